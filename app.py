@@ -1,27 +1,51 @@
+import time
+script_started = time.perf_counter() # Before the imports, so the first run reports what they cost
 import streamlit as st
-from PIL import Image
-import io
 import logging
+import statistics
 import traceback
 import streamlit.components.v1 as components
 from utils.config import (
     DEFAULT_PROVIDER,
-    DEFAULT_OPENROUTER_MODEL_ID
+    DEFAULT_OPENROUTER_MODEL_ID,
+    HEDGE_FALLBACK_MODELS,
+    HEDGE_AFTER_SECONDS,
+    METRICS_PORT,
+    STREAM_PREVIEW_REFRESH_INTERVAL,
+    JOB_POLL_INTERVAL,
+    COMPARE_MAX_MODELS,
+    ROUTER_LATENCY_BUDGET,
+    SITE_MAX_PAGES,
+    SITE_STYLESHEET_NAME
 )
 from utils.models import (
     get_available_gemini_models,
     get_available_openrouter_models,
     get_available_openai_models
 )
-from utils.generation import generate_code_from_image
+from utils.generation import is_tall_screenshot
+from utils.jobs import submit_generation, submit_comparison, submit_site, add_reused_result, get_job, get_group_jobs, cancel_job, get_job_counts
+from utils.site import inline_stylesheet, build_site_archive
+from utils.leaderboard import record_win, get_leaderboard, preferred_model
+from utils.router import route_request
+from utils.cache import get_cache_stats, clear_cache, get_cached_result
+from utils.similarity import find_similar, clear_similarity_index
+from utils.resilience import get_circuit_breaker
+from utils.metrics import record_stage, get_recent_traces, start_metrics_server, record_import, record_rerun, get_responsiveness
+from utils.preprocessing import ImageMemo, content_digest
+from utils.compaction import compress_html, compression_formats
+from utils.memory import get_memory_status
 
 # --- Basic Logging Setup ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+start_metrics_server(METRICS_PORT)
+record_import("app.py imports", time.perf_counter() - script_started) # Only the first run counts; modules stay imported
 
 # --- Configuration --- 
 st.set_page_config(layout="wide", page_title="Multimodal Website UI Cloner")
 st.title("🤖 Multimodal Website UI Cloner")
 st.caption("Input a screenshot -> Get a single HTML file clone (visual only).")
+image_memo = st.session_state.setdefault("image_memo", ImageMemo()) # Uploads are decoded once per session, not per rerun
 
 # --- Provider and API Key Selection ---
 st.sidebar.header("1. Provider & API Key")
@@ -52,6 +76,8 @@ available_models = {}
 model_id = None
 selected_model_key = None
 list_error = None
+AUTO_MODEL_OPTION = "🤖 Auto (lowest cost within a latency budget)"
+auto_route = False
 
 # Determine the correct API key to use for fetching models
 fetch_key = openai_api_key if selected_provider == "OpenAI" else \
@@ -77,8 +103,13 @@ elif available_models:
     model_options = sorted(list(available_models.keys()))
     default_index = 0
 
-    # Set Default Model Logic
-    if selected_provider == "OpenAI":
+    # Set Default Model Logic: the leaderboard's pick if this provider's models were compared, else fixed preferences
+    leaderboard_model_id = preferred_model(selected_provider, available_models.values())
+    leaderboard_key = next((k for k in model_options if available_models[k] == leaderboard_model_id), None)
+    if leaderboard_key:
+        default_index = model_options.index(leaderboard_key)
+        st.sidebar.success(f"Defaulting to {leaderboard_key} (best in your comparisons)")
+    elif selected_provider == "OpenAI":
          preferred_default_key = next((k for k in model_options if "gpt-4o" in k and "mini" not in k), None)
          if preferred_default_key:
              default_index = model_options.index(preferred_default_key)
@@ -110,25 +141,82 @@ elif available_models:
 
     selected_model_key = st.sidebar.selectbox(
         f"Choose Available {selected_provider} Model:",
-        options=model_options,
-        index=default_index,
+        options=[AUTO_MODEL_OPTION] + model_options,
+        index=default_index + 1,
         key=f"model_select_{selected_provider}",
         help="Select a model. Models with [⚠️] might have limitations (e.g., text-only)." + (" (Free only)" if selected_provider == "OpenRouter" else "")
+        + " 'Auto' picks a model for each request from the latency and error rates observed so far."
     )
-    if selected_model_key:
+    if selected_model_key == AUTO_MODEL_OPTION:
+        auto_route = True
+        latency_budget = st.sidebar.slider(
+            "Latency budget (seconds)",
+            min_value=10, max_value=300, value=int(ROUTER_LATENCY_BUDGET), step=5,
+            key="latency_budget",
+            help="Auto picks the cheapest model expected to finish within this time, or the fastest one if none is."
+        )
+        st.sidebar.info("The model is chosen when you click 'Generate Clone'.")
+    elif selected_model_key:
         model_id = available_models[selected_model_key]
         st.sidebar.info(f"Selected Model ID: `{model_id}`")
 
+compare_models = st.sidebar.checkbox(
+    "Compare several models",
+    value=False,
+    key="compare_models",
+    help="Send the same screenshot to several models at once (across providers) and show the results side by side. Results feed the local model leaderboard."
+)
+compare_targets = []
+if compare_models:
+    provider_keys = {"OpenAI": openai_api_key, "Google Gemini": google_api_key, "OpenRouter": openrouter_api_key}
+    key_inputs = {"OpenAI": ("OpenAI API Key", "openai_key"), "Google Gemini": ("Google AI Studio API Key", "google_key"), "OpenRouter": ("OpenRouter API Key", "or_key")}
+    model_fetchers = {"OpenAI": get_available_openai_models, "Google Gemini": get_available_gemini_models, "OpenRouter": get_available_openrouter_models}
+    with st.sidebar.expander("API keys for other providers"):
+        for provider in provider_options:
+            if provider != selected_provider:
+                key_label, widget_key = key_inputs[provider]
+                provider_keys[provider] = st.text_input(key_label, type="password", key=widget_key)
+    compare_options = {}
+    for provider in provider_options:
+        if not provider_keys[provider]:
+            continue
+        provider_models = available_models if provider == selected_provider else model_fetchers[provider](provider_keys[provider])[0]
+        for display_name, listed_model_id in (provider_models or {}).items():
+            compare_options[f"{provider} · {display_name}"] = (provider, listed_model_id)
+    chosen_models = st.sidebar.multiselect(
+        "Models to compare:",
+        options=sorted(compare_options),
+        default=[k for k, v in compare_options.items() if v == (selected_provider, model_id)],
+        max_selections=COMPARE_MAX_MODELS,
+        key="compare_selection"
+    )
+    compare_targets = [(provider, provider_keys[provider], target_model_id) for provider, target_model_id in (compare_options[k] for k in chosen_models)]
+
 # --- Input Method ---
 st.sidebar.header("3. Input")
 actual_api_key = openai_api_key if selected_provider == "OpenAI" else \
                  google_api_key if selected_provider == "Google Gemini" else \
                  openrouter_api_key
 
-input_disabled = not model_id or not actual_api_key
+input_disabled = not (model_id or auto_route) or not actual_api_key
 
 # input_method = st.sidebar.radio("Choose input method:", ("Website URL", "Upload Screenshot"), disabled=input_disabled, key="input_method") # Remove URL option
-uploaded_file = st.sidebar.file_uploader("Upload Screenshot:", type=["png", "jpg", "jpeg", "webp"], disabled=input_disabled, key="file_uploader")
+site_mode = st.sidebar.checkbox(
+    "Clone several pages of one site",
+    value=False,
+    key="site_mode",
+    help="Generate a shared stylesheet and component library (header, footer, buttons, cards) once, then all pages in parallel against it. Pages reuse the shared classes instead of restating them, so each costs far fewer output tokens."
+)
+uploaded_file = None
+site_files = []
+if site_mode:
+    site_files = st.sidebar.file_uploader(
+        "Upload page screenshots:", type=["png", "jpg", "jpeg", "webp"], accept_multiple_files=True,
+        disabled=input_disabled, key="site_file_uploader",
+        help=f"Up to {SITE_MAX_PAGES} pages. The shared design system is derived from the first one, so start with a page that shows the header and footer."
+    ) or []
+else:
+    uploaded_file = st.sidebar.file_uploader("Upload Screenshot:", type=["png", "jpg", "jpeg", "webp"], disabled=input_disabled, key="file_uploader")
 
 screenshot_bytes = None
 # url_input = "" # Remove URL variable
@@ -141,28 +229,135 @@ screenshot_bytes = None
 #     uploaded_file = st.sidebar.file_uploader("Upload Screenshot:", type=["png", "jpg", "jpeg", "webp"], disabled=input_disabled, key="file_uploader")
 
 
-submit_button = st.sidebar.button("Generate Clone", disabled=input_disabled, type="primary")
+def reuse_similar_result(match, label, img_bytes):
+    """Button callback: shows an earlier result for a near-identical screenshot as a finished job."""
+    html = get_cached_result(match.cache_key)
+    if html is None:
+        st.warning("That earlier result is no longer in the result cache; generate a new clone instead.")
+        return
+    job_id = add_reused_result(
+        match.provider, match.model_id, img_bytes, html, label=label,
+        reuse={"distance": match.distance, "created": match.created, "size": match.size}
+    )
+    st.session_state.setdefault("job_ids", []).append(job_id)
+    st.session_state["selected_job_id"] = job_id
 
-# --- Main Area---
-col1, col2 = st.columns(2)
+# --- Similar Earlier Screenshots (offered before anything is sent to a provider) ---
+if uploaded_file:
+    upload_bytes = uploaded_file.getvalue()
+    similar_lookups = st.session_state.setdefault("similar_lookups", {}) # Upload digest -> (matches, lookup stats)
+    upload_digest = content_digest(upload_bytes)
+    if upload_digest not in similar_lookups:
+        lookup_stats = {}
+        try:
+            similar_lookups[upload_digest] = (find_similar(upload_bytes, stats=lookup_stats), lookup_stats)
+        except Exception as e: # An unreadable upload is reported when generating
+            logging.warning(f"Similar screenshot lookup failed: {e}")
+            similar_lookups[upload_digest] = ([], lookup_stats)
+    similar_matches, lookup_stats = similar_lookups[upload_digest]
+    for match in similar_matches:
+        st.sidebar.info(
+            f"Looks like a page cloned on {time.strftime('%Y-%m-%d %H:%M', time.localtime(match.created))} "
+            f"with {match.model_id} ({match.distance} of 64 hash bits differ)."
+        )
+        st.sidebar.button(
+            "Use that result", key=f"reuse_{match.cache_key}", disabled=input_disabled,
+            on_click=reuse_similar_result, args=(match, uploaded_file.name, upload_bytes)
+        )
+    if similar_matches:
+        st.sidebar.caption(f"Found in {lookup_stats['timings']['similarity_search'] * 1000:.2f} ms; Generate Clone still makes a new one.")
 
-with col1:
-    st.subheader("Input Image")
-    input_image_placeholder = st.empty()
-    input_image_placeholder.info("Provide a screenshot and click 'Generate'.")
+submit_button = st.sidebar.button("Generate Clone", disabled=input_disabled, type="primary")
 
-with col2:
-    st.subheader("Generated HTML Output")
-    output_placeholder = st.empty()
-    output_placeholder.info("Generated HTML preview and download link will appear here.")
+# --- Options ---
+st.sidebar.header("4. Options")
+use_cache = st.sidebar.checkbox(
+    "Use result cache",
+    value=True,
+    key="use_cache",
+    help="Reuse a previous result when the same screenshot, provider, model and prompt were already generated. Uncheck to force a fresh generation."
+)
+optimize_image = st.sidebar.checkbox(
+    "Optimize image before sending",
+    value=True,
+    key="preprocess_image",
+    help="Downscale the screenshot to the resolution the provider actually uses, strip metadata and re-encode it to the smallest suitable format."
+)
+stream_output = st.sidebar.checkbox(
+    "Stream output live",
+    value=True,
+    key="stream_output",
+    help="Show the HTML code and a live preview while the model is still writing it, with the option to stop early."
+)
+tile_tall_pages = st.sidebar.checkbox(
+    "Split tall screenshots into sections",
+    value=True,
+    key="tile_tall_pages",
+    help="Full-page captures much taller than they are wide are cut into sections that are generated in parallel and stitched together. Live streaming is not used for these."
+)
+compact_layout = st.sidebar.checkbox(
+    "Compact layout mode (faster)",
+    value=False,
+    key="compact_layout",
+    help="Have the model describe the page as a compact layout tree that is rendered to HTML locally. Several times fewer output tokens, so faster and cheaper, at some cost in fidelity. Live streaming and section splitting are not used."
+)
+incremental_updates = st.sidebar.checkbox(
+    "Incremental updates",
+    value=False,
+    key="incremental_updates",
+    help="Generate the page in sections and, for an updated screenshot of the same page, only regenerate the sections whose pixels changed since the previous generation."
+)
+incremental_project = ""
+if incremental_updates:
+    incremental_project = st.sidebar.text_input(
+        "Project name (optional)",
+        key="incremental_project",
+        help="Keep the previous version on disk under this name, so updates also work across sessions. Leave empty to compare with the previous generation in this session."
+    ).strip()
+hedge_fallback_model = HEDGE_FALLBACK_MODELS.get(selected_provider)
+hedge_model = None
+if hedge_fallback_model:
+    use_hedge = st.sidebar.checkbox(
+        f"Hedge slow requests with {hedge_fallback_model}",
+        value=False,
+        key=f"use_hedge_{selected_provider}",
+        help=f"If the selected model has not answered after {HEDGE_AFTER_SECONDS}s, also send the request to {hedge_fallback_model} and use whichever finishes first. May incur the cost of both calls. Not used while streaming."
+    )
+    hedge_model = hedge_fallback_model if use_hedge else None
+provider_circuit_state = get_circuit_breaker(selected_provider, actual_api_key).state()
+if provider_circuit_state != "closed":
+    st.sidebar.warning(f"{selected_provider} is failing repeatedly; requests are paused briefly (circuit {provider_circuit_state}).")
+cache_stats = get_cache_stats()
+st.sidebar.caption(
+    f"Cache: {cache_stats['entries']} entries ({cache_stats['bytes'] / 1024:.0f} KB), "
+    f"{cache_stats['hits']} hits / {cache_stats['misses']} misses this process."
+)
+job_counts = get_job_counts()
+if job_counts.get("running") or job_counts.get("queued"):
+    st.sidebar.caption(f"Background jobs (all sessions): {job_counts.get('running', 0)} running, {job_counts.get('queued', 0)} queued.")
+if st.sidebar.button("Clear Cache", key="clear_cache"):
+    clear_cache()
+    clear_similarity_index()
+    st.session_state.pop("similar_lookups", None)
+    st.sidebar.success("Result cache cleared.")
+show_performance = st.sidebar.checkbox(
+    "Show performance panel",
+    value=False,
+    key="show_performance",
+    help="List per-stage timings, token usage and payload sizes for recent generations in this process."
+)
+
+def current_incremental_baseline():
+    """Returns the PageSnapshot of this session's latest incremental generation, or None."""
+    job = get_job(st.session_state.get("incremental_job_id"))
+    if job is not None and job.snapshot is not None:
+        st.session_state["incremental_snapshot"] = job.snapshot # Outlives the job in the store
+    return st.session_state.get("incremental_snapshot")
 
+# --- Submit (runs in the background so reruns never lose a generation) ---
 if submit_button:
     img_bytes = None
-    error_msg = None
-    input_image_placeholder.empty()
-    output_placeholder.empty()
-
-    with st.spinner("Processing input..."):
+    try:
         # if input_method == "Website URL":
         #     if url_input:
         #         logging.info(f"Taking screenshot for URL: {url_input}")
@@ -173,55 +368,473 @@ if submit_button:
         #             st.error("Screenshot failed: No image data received.")
         #     else:
         #         st.warning("Please enter a Website URL.")
-        if uploaded_file:
+        site_pages = []
+        if site_mode:
+            if len(site_files) > SITE_MAX_PAGES:
+                st.warning(f"Only the first {SITE_MAX_PAGES} pages are generated.")
+            site_pages = [(site_file.name, site_file.getvalue()) for site_file in site_files[:SITE_MAX_PAGES]]
+            if not site_pages:
+                st.warning("Please upload the screenshots of the site's pages.")
+        elif uploaded_file:
             logging.info(f"Reading uploaded file: {uploaded_file.name}")
             img_bytes = uploaded_file.getvalue()
         else:
             st.warning("Please upload a screenshot file.")
 
-    if img_bytes:
-        try:
-            # Display the input image
-            img_pil = Image.open(io.BytesIO(img_bytes))
-            with col1:
-                st.image(img_pil, caption="Input Screenshot", use_container_width=True)
-
-            # Generate Code
-            with st.spinner(f"Generating HTML with {selected_provider} ({model_id})... This may take a minute or two."):
-                generated_html, gen_error = generate_code_from_image(
-                    provider=selected_provider,
-                    api_key=actual_api_key,
-                    model_id_to_use=model_id,
-                    img_bytes=img_bytes
+        if site_pages:
+            route_decision = None
+            if auto_route: # Routed on the page the design system is derived from
+                route_decision = route_request(
+                    selected_provider, [v for k, v in available_models.items() if "[⚠️" not in k] or available_models.values(),
+                    site_pages[0][1], latency_budget
                 )
+                model_id = route_decision.model_id if route_decision else None
+            job_id = submit_site(
+                selected_provider, actual_api_key, model_id, site_pages,
+                label=f"{len(site_pages)}-page site", use_cache=use_cache, preprocess=optimize_image, hedge_model=hedge_model
+            )
+            if route_decision:
+                st.session_state.setdefault("route_decisions", {})[job_id] = route_decision
+            st.session_state.setdefault("job_ids", []).append(job_id)
+            st.session_state["selected_job_id"] = job_id
+        elif img_bytes and compare_models and len(compare_targets) > 1:
+            _, comparison_job_ids = submit_comparison(
+                compare_targets, img_bytes, label=uploaded_file.name, use_cache=use_cache, preprocess=optimize_image
+            )
+            st.session_state.setdefault("job_ids", []).extend(comparison_job_ids)
+            st.session_state["selected_job_id"] = comparison_job_ids[0]
+        elif img_bytes:
+            if compare_models:
+                st.warning("Select at least two models to compare; generating with the selected model only.")
+            route_decision = None
+            if auto_route:
+                route_decision = route_request(
+                    selected_provider, [v for k, v in available_models.items() if "[⚠️" not in k] or available_models.values(),
+                    img_bytes, latency_budget
+                )
+                model_id = route_decision.model_id if route_decision else None
+            if incremental_updates:
+                generation_mode = "incremental"
+            elif compact_layout:
+                generation_mode = "layout"
+            elif tile_tall_pages and is_tall_screenshot(img_bytes):
+                generation_mode = "tiled"
+            elif stream_output:
+                generation_mode = "stream"
+            else:
+                generation_mode = "blocking"
+            job_id = submit_generation(
+                mode=generation_mode,
+                provider=selected_provider,
+                api_key=actual_api_key,
+                model_id=model_id,
+                img_bytes=img_bytes,
+                label=uploaded_file.name,
+                use_cache=use_cache,
+                preprocess=optimize_image,
+                hedge_model=hedge_model,
+                previous_snapshot=current_incremental_baseline() if incremental_updates and not incremental_project else None,
+                project=incremental_project or None
+            )
+            if generation_mode == "incremental" and not incremental_project:
+                st.session_state["incremental_job_id"] = job_id
+            if route_decision:
+                st.session_state.setdefault("route_decisions", {})[job_id] = route_decision
+            st.session_state.setdefault("job_ids", []).append(job_id)
+            st.session_state["selected_job_id"] = job_id
+    except Exception as e:
+        st.error(f"An unexpected error occurred in the main process: {e}\n{traceback.format_exc()}")
+        logging.error(f"Main process error: {e}\n{traceback.format_exc()}")
+
+# --- Main Area---
+DOWNLOAD_ENCODINGS = compression_formats() # gzip, plus brotli if the package is installed
+COMPRESSED_DOWNLOAD_TYPES = {"gzip": ("gz", "application/gzip"), "brotli": ("br", "application/x-brotli")}
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def compressed_download(job_id, _html, encoding):
+    """Compresses a finished job's HTML; keyed by job ID so the document itself is never hashed."""
+    return compress_html(_html, encoding)
 
-            # Display Output or Error
-            with col2:
-                if gen_error:
-                    st.error(f"Code Generation Error: {gen_error}")
-                elif generated_html:
-                    st.success("HTML generation complete!")
+JOB_STATUS_LABELS = {"queued": "⏳ queued", "running": "⚙️ running", "done": "✅ done", "error": "❌ failed", "cancelled": "⏹️ stopped"}
 
-                    # Display HTML Preview
-                    st.subheader("Preview")
-                    components.html(generated_html, height=600, scrolling=True)
+def describe_job(job):
+    # Kept free of the status: a changing label would reset the selectbox on every poll.
+    kind = " · comparison" if job.group else ""
+    return f"{job.label or job.id} · {job.model_id}{kind} · {time.strftime('%H:%M:%S', time.localtime(job.created_at))}"
 
-                    # Provide Download Button
-                    st.subheader("Download")
+def pick_comparison_winner(group_id, job):
+    record_win(job.provider, job.model_id)
+    st.session_state[f"comparison_winner_{group_id}"] = job.id
+
+def render_comparison(group_id):
+    """Shows every model of a comparison side by side, each as soon as it finishes."""
+    jobs = get_group_jobs(group_id)
+    finished = [job for job in jobs if job.finished]
+    wall_time = max((job.finished_at or time.time()) for job in jobs) - min(job.created_at for job in jobs)
+    st.subheader(f"Model Comparison ({len(finished)}/{len(jobs)} finished)")
+    st.caption(
+        f"Wall time {wall_time:.1f}s; the same runs one after another would take {sum(job.elapsed() for job in jobs):.1f}s."
+    )
+    if jobs[0].image:
+        with st.expander("Input Screenshot"):
+            st.image(image_memo.thumbnail(jobs[0].image), caption=jobs[0].label or None, use_container_width=True)
+    winner_id = st.session_state.get(f"comparison_winner_{group_id}")
+    for row_start in range(0, len(jobs), 3):
+        row_jobs = jobs[row_start:row_start + 3]
+        for column, job in zip(st.columns(len(row_jobs)), row_jobs):
+            with column:
+                st.markdown(f"**{job.model_id}**  \n{job.provider}")
+                if not job.finished:
+                    st.info(f"{JOB_STATUS_LABELS[job.status]} {job.elapsed():.0f}s")
+                elif job.error or not job.html:
+                    st.error(job.error or "No HTML content received.")
+                else:
+                    stats = job.stats
+                    tokens = f"{stats['prompt_tokens']} + {stats['completion_tokens']} tokens" if stats.get("completion_tokens") else "tokens n/a"
+                    cached = " (cached)" if stats.get("cache_hit") else ""
+                    st.caption(f"{job.elapsed():.1f}s{cached} · {tokens} · {len(job.html.encode('utf-8')) / 1024:.1f} KB")
+                    components.html(job.html, height=400, scrolling=True)
+                    if winner_id == job.id:
+                        st.success("Picked as the best clone.")
+                    else:
+                        st.button(
+                            "Pick as best", key=f"pick_{job.id}", disabled=winner_id is not None,
+                            on_click=pick_comparison_winner, args=(group_id, job)
+                        )
                     st.download_button(
-                        label="Download HTML File",
-                        data=generated_html,
-                        file_name="generated_clone.html",
+                        label="Download HTML",
+                        data=job.html,
+                        file_name=f"{(job.label.rsplit('.', 1)[0] if job.label else 'generated')}_{job.model_id.split('/')[-1]}_clone.html",
                         mime="text/html",
+                        key=f"download_{job.id}"
                     )
-                else:
-                    st.error("Code generation failed: No HTML content received.")
 
-        except Exception as e:
-            st.error(f"An unexpected error occurred in the main process: {e}\n{traceback.format_exc()}")
-            logging.error(f"Main process error: {e}\n{traceback.format_exc()}")
-    elif not error_msg:
-        st.warning("Could not proceed without a valid input image.")
+def render_job_input(job):
+    st.subheader("Input Image")
+    if job.image:
+        st.image(image_memo.thumbnail(job.image), caption=f"Input Screenshot ({job.label})" if job.label else "Input Screenshot", use_container_width=True)
+    stats = job.stats
+    route_decision = st.session_state.get("route_decisions", {}).get(job.id)
+    if route_decision:
+        st.caption(
+            f"Auto-routed to {route_decision.model_id}: {route_decision.reason} "
+            f"(expected ~{route_decision.estimated_latency_s:.0f}s, ~${route_decision.estimated_cost_usd:.4f})."
+        )
+    site_stats = stats.get("site")
+    if site_stats and job.finished:
+        st.caption(
+            f"Shared design system ({site_stats['shared_css_bytes'] / 1024:.1f} KB of CSS; components: "
+            f"{', '.join(site_stats['components']) or 'none'}) generated in {site_stats['design']['latency_s']:.1f}s, "
+            f"then {site_stats['pages']} pages in parallel ({stats.get('provider_latency_s', 0.0):.1f}s in total). Shown above: the first page."
+        )
+    tiling_stats = stats.get("tiling")
+    if tiling_stats and job.finished:
+        st.caption(f"Generated as {len(tiling_stats['bands'])} sections in parallel ({stats.get('provider_latency_s', 0.0):.1f}s).")
+    layout_stats = stats.get("layout")
+    if layout_stats and job.finished:
+        st.caption(
+            f"Rendered locally from a {layout_stats['nodes']}-node layout tree "
+            f"({layout_stats['json_bytes'] / 1024:.1f} KB of JSON -> {layout_stats['html_bytes'] / 1024:.1f} KB of HTML)."
+        )
+    incremental_stats = stats.get("incremental")
+    if incremental_stats and job.finished:
+        if incremental_stats["mode"] == "unchanged":
+            st.caption("Screenshot unchanged since the previous version; its HTML was reused.")
+        elif incremental_stats["mode"] == "partial":
+            st.caption(
+                f"Regenerated {len(incremental_stats['regenerated'])} of {incremental_stats['sections']} sections "
+                f"({incremental_stats['regenerated']}) and reused the rest ({stats.get('provider_latency_s', 0.0):.1f}s)."
+            )
+        else:
+            st.caption(f"Generated all {incremental_stats['sections']} sections ({incremental_stats['reason']}).")
+    prep_stats = stats.get("preprocessing")
+    if prep_stats and prep_stats.get("final_size"):
+        st.caption(
+            f"Sent {prep_stats['final_size'][0]}x{prep_stats['final_size'][1]} {prep_stats['final_format']} "
+            f"({prep_stats['final_bytes'] / 1024:.0f} KB, {prep_stats['bytes_saved'] / 1024:.0f} KB saved, "
+            f"~{prep_stats['estimated_tokens_saved']} image tokens saved)."
+        )
+    reuse_stats = stats.get("similar_reuse")
+    if reuse_stats:
+        st.caption(
+            f"Reused the result of a similar screenshot ({reuse_stats['size'][0]}x{reuse_stats['size'][1]}, "
+            f"{reuse_stats['distance']} of 64 hash bits differ) cloned on "
+            f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(reuse_stats['created']))}; nothing was sent to {job.provider}."
+        )
+    compaction_stats = stats.get("compaction")
+    if compaction_stats and job.finished:
+        st.caption(
+            f"Output compacted from {compaction_stats['input_bytes'] / 1024:.1f} KB to {compaction_stats['output_bytes'] / 1024:.1f} KB "
+            f"({compaction_stats['saved_percent']}% smaller; {compaction_stats['hoisted_attributes']} inline styles moved into "
+            f"{compaction_stats['hoisted_styles']} classes, {compaction_stats['duplicate_rules']} duplicate CSS rules dropped)."
+        )
+    if stats.get("attempts", 1) > 1:
+        st.caption(f"Succeeded after {stats['attempts']} attempts ({stats.get('retry_wait_s', 0.0):.1f}s spent backing off).")
+    if stats.get("continuations"):
+        st.caption(f"Output hit the model's length limit; completed with {stats['continuations']} continuation request(s).")
+    if stats.get("hedged_to"):
+        st.caption(f"Answered by fallback model {stats['hedged_to']} (primary was slower than {HEDGE_AFTER_SECONDS}s).")
+
+def render_job_output(job):
+    st.subheader("Generated HTML Output")
+    if not job.finished:
+        if job.status == "queued":
+            st.info(f"Queued: waiting for a free worker to run {job.provider} ({job.model_id})...")
+        elif job.mode == "site":
+            st.info(f"Generating the shared design system, then every page in parallel, with {job.provider} ({job.model_id})... {job.elapsed():.0f}s")
+        elif job.mode == "layout":
+            st.info(f"Generating a layout tree with {job.provider} ({job.model_id})... {job.elapsed():.0f}s")
+        elif job.mode in ("tiled", "incremental"):
+            st.info(f"Generating HTML section by section with {job.provider} ({job.model_id})... {job.elapsed():.0f}s")
+        elif job.mode == "stream":
+            st.info(f"Streaming HTML from {job.provider} ({job.model_id})... {job.elapsed():.0f}s")
+        else:
+            st.info(f"Generating HTML with {job.provider} ({job.model_id})... This may take a minute or two. {job.elapsed():.0f}s")
+        if job.cancellable:
+            st.button("Stop Generation", key=f"stop_{job.id}", on_click=cancel_job, args=(job.id,))
+        partial_html = job.partial_html()
+        if partial_html:
+            # Re-render the preview only every few seconds; an unchanged element is not reloaded.
+            preview_key = f"live_preview_{job.id}"
+            shown_at, shown_html = st.session_state.get(preview_key, (0.0, ""))
+            if time.monotonic() - shown_at >= STREAM_PREVIEW_REFRESH_INTERVAL:
+                shown_at, shown_html = time.monotonic(), partial_html
+                st.session_state[preview_key] = (shown_at, shown_html)
+            components.html(shown_html, height=600, scrolling=True)
+            st.code(partial_html, language="html")
+        return
+
+    st.session_state.pop(f"live_preview_{job.id}", None)
+    if job.status == "cancelled":
+        st.warning("Generation stopped. Adjust your settings and click 'Generate Clone' to try again.")
+    elif job.error:
+        st.error(f"Code Generation Error: {job.error}")
+    elif job.site is not None:
+        render_site_output(job)
+    elif job.html:
+        if job.stats.get("truncated"):
+            st.warning("The model's output was still cut off after continuing it, so the clone may be missing its end.")
+        st.success(f"HTML generation complete! ({job.elapsed():.1f}s)")
+
+        # Display HTML Preview
+        st.subheader("Preview")
+        render_started = time.perf_counter()
+        components.html(job.html, height=600, scrolling=True)
+        # Only the server-side hand-off is measurable; the browser renders the iframe afterwards.
+        recorded_key = f"preview_recorded_{job.id}"
+        if not st.session_state.get(recorded_key):
+            record_stage(job.stats.get("trace_id"), "preview_render", time.perf_counter() - render_started)
+            st.session_state[recorded_key] = True
+        with st.expander("HTML Code"):
+            st.code(job.html, language="html")
+
+        # Provide Download Button
+        st.subheader("Download")
+        file_name = f"{(job.label.rsplit('.', 1)[0] if job.label else 'generated')}_clone.html"
+        download_columns = st.columns(1 + len(DOWNLOAD_ENCODINGS))
+        with download_columns[0]:
+            st.download_button(
+                label="Download HTML File",
+                data=job.html,
+                file_name=file_name,
+                mime="text/html",
+                key=f"download_{job.id}"
+            )
+        for column, encoding in zip(download_columns[1:], DOWNLOAD_ENCODINGS):
+            extension, mime = COMPRESSED_DOWNLOAD_TYPES[encoding]
+            with column:
+                st.download_button(
+                    label=f"Download {encoding}",
+                    data=compressed_download(job.id, job.html, encoding), # Compressed once per job, not on every rerun
+                    file_name=f"{file_name}.{extension}",
+                    mime=mime,
+                    key=f"download_{encoding}_{job.id}"
+                )
+    else:
+        st.error("Code generation failed: No HTML content received.")
+
+def render_site_output(job):
+    """Shows the pages of a site job with per-call costs, and offers the bundle and single-file downloads."""
+    bundle = job.site
+    site_stats = job.stats["site"]
+    st.success(f"Site generated: {site_stats['pages'] - site_stats['failed']} of {site_stats['pages']} pages ({job.elapsed():.1f}s).")
+    design_stats = site_stats["design"]
+    rows = [{
+        "file": f"{SITE_STYLESHEET_NAME} + components",
+        "latency (s)": round(design_stats["latency_s"], 1),
+        "prompt tokens": design_stats["prompt_tokens"],
+        "completion tokens": design_stats["completion_tokens"],
+        "output (KB)": round(site_stats["shared_css_bytes"] / 1024, 1),
+        "status": "cached" if design_stats["cache_hit"] else "ok",
+    }]
+    for page in bundle.pages:
+        rows.append({
+            "file": page.name,
+            "latency (s)": round(page.stats.get("provider_latency_s", 0.0), 1),
+            "prompt tokens": page.stats.get("prompt_tokens"),
+            "completion tokens": page.stats.get("completion_tokens"),
+            "output (KB)": round(len(page.html.encode("utf-8")) / 1024, 1) if page.html else None,
+            "status": page.error or ("cached" if page.stats.get("cache_hit") else "ok"),
+        })
+    st.dataframe(rows, use_container_width=True)
+
+    pages = [page for page in bundle.pages if page.html]
+    page_name = st.selectbox("Page", [page.name for page in pages], key=f"site_page_{job.id}")
+    page = next(page for page in pages if page.name == page_name)
+    single_file_html = inline_stylesheet(page.html, bundle.design.css)
+    st.subheader("Preview")
+    components.html(single_file_html, height=600, scrolling=True)
+    with st.expander("HTML Code"):
+        st.code(page.html, language="html")
+    with st.expander(f"Shared stylesheet ({SITE_STYLESHEET_NAME})"):
+        st.code(bundle.design.css, language="css")
+
+    st.subheader("Download")
+    st.download_button(
+        label="Download site bundle (.zip)",
+        data=build_site_archive(bundle),
+        file_name="site_clone.zip",
+        mime="application/zip",
+        key=f"download_bundle_{job.id}",
+        help=f"{SITE_STYLESHEET_NAME}, the component library and one HTML file per page linking the shared stylesheet."
+    )
+    st.download_button(
+        label="Download single-file pages (.zip)",
+        data=build_site_archive(bundle, inline=True),
+        file_name="site_clone_single_file.zip",
+        mime="application/zip",
+        key=f"download_inline_{job.id}",
+        help="Every page as a self-contained HTML file with the shared stylesheet inlined."
+    )
+    st.download_button(
+        label=f"Download {page.name} (single file)",
+        data=single_file_html,
+        file_name=page.name,
+        mime="text/html",
+        key=f"download_page_{job.id}"
+    )
+
+def render_main_area(polling):
+    """Shows this session's jobs. Reruns on its own every JOB_POLL_INTERVAL while any job is unfinished."""
+    fragment_started = time.perf_counter()
+    try:
+        render_session_jobs(polling)
+    finally:
+        record_rerun(time.perf_counter() - fragment_started, scope="fragment")
+
+def render_session_jobs(polling):
+    job_ids = st.session_state.get("job_ids", [])
+    session_jobs = [job for job in (get_job(job_id) for job_id in job_ids) if job is not None]
+    if len(session_jobs) < len(job_ids):
+        st.session_state["job_ids"] = [job.id for job in session_jobs] # Evicted from the result store
+    active = [job for job in session_jobs if not job.finished]
+    if polling and not active:
+        st.rerun() # Everything finished: one full rerun turns polling off
+
+    if len(session_jobs) > 1:
+        jobs_by_id = {job.id: job for job in session_jobs}
+        if st.session_state.get("selected_job_id") not in jobs_by_id:
+            st.session_state["selected_job_id"] = session_jobs[-1].id
+        st.selectbox(
+            "Generations this session",
+            options=[job.id for job in reversed(session_jobs)],
+            format_func=lambda job_id: describe_job(jobs_by_id[job_id]),
+            key="selected_job_id"
+        )
+        st.caption(" · ".join(f"{job.label or job.id}: {JOB_STATUS_LABELS[job.status]}" for job in reversed(session_jobs)))
+    selected_job = get_job(st.session_state.get("selected_job_id")) if session_jobs else None
+    if selected_job is None and session_jobs:
+        selected_job = session_jobs[-1]
+
+    if selected_job is not None and selected_job.group:
+        render_comparison(selected_job.group)
+        return
+    col1, col2 = st.columns(2)
+    if selected_job is None:
+        with col1:
+            st.subheader("Input Image")
+            st.info("Provide a screenshot and click 'Generate'.")
+        with col2:
+            st.subheader("Generated HTML Output")
+            st.info("Generated HTML preview and download link will appear here.")
+        return
+    with col1:
+        render_job_input(selected_job)
+    with col2:
+        render_job_output(selected_job)
+
+session_polling = any(
+    job is not None and not job.finished for job in (get_job(job_id) for job_id in st.session_state.get("job_ids", []))
+)
+st.fragment(render_main_area, run_every=JOB_POLL_INTERVAL if session_polling else None)(session_polling)
+
+# --- Performance Panel ---
+if show_performance:
+    recent_traces = get_recent_traces(10)
+    with st.expander("Performance (recent generations)", expanded=True):
+        if not recent_traces:
+            st.info("No generations recorded in this process yet.")
+        else:
+            st.dataframe([
+                {
+                    "time": trace["time"],
+                    "kind": trace["kind"],
+                    "provider": trace["provider"],
+                    "model": trace["model"],
+                    "status": trace["status"],
+                    "first token (s)": trace["time_to_first_token_s"],
+                    "provider (s)": trace["provider_latency_s"],
+                    "prompt tokens": trace["prompt_tokens"],
+                    "completion tokens": trace["completion_tokens"],
+                    "sent (KB)": round((trace["request_bytes"] or 0) / 1024, 1),
+                    "output (KB)": round(trace["output_bytes"] / 1024, 1),
+                    "peak RSS (MB)": round(trace["peak_rss_bytes"] / 2**20) if trace.get("peak_rss_bytes") else None,
+                    "memory wait (s)": trace.get("memory_wait_s"),
+                    **{f"{stage} (ms)": round(seconds * 1000, 1) for stage, seconds in trace["timings"].items()},
+                }
+                for trace in recent_traces
+            ], use_container_width=True)
+            st.caption("Traces are also appended to the JSONL trace log and exported in Prometheus format; see the README.")
+        memory = get_memory_status()
+        if memory["limit_bytes"] > 0:
+            st.caption(
+                f"Memory budget: {memory['reserved_bytes'] / 2**20:.0f} of {memory['limit_bytes'] / 2**20:.0f} MB reserved, "
+                f"{memory['waiting']} generation(s) waiting"
+                + (f"; process RSS {memory['rss_bytes'] / 2**20:.0f} MB." if memory["rss_bytes"] else ".")
+            )
+        responsiveness = get_responsiveness()
+        if responsiveness["imports"]:
+            st.caption("First imports: " + ", ".join(
+                f"{module} {seconds:.2f}s" for module, seconds in responsiveness["imports"].items()
+            ) + ". Provider SDKs are only imported once a provider is used.")
+        run_summaries = [
+            f"{label} median {statistics.median(runs) * 1000:.0f} ms over the last {len(runs)}"
+            for label, runs in (("script reruns", responsiveness["reruns"].get("script")), ("job view refreshes", responsiveness["reruns"].get("fragment")))
+            if runs
+        ]
+        if run_summaries:
+            st.caption("Interaction latency: " + "; ".join(run_summaries) + ".")
+
+# --- Model Leaderboard ---
+leaderboard_rows = get_leaderboard()
+if leaderboard_rows:
+    with st.expander("Model leaderboard (from your comparisons)"):
+        st.dataframe([
+            {
+                "provider": row["provider"],
+                "model": row["model"],
+                "comparisons": row["runs"],
+                "picked as best": row["wins"],
+                "success rate": f"{row['success_rate']:.0%}",
+                "median latency (s)": row["median_latency_s"],
+                "completion tokens": row["mean_completion_tokens"],
+                "output (KB)": row["mean_output_kb"],
+            }
+            for row in leaderboard_rows
+        ], use_container_width=True)
+        st.caption("Ranked by how often a model's clone was picked as best, then reliability and latency. The top model of each provider is preselected in the sidebar.")
+
+record_rerun(time.perf_counter() - script_started)
 
 # --- Footer/Instructions --- # Remove this section
 # st.sidebar.markdown("---")
@@ -0,0 +1,179 @@
+"""Headless batch entry point: clone a folder (or manifest) of screenshots into HTML files.
+
+Examples:
+    python batch.py screenshots/ --provider openai --model gpt-4o --output-dir clones/
+    python batch.py manifest.jsonl --provider gemini --model models/gemini-1.5-pro --concurrency 8 --rpm 30
+
+Rerunning with the same --output-dir skips items already recorded as successful in results.jsonl.
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils.config import (
+    PROVIDER_ALIASES,
+    PROVIDER_API_KEY_ENV_VARS,
+    PROVIDER_REQUESTS_PER_MINUTE,
+    BATCH_DEFAULT_CONCURRENCY,
+    SUPPORTED_IMAGE_EXTENSIONS
+)
+from utils.generation import generate_code_from_image
+from utils.resilience import get_provider_rate_limiter
+
+RESULTS_LOG_NAME = "results.jsonl"
+
+def _output_name(item_id):
+    """Turns an item ID (usually a relative path) into a flat, filesystem-safe HTML file name.
+
+    The image extension is kept ("a.png" -> "a.png.html"), so a.png and a.jpg do not share a file.
+    """
+    return (re.sub(r"[^A-Za-z0-9._-]+", "__", item_id).strip("_") or "item") + ".html"
+
+def assign_output_names(items, taken=()):
+    """Sets item["output"] to a file name no other item (or name in `taken`) uses.
+
+    Different IDs can still flatten to the same name ("a/b.png" and "a__b.png"); later ones get a
+    numeric suffix. Names are compared case-insensitively, as on macOS and Windows file systems.
+    """
+    used = {name.lower() for name in taken}
+    for item in items:
+        name = _output_name(item["id"])
+        stem, suffix = name[:-len(".html")], 2
+        while name.lower() in used:
+            name, suffix = f"{stem}-{suffix}.html", suffix + 1
+        used.add(name.lower())
+        item["output"] = name
+
+def load_items(source):
+    """Returns a list of {"id", "image"} dicts from a folder, a JSONL manifest or a text file of paths."""
+    items = []
+    if os.path.isdir(source):
+        for root, _, files in os.walk(source):
+            for name in sorted(files):
+                if name.lower().endswith(SUPPORTED_IMAGE_EXTENSIONS):
+                    path = os.path.join(root, name)
+                    items.append({"id": os.path.relpath(path, source), "image": path})
+    else:
+        base_dir = os.path.dirname(os.path.abspath(source))
+        with open(source, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                entry = json.loads(line) if source.endswith(".jsonl") else {"image": line}
+                path = entry["image"]
+                if not os.path.isabs(path):
+                    path = os.path.join(base_dir, path)
+                items.append({"id": entry.get("id") or entry["image"], "image": path})
+    items.sort(key=lambda item: item["id"])
+    return items
+
+def load_completed(log_path, output_dir):
+    """Returns {id: output file name} of the items already recorded as successful whose HTML file still exists."""
+    completed = {}
+    if not os.path.exists(log_path):
+        return completed
+    with open(log_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue # A line cut short by an interrupted run
+            if record.get("status") == "ok" and os.path.exists(os.path.join(output_dir, record.get("output", ""))):
+                completed[record["id"]] = record["output"]
+    return completed
+
+def process_item(item, provider, api_key, model_id, output_dir, limiter, use_cache, preprocess):
+    """Generates one clone and writes its HTML file. Returns the result record."""
+    record = {"id": item["id"], "image": item["image"], "provider": provider, "model": model_id}
+    try:
+        with open(item["image"], "rb") as f:
+            img_bytes = f.read()
+    except OSError as e:
+        record.update(status="error", error=f"Could not read image: {e}", latency_s=0.0, output_bytes=0)
+        return record
+
+    # latency_s covers the provider call only; time queued behind the rate limiter is reported separately.
+    stats = {}
+    generated_html, error_message = generate_code_from_image(
+        provider, api_key, model_id, img_bytes,
+        use_cache=use_cache, preprocess=preprocess, stats=stats, rate_limiter=limiter
+    )
+    record["latency_s"] = round(stats.get("provider_latency_s", 0.0), 3)
+    record["rate_limit_wait_s"] = round(stats.get("rate_limit_wait_s", 0.0), 3)
+    record["cache_hit"] = bool(stats.get("cache_hit"))
+    if error_message or not generated_html:
+        record.update(status="error", error=error_message or "No HTML content received.", output_bytes=0)
+        return record
+
+    output_name = item["output"]
+    output_path = os.path.join(output_dir, output_name)
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(generated_html)
+    os.replace(tmp_path, output_path)
+    record.update(status="ok", output=output_name, output_bytes=len(generated_html.encode("utf-8")))
+    return record
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Clone a folder or manifest of screenshots into HTML files.")
+    parser.add_argument("source", help="Folder of screenshots, a JSONL manifest ({\"image\": path, \"id\": optional}) or a text file with one path per line.")
+    parser.add_argument("--provider", required=True, choices=sorted(PROVIDER_ALIASES), help="LLM provider.")
+    parser.add_argument("--model", required=True, help="Model ID, e.g. gpt-4o or models/gemini-1.5-pro.")
+    parser.add_argument("--api-key", help="API key. Defaults to the provider's environment variable (e.g. OPENAI_API_KEY).")
+    parser.add_argument("--output-dir", default="clones", help="Where HTML files and results.jsonl are written.")
+    parser.add_argument("--concurrency", type=int, default=BATCH_DEFAULT_CONCURRENCY, help="Number of requests in flight.")
+    parser.add_argument("--rpm", type=float, help="Requests per minute for the provider. Defaults to a per-provider limit from utils/config.py.")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the result cache.")
+    parser.add_argument("--no-preprocess", action="store_true", help="Send images as-is instead of downscaling/re-encoding them.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    provider = PROVIDER_ALIASES[args.provider]
+    api_key = args.api_key or os.environ.get(PROVIDER_API_KEY_ENV_VARS[provider])
+    if not api_key:
+        parser.error(f"No API key given. Pass --api-key or set {PROVIDER_API_KEY_ENV_VARS[provider]}.")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    log_path = os.path.join(args.output_dir, RESULTS_LOG_NAME)
+    items = load_items(args.source)
+    completed = load_completed(log_path, args.output_dir)
+    pending = [item for item in items if item["id"] not in completed]
+    assign_output_names(pending, taken=completed.values()) # Never over an earlier run's output
+    logging.info(f"{len(items)} items found, {len(items) - len(pending)} already done, {len(pending)} to process.")
+    if not pending:
+        return 0
+
+    rpm = args.rpm or PROVIDER_REQUESTS_PER_MINUTE[provider]
+    limiter = get_provider_rate_limiter(provider, rpm)
+    counts = {"ok": 0, "error": 0}
+    started = time.monotonic()
+
+    with open(log_path, "a", encoding="utf-8") as log_file, ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as pool:
+        futures = [
+            pool.submit(process_item, item, provider, api_key, args.model, args.output_dir, limiter, not args.no_cache, not args.no_preprocess)
+            for item in pending
+        ]
+        for future in as_completed(futures):
+            record = future.result()
+            record["finished_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+            log_file.write(json.dumps(record) + "\n")
+            log_file.flush()
+            counts[record["status"]] += 1
+            done = counts["ok"] + counts["error"]
+            logging.info(f"[{done}/{len(pending)}] {record['id']}: {record['status']} ({record['latency_s']}s)")
+
+    elapsed = time.monotonic() - started
+    logging.info(
+        f"Finished {len(pending)} items in {elapsed:.1f}s ({len(pending) / elapsed * 60:.1f}/min): "
+        f"{counts['ok']} ok, {counts['error']} failed. Results: {log_path}"
+    )
+    return 1 if counts["error"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
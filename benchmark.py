@@ -0,0 +1,383 @@
+"""Offline benchmark suite: measures the generation pipeline against a local OpenAI-compatible stub.
+
+No API key or network is needed; requests go to utils/stub_server.py through the OpenAI base-URL
+override. Results are written as JSON so they can be compared across releases. The run exits with
+status 1 if the stub received a different number of requests than the client recorded attempts.
+
+Examples:
+    python benchmark.py --output bench.json
+    python benchmark.py --suites latency,concurrency --requests 100 --latency 0.2 --error-rate 0.05
+    python benchmark.py --suites latency --record cassette.jsonl --api-key $OPENAI_API_KEY   # real API, saved
+    python benchmark.py --suites latency,streaming --replay cassette.jsonl                   # offline replay
+"""
+import argparse
+import base64
+import io
+import json
+import logging
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageDraw
+from utils.config import (
+    PROVIDER_BASE_URLS,
+    IMAGE_PROVIDER_LIMITS,
+    BENCH_RESULTS_SCHEMA_VERSION,
+    BENCH_RESULTS_PATH,
+    BENCH_IMAGE_RESOLUTIONS,
+    BENCH_POSTPROCESS_SIZES_MB
+)
+from utils.generation import generate_code_from_image, generate_layout_code_from_image, stream_code_from_image
+from utils.extraction import extract_html
+from utils.preprocessing import preprocess_image
+from utils.ratelimit import TokenBucket
+from utils.resilience import get_circuit_breaker
+from utils.stub_server import StubConfig, StubServer, make_canned_html
+
+PROVIDER = "OpenAI"
+SUITES = ("latency", "concurrency", "streaming", "image", "postprocess")
+
+# --- Fixtures ---
+def make_screenshot(width, height, seed=0):
+    """Draws a deterministic, page-like PNG (header, cards, text lines) so encoders see realistic content."""
+    rng = random.Random(seed)
+    img = Image.new("RGB", (width, height), (248, 249, 251))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle([0, 0, width, 64], fill=(33, 37, 41))
+    y = 96
+    while y < height - 40:
+        card_height = rng.randint(120, 320)
+        color = tuple(rng.randint(200, 255) for _ in range(3))
+        draw.rectangle([32, y, width - 32, min(height - 8, y + card_height)], fill=color, outline=(210, 210, 210))
+        for line_y in range(y + 20, min(height - 16, y + card_height - 12), 18):
+            draw.rectangle([56, line_y, 56 + rng.randint(width // 4, width - 120), line_y + 8], fill=(90, 90, 90))
+        y += card_height + 24
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+def percentiles(values):
+    """Summarises a list of seconds as min/mean/p50/p90/p95/p99/max (linear interpolation)."""
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pick(q):
+        position = (len(ordered) - 1) * q
+        lower = math.floor(position)
+        upper = min(lower + 1, len(ordered) - 1)
+        return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+    summary = {"min": ordered[0], "mean": sum(ordered) / len(ordered), "max": ordered[-1]}
+    for name, q in (("p50", 0.5), ("p90", 0.9), ("p95", 0.95), ("p99", 0.99)):
+        summary[name] = pick(q)
+    return {name: round(value, 4) for name, value in summary.items()}
+
+def _mean_timings(stats_list):
+    totals = {}
+    for stats in stats_list:
+        for stage, seconds in stats.get("timings", {}).items():
+            totals[stage] = totals.get(stage, 0.0) + seconds
+    return {stage: round(total / len(stats_list), 5) for stage, total in totals.items()} if stats_list else {}
+
+def _http_requests(stats_list):
+    # Every attempt of the first call and of each continuation is one request to the server.
+    return sum(stats.get("attempts", 0) + stats.get("continuation_attempts", 0) for stats in stats_list)
+
+def _reset_provider_state(args):
+    # Injected errors may have opened the breaker; each suite starts from a closed circuit.
+    get_circuit_breaker(PROVIDER, args.api_key).record_success()
+
+# --- Suites ---
+def _run_request(args, img_bytes, limiter):
+    stats = {}
+    started = time.perf_counter()
+    generate = generate_layout_code_from_image if args.output_format == "layout" else generate_code_from_image
+    html, error = generate(
+        PROVIDER, args.api_key, args.model, img_bytes, use_cache=False, preprocess=True, stats=stats, rate_limiter=limiter
+    )
+    return time.perf_counter() - started, html, error, stats
+
+def bench_latency(args, img_bytes, limiter):
+    """Sequential end-to-end requests: latency percentiles, retries and per-stage overhead."""
+    _reset_provider_state(args)
+    results = [_run_request(args, img_bytes, limiter) for _ in range(args.requests)]
+    ok = [r for r in results if not r[2]]
+    return {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "latency_s": percentiles([r[0] for r in ok]),
+        "provider_latency_s": percentiles([r[3].get("provider_latency_s", 0.0) for r in ok]),
+        "client_overhead_s": percentiles([r[0] - r[3].get("provider_latency_s", 0.0) for r in ok]),
+        "mean_attempts": round(sum(r[3].get("attempts", 1) for r in results) / len(results), 3) if results else None,
+        "http_requests": _http_requests([r[3] for r in results]),
+        "mean_continuations": round(sum(r[3].get("continuations", 0) for r in results) / len(results), 3) if results else None,
+        "truncated": sum(1 for r in ok if r[3].get("truncated")),
+        "mean_completion_tokens": round(sum(r[3].get("completion_tokens", 0) for r in ok) / len(ok), 1) if ok else None,
+        "mean_stage_timings_s": _mean_timings([r[3] for r in ok]),
+        "output_bytes": len(ok[0][1].encode("utf-8")) if ok else 0,
+    }
+
+def bench_concurrency(args, img_bytes, limiter):
+    """The same number of requests at each concurrency level: throughput and latency under load."""
+    levels = {}
+    for level in args.concurrency:
+        _reset_provider_state(args)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=level) as pool:
+            results = list(pool.map(lambda _: _run_request(args, img_bytes, limiter), range(args.requests)))
+        elapsed = time.perf_counter() - started
+        ok = [r for r in results if not r[2]]
+        levels[str(level)] = {
+            "requests": len(results),
+            "errors": len(results) - len(ok),
+            "elapsed_s": round(elapsed, 4),
+            "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else None,
+            "latency_s": percentiles([r[0] for r in ok]),
+            "http_requests": _http_requests([r[3] for r in results]),
+        }
+    return {"levels": levels}
+
+def bench_streaming(args, img_bytes, limiter):
+    """Streaming requests: time to first chunk, total time and chunk counts."""
+    _reset_provider_state(args)
+    ttft, totals, chunk_counts, errors, stats_list = [], [], [], 0, []
+    for _ in range(args.requests):
+        stats = {}
+        stats_list.append(stats)
+        started = time.perf_counter()
+        first = None
+        chunks = 0
+        failed = False
+        for kind, _payload in stream_code_from_image(
+            PROVIDER, args.api_key, args.model, img_bytes, use_cache=False, preprocess=True, stats=stats, rate_limiter=limiter
+        ):
+            if kind == "chunk":
+                chunks += 1
+                if first is None:
+                    first = time.perf_counter() - started
+            elif kind == "error":
+                failed = True
+        if failed:
+            errors += 1
+            continue
+        ttft.append(first or 0.0)
+        totals.append(time.perf_counter() - started)
+        chunk_counts.append(chunks)
+    return {
+        "requests": args.requests,
+        "errors": errors,
+        "time_to_first_chunk_s": percentiles(ttft),
+        "total_s": percentiles(totals),
+        "mean_chunks": round(sum(chunk_counts) / len(chunk_counts), 1) if chunk_counts else 0,
+        "http_requests": _http_requests(stats_list),
+    }
+
+def bench_image(args):
+    """Preprocessing (decode, resize, re-encode) and base64 cost per resolution and provider."""
+    rows = []
+    for width, height in BENCH_IMAGE_RESOLUTIONS:
+        img_bytes = make_screenshot(width, height)
+        for provider in IMAGE_PROVIDER_LIMITS:
+            durations, b64_durations = [], []
+            prepared = None
+            for _ in range(args.repeats):
+                started = time.perf_counter()
+                prepared, error = preprocess_image(img_bytes, provider)
+                durations.append(time.perf_counter() - started)
+                if error:
+                    raise RuntimeError(error)
+                started = time.perf_counter()
+                base64.b64encode(prepared.data)
+                b64_durations.append(time.perf_counter() - started)
+            rows.append({
+                "resolution": f"{width}x{height}",
+                "provider": provider,
+                "input_bytes": len(img_bytes),
+                "output_bytes": len(prepared.data),
+                "output_size": f"{prepared.width}x{prepared.height}",
+                "output_format": prepared.mime_type,
+                "preprocess_s": percentiles(durations),
+                "base64_s": percentiles(b64_durations),
+                "stage_timings_s": {stage: round(seconds, 5) for stage, seconds in prepared.stats.get("timings", {}).items()},
+            })
+    return {"rows": rows}
+
+def bench_postprocess(args):
+    """Output extraction/validation on multi-megabyte responses, bare and wrapped in a code fence."""
+    rows = []
+    for size_mb in BENCH_POSTPROCESS_SIZES_MB:
+        html = make_canned_html(int(size_mb * 1024 * 1024))
+        for variant, text in (("bare", html), ("fenced", f"```html\n{html}\n```")):
+            durations = []
+            for _ in range(args.repeats):
+                started = time.perf_counter()
+                result, error = extract_html(PROVIDER, text)
+                durations.append(time.perf_counter() - started)
+                if error:
+                    raise RuntimeError(error)
+            rows.append({
+                "size_mb": size_mb,
+                "variant": variant,
+                "input_bytes": len(text.encode("utf-8")),
+                "output_bytes": len(result.encode("utf-8")),
+                "extract_s": percentiles(durations),
+                "mb_per_s": round(size_mb / (sum(durations) / len(durations)), 1) if sum(durations) else None,
+            })
+    return {"rows": rows}
+
+# --- Reporting ---
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def _request_accounting(results, stub):
+    """Compares the requests the stub received with the attempts the client recorded.
+
+    A gap means requests were retried (or sent) outside call_with_retries, so the attempt and retry
+    figures understate what the server saw.
+    """
+    if stub is None:
+        return None
+    client_requests = sum(
+        result.get("http_requests", 0) + sum(row["http_requests"] for row in result.get("levels", {}).values())
+        for result in results.values()
+    )
+    return {"stub_requests": stub.counts["requests"], "client_requests": client_requests}
+
+def _print_summary(results):
+    for suite, result in results.items():
+        if "latency_s" in result:
+            latency = result["latency_s"]
+            print(f"{suite:<12} p50={latency.get('p50')}s p95={latency.get('p95')}s p99={latency.get('p99')}s errors={result['errors']}/{result['requests']}")
+        elif "time_to_first_chunk_s" in result:
+            print(f"{suite:<12} ttft p50={result['time_to_first_chunk_s'].get('p50')}s total p50={result['total_s'].get('p50')}s errors={result['errors']}/{result['requests']}")
+        elif "levels" in result:
+            for level, row in result["levels"].items():
+                print(f"{suite:<12} x{level:<4} {row['throughput_rps']} req/s p95={row['latency_s'].get('p95')}s errors={row['errors']}")
+        else:
+            for row in result["rows"]:
+                label = row.get("resolution") or f"{row['size_mb']}MB {row['variant']}"
+                timing = row.get("preprocess_s") or row.get("extract_s")
+                print(f"{suite:<12} {label:<16} {row.get('provider', ''):<14} mean={timing['mean']}s")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the generation pipeline offline against a local stub server.")
+    parser.add_argument("--suites", default=",".join(SUITES), help=f"Comma-separated subset of: {', '.join(SUITES)}.")
+    parser.add_argument("--output", default=BENCH_RESULTS_PATH, help="Where the JSON results are written.")
+    parser.add_argument("--output-format", choices=("html", "layout"), default="html", help="Generate HTML directly, or a layout tree rendered locally (latency/concurrency suites).")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per latency/streaming run and per concurrency level.")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated concurrency levels.")
+    parser.add_argument("--repeats", type=int, default=5, help="Repetitions for the image and post-processing suites.")
+    parser.add_argument("--resolution", default="1440x900", help="Screenshot size used for request suites.")
+    parser.add_argument("--model", default="gpt-4o", help="Model ID sent to the server.")
+    parser.add_argument("--api-key", default="stub-key", help="API key sent to the server (a real key is only needed with --record).")
+    parser.add_argument("--base-url", help="Use an already running OpenAI-compatible server instead of starting the stub.")
+    stub_group = parser.add_argument_group("stub server")
+    stub_group.add_argument("--latency", type=float, default=0.25, help="Seconds before the first token.")
+    stub_group.add_argument("--jitter", type=float, default=0.05, help="Extra random latency, up to this many seconds.")
+    stub_group.add_argument("--chunk-chars", type=int, default=StubConfig.chunk_chars, help="Characters per streamed chunk.")
+    stub_group.add_argument("--chunk-rate", type=float, default=1000.0, help="Streamed chunks per second (0 = unthrottled).")
+    stub_group.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with --error-status.")
+    stub_group.add_argument("--error-status", type=int, default=StubConfig.error_status)
+    stub_group.add_argument("--html-kb", type=float, default=20, help="Size of the canned HTML response.")
+    stub_group.add_argument("--trailing-text", default="", help="Commentary the stub appends after the document.")
+    stub_group.add_argument("--max-output-kb", type=float, default=0, help="Cut stub replies off after this size (exercises continuations).")
+    stub_group.add_argument("--record", metavar="CASSETTE", help="Proxy to --upstream (real API) and save responses here.")
+    stub_group.add_argument("--upstream", default="https://api.openai.com/v1", help="Real API base URL used with --record.")
+    stub_group.add_argument("--replay", metavar="CASSETTE", help="Serve responses saved with --record.")
+    stub_group.add_argument("--replay-fast", action="store_true", help="Ignore recorded delays when replaying.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    suites = [suite.strip() for suite in args.suites.split(",") if suite.strip()]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        parser.error(f"Unknown suite(s): {', '.join(sorted(unknown))}")
+    args.concurrency = [int(level) for level in args.concurrency.split(",")]
+    width, height = (int(side) for side in args.resolution.lower().split("x"))
+
+    stub_config = StubConfig(
+        latency_s=args.latency, jitter_s=args.jitter, chunk_chars=args.chunk_chars, chunks_per_second=args.chunk_rate,
+        error_rate=args.error_rate, error_status=args.error_status, html_bytes=int(args.html_kb * 1000),
+        trailing_text=args.trailing_text, max_output_chars=int(args.max_output_kb * 1000),
+        upstream=args.upstream if args.record else None, cassette_path=args.record or args.replay,
+        replay=bool(args.replay), replay_timing=not args.replay_fast,
+    )
+    stub = None
+    if args.base_url:
+        PROVIDER_BASE_URLS[PROVIDER] = args.base_url
+    elif any(suite in suites for suite in ("latency", "concurrency", "streaming")):
+        stub = StubServer(stub_config).start()
+        PROVIDER_BASE_URLS[PROVIDER] = stub.base_url
+
+    # The benchmark measures the pipeline, not the production request budget.
+    limiter = TokenBucket(rate_per_minute=10 ** 9, burst=10 ** 6)
+    img_bytes = make_screenshot(width, height)
+    results = {}
+    try:
+        for suite in suites:
+            print(f"Running {suite}...", file=sys.stderr)
+            if suite == "latency":
+                results[suite] = bench_latency(args, img_bytes, limiter)
+            elif suite == "concurrency":
+                results[suite] = bench_concurrency(args, img_bytes, limiter)
+            elif suite == "streaming":
+                results[suite] = bench_streaming(args, img_bytes, limiter)
+            elif suite == "image":
+                results[suite] = bench_image(args)
+            elif suite == "postprocess":
+                results[suite] = bench_postprocess(args)
+    finally:
+        if stub is not None:
+            stub.stop()
+
+    report = {
+        "schema_version": BENCH_RESULTS_SCHEMA_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {
+            "suites": suites,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "repeats": args.repeats,
+            "resolution": args.resolution,
+            "output_format": args.output_format,
+            "model": args.model,
+            "server": args.base_url or ("replay" if args.replay else "record" if args.record else "stub"),
+            "stub": None if args.base_url else {key: value for key, value in vars(stub_config).items() if key != "upstream"},
+        },
+        "stub_counts": stub.counts if stub else None,
+        "request_accounting": _request_accounting(results, stub),
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    _print_summary(results)
+    print(f"Results written to {args.output}", file=sys.stderr)
+    accounting = report["request_accounting"]
+    if accounting and accounting["stub_requests"] != accounting["client_requests"]:
+        print(
+            f"Request mismatch: the stub received {accounting['stub_requests']} requests but the client recorded "
+            f"{accounting['client_requests']} attempts; retries are happening outside call_with_retries.",
+            file=sys.stderr,
+        )
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,447 @@
+"""HTTP API entry point: clone screenshots from other tools without going through the Streamlit UI.
+
+Examples:
+    python server.py --port 8500 --concurrency 8 --processes 4
+    curl -s --data-binary @shot.png -H "Authorization: Bearer $OPENAI_API_KEY" \\
+        "http://127.0.0.1:8500/v1/jobs?provider=openai&model=gpt-4o&stream=1"
+    curl -s http://127.0.0.1:8500/v1/jobs/<id>
+    curl -sN http://127.0.0.1:8500/v1/jobs/<id>/events
+
+Endpoints:
+    POST   /v1/jobs?provider=..&model=..   Body: the image. Optional: stream=1, cache=0, preprocess=0, label=...
+                                           202 with the job ID, or 429 (with Retry-After) when the queue is full.
+    GET    /v1/jobs/<id>                   Status, stats and, once done, the HTML.
+    GET    /v1/jobs/<id>/events            Server-sent events: "status", "chunk" (streamed jobs), then "done" or "error".
+    DELETE /v1/jobs/<id>                   Cancels a queued job, or a streamed one at its next chunk.
+    GET    /healthz                        Queue depth, running jobs and pooled provider clients.
+
+The API key is taken from "Authorization: Bearer <key>", falling back to the provider's environment
+variable (e.g. OPENAI_API_KEY). Jobs are kept in memory, like the UI's background jobs (utils/jobs.py).
+
+CPU-bound work runs on a pool of --processes worker processes, so it can use every core: image
+preprocessing before the provider call, and output compaction (by far the heaviest post-processing
+step) after it. Provider calls and the extraction of streamed output, an incremental scan of each
+chunk, stay on threads. There is a single server process rather than several on a shared socket,
+because jobs live in its memory: polling and event requests must reach the process that owns the job.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs
+from utils.config import (
+    PROVIDER_ALIASES,
+    PROVIDER_API_KEY_ENV_VARS,
+    JOB_STORE_MAX_FINISHED,
+    JOB_RESULT_TTL,
+    SERVICE_HOST,
+    SERVICE_PORT,
+    SERVICE_CONCURRENCY,
+    SERVICE_QUEUE_DEPTH,
+    SERVICE_PROCESSES,
+    SERVICE_MAX_UPLOAD_BYTES,
+    SERVICE_MAX_HEADER_BYTES,
+    SERVICE_READ_CHUNK_BYTES,
+    SERVICE_RETRY_AFTER,
+    SERVICE_SSE_KEEPALIVE
+)
+from utils.clients import get_pool_stats
+from utils.memory import get_memory_status
+from utils.generation import generate_code_from_image, stream_code_from_image
+from utils.jobs import Job
+from utils.preprocessing import preprocess_image, passthrough_image
+
+class HttpError(Exception):
+    """An error answered to the client as {"error": message} with the given status."""
+
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+def _response_head(status, content_type, content_length=None, headers=None):
+    lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}", f"Content-Type: {content_type}", "Connection: close"]
+    if content_length is not None:
+        lines.append(f"Content-Length: {content_length}")
+    lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+async def _send_json(writer, status, payload, headers=None):
+    body = json.dumps(payload, default=str).encode("utf-8")
+    writer.write(_response_head(status, "application/json", len(body), headers) + body)
+    await writer.drain()
+
+async def _read_request(reader):
+    """Returns (method, path, query, headers), or None if the client closed the connection first."""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError:
+        return None
+    except asyncio.LimitOverrunError:
+        raise HttpError(431, "Request headers are too large.")
+    request_line, *header_lines = head.decode("latin-1").rstrip("\r\n").split("\r\n")
+    try:
+        method, target, _ = request_line.split(" ", 2)
+    except ValueError:
+        raise HttpError(400, "Malformed request line.")
+    headers = {}
+    for line in header_lines:
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    url = urlsplit(target)
+    return method.upper(), url.path.rstrip("/") or "/", parse_qs(url.query), headers
+
+async def _read_body(reader, headers):
+    """Reads the upload straight into one preallocated buffer, so it is never copied between chunks."""
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        raise HttpError(411, "Send the image with a Content-Length header.")
+    try:
+        length = int(headers.get("content-length", "0"))
+    except ValueError:
+        raise HttpError(400, "Invalid Content-Length header.")
+    if length > SERVICE_MAX_UPLOAD_BYTES:
+        raise HttpError(413, f"Images are limited to {SERVICE_MAX_UPLOAD_BYTES // (1024 * 1024)} MB.")
+    body = bytearray(length)
+    view = memoryview(body)
+    received = 0
+    while received < length:
+        chunk = await reader.read(min(SERVICE_READ_CHUNK_BYTES, length - received))
+        if not chunk:
+            raise HttpError(400, "The upload ended before Content-Length bytes were received.")
+        view[received:received + len(chunk)] = chunk
+        received += len(chunk)
+    return body
+
+def _param(query, name, default=None):
+    values = query.get(name)
+    return values[0] if values else default
+
+def _flag(query, name, default):
+    value = _param(query, name)
+    return default if value is None else value.lower() not in ("0", "false", "no", "off")
+
+def _resolve_provider(name):
+    if name in PROVIDER_API_KEY_ENV_VARS:
+        return name
+    return PROVIDER_ALIASES.get((name or "").lower())
+
+def describe_job(job):
+    """Returns the JSON view of a job; the HTML is included once it is done."""
+    description = {
+        "id": job.id,
+        "status": job.status,
+        "mode": job.mode,
+        "provider": job.provider,
+        "model": job.model_id,
+        "label": job.label,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "elapsed_s": round(job.elapsed(), 3),
+        "stats": job.stats,
+    }
+    if job.error:
+        description["error"] = job.error
+    if job.html:
+        description["html"] = job.html
+    return description
+
+class GenerationService:
+    """Job store, bounded queue and worker pool behind the HTTP API.
+
+    Everything but the generation itself runs on one asyncio event loop. `concurrency` worker tasks
+    take jobs from a queue of at most `queue_depth` waiting jobs; each job's provider call runs on a
+    thread (the SDK clients are blocking, and they are shared through the process-wide client pool),
+    and image preprocessing and output compaction run on a pool of `processes` worker processes so
+    they can use every core.
+    """
+
+    def __init__(self, concurrency=SERVICE_CONCURRENCY, queue_depth=SERVICE_QUEUE_DEPTH, processes=SERVICE_PROCESSES):
+        self.concurrency = max(1, concurrency)
+        self.processes = max(1, processes)
+        self.queue = asyncio.Queue(maxsize=max(1, queue_depth))
+        self.jobs = OrderedDict() # job id -> Job, in submission order
+        self._watchers = {} # job id -> asyncio.Events of the event streams following it
+        self._threads = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="service-generation")
+        # Spawned rather than forked: the server process already runs threads.
+        self._process_pool = ProcessPoolExecutor(
+            max_workers=self.processes, mp_context=multiprocessing.get_context("spawn")
+        ) if self.processes > 1 else None
+        self._loop = None
+
+    async def serve(self, host=SERVICE_HOST, port=SERVICE_PORT):
+        self._loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=SERVICE_MAX_HEADER_BYTES)
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        logging.info(
+            f"Serving on http://{host}:{port} ({self.concurrency} concurrent generations, "
+            f"{self.queue.maxsize} queued, {self.processes} worker process(es) for preprocessing and compaction)."
+        )
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+    def close(self):
+        self._threads.shutdown(wait=False, cancel_futures=True)
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+
+    # --- Jobs ---
+    def _notify(self, job_id):
+        for event in self._watchers.get(job_id, ()):
+            event.set()
+
+    def _finish(self, job, status, html=None, error=None):
+        job.html = html
+        job.error = error
+        job.finished_at = time.time()
+        job.status = status
+        self._notify(job.id)
+        logging.info(f"Job {job.id} ({job.provider} {job.model_id}) finished: {status} after {job.elapsed():.1f}s.")
+
+    def _prune(self, now):
+        """Drops finished jobs past JOB_RESULT_TTL, then the oldest beyond JOB_STORE_MAX_FINISHED."""
+        finished = [job for job in self.jobs.values() if job.finished]
+        expired = {job.id for job in finished if now - job.finished_at > JOB_RESULT_TTL}
+        overflow = len(finished) - len(expired) - JOB_STORE_MAX_FINISHED
+        if overflow > 0:
+            remaining = sorted((job for job in finished if job.id not in expired), key=lambda job: job.finished_at)
+            expired.update(job.id for job in remaining[:overflow])
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    async def _worker(self):
+        while True:
+            job, api_key, use_cache, preprocess = await self.queue.get()
+            try:
+                if not job.finished: # Cancelled while queued
+                    await self._run(job, api_key, use_cache, preprocess)
+            except Exception as e:
+                logging.exception(f"Job {job.id} failed unexpectedly.")
+                self._finish(job, "error", error=f"An unexpected error occurred in the generation job: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _run(self, job, api_key, use_cache, preprocess):
+        job.started_at = time.time()
+        job.status = "running"
+        self._notify(job.id)
+        img_bytes, job.image = job.image, None # The upload is not kept once the job has started
+
+        if preprocess:
+            prepared, error = await self._loop.run_in_executor(self._process_pool or self._threads, preprocess_image, img_bytes, job.provider)
+        else:
+            prepared, error = passthrough_image(bytes(img_bytes)), None
+        del img_bytes
+        html = None
+        if prepared is not None:
+            html, error = await self._loop.run_in_executor(self._threads, self._generate, job, api_key, prepared.data, use_cache)
+            job.stats["preprocessing"] = prepared.stats
+
+        if job.cancel_event.is_set() and not html:
+            self._finish(job, "cancelled")
+        elif error or not html:
+            self._finish(job, "error", error=error or "No HTML content received.")
+        else:
+            self._finish(job, "done", html=html)
+
+    def _offload(self, fn, *args):
+        """Runs a CPU-bound step of a generation on the worker processes; called from generation threads."""
+        if self._process_pool is None:
+            return fn(*args)
+        return self._process_pool.submit(fn, *args).result()
+
+    def _generate(self, job, api_key, img_bytes, use_cache):
+        """Runs on a generation thread; streamed chunks wake the job's event streams on the loop."""
+        if job.mode != "stream":
+            return generate_code_from_image(
+                job.provider, api_key, job.model_id, img_bytes, use_cache=use_cache, preprocess=False, stats=job.stats,
+                offload=self._offload
+            )
+        html, error = None, None
+        for kind, payload in stream_code_from_image(
+            job.provider, api_key, job.model_id, img_bytes,
+            use_cache=use_cache, preprocess=False, stats=job.stats, cancel_event=job.cancel_event, offload=self._offload
+        ):
+            if kind == "chunk":
+                job.chunks.append(payload)
+                self._loop.call_soon_threadsafe(self._notify, job.id)
+            elif kind == "done":
+                html = payload
+            else:
+                error = payload
+        return html, error
+
+    # --- HTTP ---
+    async def handle_connection(self, reader, writer):
+        try:
+            request = await _read_request(reader)
+            if request is not None:
+                await self._dispatch(*request, reader, writer)
+        except HttpError as e:
+            await _send_json(writer, e.status, {"error": e.message}, e.headers)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass # The client went away
+        except Exception:
+            logging.exception("Unhandled error while serving a request.")
+            try:
+                await _send_json(writer, 500, {"error": "Internal server error."})
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _dispatch(self, method, path, query, headers, reader, writer):
+        parts = path.strip("/").split("/")
+        if path == "/healthz" and method == "GET":
+            return await _send_json(writer, 200, self.health())
+        if parts[:2] != ["v1", "jobs"] or len(parts) > 4:
+            raise HttpError(404, "Not found.")
+        if len(parts) == 2:
+            if method != "POST":
+                raise HttpError(405, "Use POST to submit a screenshot.", {"Allow": "POST"})
+            return await self._submit(query, headers, reader, writer)
+
+        job = self.jobs.get(parts[2])
+        if job is None:
+            raise HttpError(404, "Unknown or expired job.")
+        if len(parts) == 4:
+            if parts[3] != "events" or method != "GET":
+                raise HttpError(404, "Not found.")
+            return await self._stream_events(job, writer)
+        if method == "GET":
+            return await _send_json(writer, 200, describe_job(job))
+        if method == "DELETE":
+            if not job.cancellable:
+                raise HttpError(409, f"A {job.status} {job.mode} job cannot be cancelled.")
+            job.cancel_event.set()
+            if job.status == "queued":
+                job.image = None
+                self._finish(job, "cancelled")
+            return await _send_json(writer, 202, {"id": job.id, "status": job.status})
+        raise HttpError(405, "Use GET or DELETE.", {"Allow": "GET, DELETE"})
+
+    async def _submit(self, query, headers, reader, writer):
+        provider = _resolve_provider(_param(query, "provider"))
+        if provider is None:
+            raise HttpError(400, f"Unknown or missing provider; use one of {', '.join(sorted(PROVIDER_ALIASES))}.")
+        model_id = _param(query, "model")
+        if not model_id:
+            raise HttpError(400, "Missing model, e.g. model=gpt-4o.")
+        authorization = headers.get("authorization", "")
+        api_key = authorization[7:].strip() if authorization.lower().startswith("bearer ") else os.environ.get(PROVIDER_API_KEY_ENV_VARS[provider])
+        if not api_key:
+            raise HttpError(401, f"No API key: send 'Authorization: Bearer <key>' or set {PROVIDER_API_KEY_ENV_VARS[provider]} for the server.")
+        # Turn clients away before they upload anything when no job could be queued anyway.
+        busy = HttpError(429, "Too many queued jobs; retry later.", {"Retry-After": str(SERVICE_RETRY_AFTER)})
+        if self.queue.full():
+            raise busy
+        if headers.get("expect", "").lower() == "100-continue":
+            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+        img_bytes = await _read_body(reader, headers)
+        if not img_bytes:
+            raise HttpError(400, "The request body must be the screenshot.")
+
+        job = Job(
+            id=uuid.uuid4().hex[:12], mode="stream" if _flag(query, "stream", False) else "blocking",
+            provider=provider, model_id=model_id, label=_param(query, "label", ""), image=img_bytes
+        )
+        try:
+            self.queue.put_nowait((job, api_key, _flag(query, "cache", True), _flag(query, "preprocess", True)))
+        except asyncio.QueueFull: # Filled up while this upload was being received
+            raise busy
+        self._prune(time.time())
+        self.jobs[job.id] = job
+        logging.info(f"Job {job.id} queued: {job.mode} generation with {provider} {model_id} ({len(img_bytes)} bytes).")
+        await _send_json(writer, 202, {
+            "id": job.id, "status": job.status, "poll": f"/v1/jobs/{job.id}", "events": f"/v1/jobs/{job.id}/events"
+        }, {"Location": f"/v1/jobs/{job.id}"})
+
+    async def _stream_events(self, job, writer):
+        writer.write(_response_head(200, "text/event-stream", headers={"Cache-Control": "no-cache"}))
+
+        def send(event, payload):
+            writer.write(f"event: {event}\ndata: {json.dumps(payload, default=str)}\n\n".encode("utf-8"))
+
+        changed = asyncio.Event()
+        self._watchers.setdefault(job.id, set()).add(changed)
+        status, sent_chunks = None, 0
+        try:
+            while True:
+                changed.clear() # Before reading the job, so no update in between can be missed
+                if job.status != status:
+                    status = job.status
+                    send("status", {"status": status})
+                chunk_count = len(job.chunks)
+                if chunk_count > sent_chunks: # Chunks that arrived since the last wake-up go out as one event
+                    send("chunk", {"text": "".join(job.chunks[sent_chunks:chunk_count])})
+                    sent_chunks = chunk_count
+                if job.finished:
+                    if job.status == "done":
+                        send("done", {"html": job.html, "stats": job.stats})
+                    else:
+                        send("error", {"status": job.status, "error": job.error or "Generation cancelled."})
+                    await writer.drain()
+                    return
+                await writer.drain()
+                try:
+                    await asyncio.wait_for(changed.wait(), SERVICE_SSE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    writer.write(b": keep-alive\n\n")
+        finally:
+            watchers = self._watchers.get(job.id)
+            watchers.discard(changed)
+            if not watchers:
+                del self._watchers[job.id]
+
+    def health(self):
+        counts = {}
+        for job in self.jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {
+            "queued": self.queue.qsize(),
+            "queue_depth": self.queue.maxsize,
+            "concurrency": self.concurrency,
+            "processes": self.processes,
+            "jobs": counts,
+            "pooled_clients": get_pool_stats(),
+            "memory": get_memory_status(),
+        }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve screenshot-to-HTML generation over HTTP.")
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--concurrency", type=int, default=SERVICE_CONCURRENCY, help="Generations running at once.")
+    parser.add_argument("--queue-depth", type=int, default=SERVICE_QUEUE_DEPTH, help="Jobs allowed to wait before uploads are answered 429.")
+    parser.add_argument("--processes", type=int, default=SERVICE_PROCESSES, help="Worker processes for image preprocessing and output compaction (1 = none).")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    service = GenerationService(args.concurrency, args.queue_depth, args.processes)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# Keep caches, traces and indexes of test runs out of ~/.ui_cloner; set before utils.config is imported.
+os.environ.setdefault("UI_CLONER_DATA_DIR", tempfile.mkdtemp(prefix="ui_cloner_tests_"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,19 @@
+import json
+import pytest
+
+pytest.importorskip("openai")
+
+import benchmark
+
+def test_stub_requests_match_recorded_attempts(monkeypatch, tmp_path):
+    monkeypatch.setattr("utils.resilience.backoff_delay", lambda attempt, retry_after=None: 0)
+    output = tmp_path / "bench.json"
+    exit_code = benchmark.main([
+        "--suites", "latency,streaming", "--requests", "2", "--latency", "0", "--jitter", "0",
+        "--error-rate", "0.5", "--max-output-kb", "8", "--api-key", "stub-accounting", "--output", str(output),
+    ])
+    report = json.loads(output.read_text())
+    accounting = report["request_accounting"]
+    assert exit_code == 0
+    assert accounting["stub_requests"] == accounting["client_requests"] > 0
+    assert report["results"]["latency"]["http_requests"] + report["results"]["streaming"]["http_requests"] == accounting["client_requests"]
@@ -0,0 +1,56 @@
+from types import SimpleNamespace
+from utils import cache
+from utils.cache import make_cache_key, get_cached_result, store_result, get_cache_stats
+
+def _clock(monkeypatch, start=1000.0):
+    clock = SimpleNamespace(now=start)
+    monkeypatch.setattr(cache, "time", SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+def test_cache_key_covers_everything_that_shapes_the_output():
+    base = make_cache_key(b"img", "OpenAI", "gpt-4o", "prompt", {"temperature": 0.1, "preprocess": True})
+    assert base == make_cache_key(b"img", "OpenAI", "gpt-4o", "prompt", {"preprocess": True, "temperature": 0.1})
+    variants = [
+        make_cache_key(b"img2", "OpenAI", "gpt-4o", "prompt", {"temperature": 0.1, "preprocess": True}),
+        make_cache_key(b"img", "OpenRouter", "gpt-4o", "prompt", {"temperature": 0.1, "preprocess": True}),
+        make_cache_key(b"img", "OpenAI", "gpt-4.1", "prompt", {"temperature": 0.1, "preprocess": True}),
+        make_cache_key(b"img", "OpenAI", "gpt-4o", "other prompt", {"temperature": 0.1, "preprocess": True}),
+        make_cache_key(b"img", "OpenAI", "gpt-4o", "prompt", {"temperature": 0.2, "preprocess": True}),
+        make_cache_key(b"img", "OpenAI", "gpt-4o", "prompt", {"temperature": 0.1, "preprocess": False}),
+    ]
+    assert len({base, *variants}) == len(variants) + 1
+
+def test_entries_expire(monkeypatch, tmp_path):
+    clock = _clock(monkeypatch)
+    db_path = str(tmp_path / "cache.sqlite3")
+    store_result("key", "<html>a</html>", db_path=db_path)
+    assert get_cached_result("key", db_path=db_path, max_age=60) == "<html>a</html>"
+    clock.now += 61
+    assert get_cached_result("key", db_path=db_path, max_age=60) is None
+    assert get_cache_stats(db_path)["entries"] == 0
+
+def test_least_recently_used_entries_are_evicted(monkeypatch, tmp_path):
+    clock = _clock(monkeypatch)
+    db_path = str(tmp_path / "cache.sqlite3")
+    page = "x" * 100
+    for key in ("a", "b"):
+        store_result(key, page, db_path=db_path, max_bytes=250)
+        clock.now += 1
+    assert get_cached_result("a", db_path=db_path) == page # "b" is now the least recently used
+    clock.now += 1
+    store_result("c", page, db_path=db_path, max_bytes=250)
+    assert get_cached_result("b", db_path=db_path) is None
+    assert get_cached_result("a", db_path=db_path) == page
+    assert get_cached_result("c", db_path=db_path) == page
+
+def test_entries_larger_than_the_cache_are_not_stored(tmp_path):
+    db_path = str(tmp_path / "cache.sqlite3")
+    store_result("big", "x" * 300, db_path=db_path, max_bytes=250)
+    assert get_cached_result("big", db_path=db_path) is None
+
+def test_unusable_data_dir_is_a_miss(tmp_path):
+    not_a_dir = tmp_path / "file"
+    not_a_dir.write_text("")
+    db_path = str(not_a_dir / "sub" / "cache.sqlite3")
+    store_result("key", "<html></html>", db_path=db_path)
+    assert get_cached_result("key", db_path=db_path) is None
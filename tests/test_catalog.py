@@ -0,0 +1,34 @@
+import time
+
+from utils import catalog
+
+def _wait_for_refresh():
+    deadline = time.time() + 5
+    while catalog._refreshing and time.time() < deadline:
+        time.sleep(0.01)
+
+def test_failed_background_refresh_backs_off():
+    calls = []
+
+    def failing_fetch(api_key):
+        calls.append(api_key)
+        return [], "HTTP 503"
+
+    catalog._store("OpenAI", "sk-backoff", [{"id": "gpt-4o"}])
+    entry = catalog._index[catalog._entry_key("OpenAI", "sk-backoff")]
+    entry["fetched_at"] -= catalog.CATALOG_TTL + 1
+
+    models, error = catalog.get_models("OpenAI", "sk-backoff", failing_fetch)
+    _wait_for_refresh()
+    assert error is None and models[0]["id"] == "gpt-4o"
+    assert entry["failures"] == 1 and entry["retry_at"] > time.time()
+
+    catalog.get_models("OpenAI", "sk-backoff", failing_fetch)
+    _wait_for_refresh()
+    assert len(calls) == 1
+
+    entry["retry_at"] = 0
+    catalog.get_models("OpenAI", "sk-backoff", lambda key: ([{"id": "gpt-4.1"}], None))
+    _wait_for_refresh()
+    refreshed = catalog._index[catalog._entry_key("OpenAI", "sk-backoff")]
+    assert refreshed["models"][0]["id"] == "gpt-4.1" and "retry_at" not in refreshed
@@ -0,0 +1,20 @@
+import pytest
+
+pytest.importorskip("openai")
+
+from benchmark import make_screenshot
+from utils import config
+from utils.generation import generate_code_from_image
+from utils.stub_server import StubServer, StubConfig
+
+def test_only_call_with_retries_retries(monkeypatch):
+    monkeypatch.setattr("utils.resilience.backoff_delay", lambda attempt, retry_after=None: 0)
+    with StubServer(StubConfig(latency_s=0, error_rate=1.0, retry_after_ms=0)) as stub:
+        monkeypatch.setitem(config.PROVIDER_BASE_URLS, "OpenAI", stub.base_url)
+        stats = {}
+        html, error = generate_code_from_image(
+            "OpenAI", "sk-retry-count", "gpt-4o", make_screenshot(64, 64), use_cache=False, stats=stats
+        )
+    assert html is None and error
+    assert stats["attempts"] == config.RETRY_MAX_ATTEMPTS
+    assert stub.counts["requests"] == stats["attempts"]
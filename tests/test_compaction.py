@@ -0,0 +1,37 @@
+from utils.compaction import compact_html, compact_css, minify_css
+
+def _page(body, css="p{margin:0}"):
+    return f"<html><head><style>{css}</style></head><body>{body}</body></html>"
+
+def test_minify_css_keeps_strings():
+    assert minify_css("a  {  content: '  x  ' ;/* note */color: red ; }") == "a{content:'  x  ';color:red}"
+    assert minify_css("a :hover{width: calc(1px + 2px)}") == "a :hover{width:calc(1px + 2px)}"
+
+def test_compact_css_keeps_last_duplicate():
+    counts = {"duplicate_rules": 0, "merged_rules": 0}
+    css = compact_css(".a{color:red}.a{color:blue}.a{color:red}", counts)
+    assert css.rindex("color:red") > css.index("color:blue")
+    assert counts["duplicate_rules"] == 1
+
+def test_repeated_inline_styles_become_classes():
+    html, stats = compact_html(_page('<p style="padding: 4px 8px; margin: 0 auto">x</p>' * 10))
+    assert stats["hoisted_styles"] == 1
+    assert "style=" not in html.split("</head>")[1]
+    assert ".hc0{padding:4px 8px!important;margin:0 auto!important}" in html
+
+def test_important_inline_styles_stay_inline():
+    html, _ = compact_html(_page('<p style="color:red !important; padding: 4px 8px">x</p>' * 10))
+    assert "!important!important" not in html
+    assert html.count('style="color:red!important;padding:4px 8px"') == 10
+
+def test_no_hoisting_with_scripts():
+    html, stats = compact_html(_page('<p style="padding: 4px 8px; margin: 0 auto">x</p>' * 10 + "<script>x()</script>"))
+    assert stats["hoisted_styles"] == 0
+    assert 'style="padding:4px 8px;margin:0 auto"' in html
+
+def test_preformatted_whitespace_is_kept():
+    html, _ = compact_html(_page("<pre>a\n    b</pre>\n\n   <p>c   d</p>"))
+    assert "<pre>a\n    b</pre>" in html
+    assert "c d" in html
+    html, _ = compact_html(_page("<p>c   d</p>", css="p{white-space:pre-wrap}"))
+    assert "c   d" in html # Text is not collapsed when any element preserves whitespace
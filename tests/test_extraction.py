@@ -0,0 +1,56 @@
+import pytest
+from utils.extraction import HtmlExtractor, extract_html, splice_continuation
+
+DOCUMENT = "<!DOCTYPE html>\n<html><head><title>T</title></head><body><p>Hi</p></body></html>"
+
+def _feed_in_chunks(text, size):
+    extractor = HtmlExtractor()
+    fed = "".join(extractor.feed(text[i:i + size]) for i in range(0, len(text), size))
+    return extractor, fed
+
+def test_strips_text_around_the_document():
+    html, error = extract_html("OpenAI", f"Here is the code:\n```html\n{DOCUMENT}\n```\nHope this helps!")
+    assert error is None and html == DOCUMENT
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64])
+def test_markers_split_across_chunks(size):
+    extractor, fed = _feed_in_chunks(f"Sure! {DOCUMENT.upper()} trailing", size)
+    assert extractor.closed
+    assert fed.endswith(DOCUMENT.upper()) # Chunks before the start marker is complete are passed through
+    assert extractor.result("OpenAI") == (DOCUMENT.upper(), None)
+
+@pytest.mark.parametrize("size", [1, 5, 1000])
+def test_offsets_survive_case_changing_characters(size):
+    # "İ".lower() is two code points; offsets must still point into the raw text.
+    document = "<html><body>İstanbul İzmir</body></html>"
+    extractor, fed = _feed_in_chunks("İİ " + document + " trailing", size)
+    assert fed.endswith(document)
+    assert extractor.result("OpenAI") == (document, None)
+
+def test_fenced_block_without_html_tag():
+    html, error = extract_html("OpenAI", "```html\n<div>only a fragment</div>\n```\nmore")
+    assert error is None and html == "<div>only a fragment</div>"
+
+def test_head_and_body_without_doctype_are_accepted():
+    raw = "<head></head><body>x</body>"
+    assert extract_html("OpenAI", raw) == (raw, None)
+
+def test_non_html_output_is_an_error():
+    html, error = extract_html("OpenAI", "I cannot help with that.")
+    assert html is None and "does not appear to be valid HTML" in error
+
+def test_truncated_document_drops_trailing_fence():
+    html, _ = extract_html("OpenAI", "```html\n<html><body><p>cut\n```")
+    assert html == "<html><body><p>cut"
+
+def test_splice_continuation_drops_repeated_tail_and_fence():
+    assert splice_continuation("<div class='card'>Hello wor", "```html\nHello world</div>") == (False, "ld</div>")
+    assert splice_continuation("...", "<!DOCTYPE html><html>") == (True, "<!DOCTYPE html><html>")
+
+def test_extend_continues_a_cut_off_document():
+    extractor = HtmlExtractor()
+    extractor.feed("<html><body><p>Hello wor")
+    added = extractor.extend("<p>Hello world</p></body></html> done", 200)
+    assert extractor.closed
+    assert extractor.result("OpenAI")[0] == "<html><body><p>Hello world</p></body></html>"
+    assert added == "ld</p></body></html>"
@@ -0,0 +1,47 @@
+import pytest
+
+genai = pytest.importorskip("google.generativeai")
+glm = pytest.importorskip("google.ai.generativelanguage")
+genai_client = pytest.importorskip("google.generativeai.client")
+from utils import generation
+
+# _make_gemini_model binds each model to a per-key client through GenerativeModel._client, a private
+# attribute of the (pinned, no longer developed) SDK. These tests fail if the SDK stops using it.
+
+class _FakeClient:
+    def __init__(self):
+        self.calls = []
+
+    def _response(self):
+        return glm.GenerateContentResponse(candidates=[
+            glm.Candidate(content=glm.Content(parts=[glm.Part(text="<html></html>")], role="model"), finish_reason=glm.Candidate.FinishReason.STOP)
+        ])
+
+    def generate_content(self, request, **kwargs):
+        self.calls.append(("generate_content", request))
+        return self._response()
+
+    def stream_generate_content(self, request, **kwargs):
+        self.calls.append(("stream_generate_content", request))
+        return iter([self._response()])
+
+@pytest.fixture
+def fake_client(monkeypatch):
+    client = _FakeClient()
+    monkeypatch.setattr(generation, "get_gemini_client", lambda api_key: client)
+    def no_default_client():
+        raise AssertionError("The process-global Gemini client was used instead of the per-key one.")
+    monkeypatch.setattr(genai_client, "get_default_generative_client", no_default_client)
+    return client
+
+def test_blocking_calls_use_the_per_key_client(fake_client):
+    model = generation._make_gemini_model("key", "models/gemini-test", {"temperature": 0})
+    response = model.generate_content(["prompt", {"mime_type": "image/png", "data": b"\x89PNG"}])
+    assert response.text == "<html></html>"
+    assert [name for name, _ in fake_client.calls] == ["generate_content"]
+
+def test_streaming_calls_use_the_per_key_client(fake_client):
+    model = generation._make_gemini_model("key", "models/gemini-test", {"temperature": 0})
+    chunks = [chunk.text for chunk in model.generate_content(["prompt"], stream=True)]
+    assert chunks == ["<html></html>"]
+    assert [name for name, _ in fake_client.calls] == ["stream_generate_content"]
@@ -0,0 +1,93 @@
+import numpy as np
+from PIL import Image
+
+from utils.incremental import diff_screenshots, plan_update, _split_region
+
+HEIGHT, WIDTH = 256, 64
+
+def _rows(colors):
+    """Returns an RGB array with one solid colour per row."""
+    return np.repeat(np.asarray(colors, dtype=np.uint8)[:, None, :], WIDTH, axis=1)
+
+def _page():
+    # Every row has its own red level, so rows shifted by an insertion or removal never line up.
+    return _rows([(y, 0, 0) for y in range(HEIGHT)])
+
+def _inserted(height):
+    return _rows([(0, 255, 0)] * height)
+
+def _sections():
+    return [
+        {"top": top, "bottom": top + 64, "prefix": f"s{i}", "html": f"<section>s{i}</section>"}
+        for i, top in enumerate(range(0, HEIGHT, 64), start=1)
+    ]
+
+def _plan(new):
+    spans, height_delta, _ = diff_screenshots(_page(), new)
+    return plan_update(_sections(), spans, height_delta, HEIGHT)
+
+def test_edit_in_place_regenerates_only_the_touched_section():
+    new = _page()
+    new[100:110, :, 1] = 200
+    spans, height_delta, block_count = diff_screenshots(_page(), new)
+    assert (spans, height_delta, block_count) == ([(96, 112)], 0, WIDTH // 16)
+
+    layout, regenerate = plan_update(_sections(), spans, height_delta, HEIGHT)
+    assert regenerate == [1]
+    assert layout[1]["html"] is None
+    assert [s["html"] for s in layout[::2] + layout[3:]] == [s["html"] for s in _sections()[::2] + _sections()[3:]]
+
+def test_truncation_shrinks_the_last_section():
+    new = _page()[:200]
+    assert diff_screenshots(_page(), new)[:2] == ([(200, 256)], -56)
+
+    layout, regenerate = _plan(new)
+    assert regenerate == [3]
+    assert [(s["top"], s["bottom"]) for s in layout] == [(0, 64), (64, 128), (128, 192), (192, 200)]
+    assert [s["html"] for s in layout[:3]] == [s["html"] for s in _sections()[:3]]
+
+def test_append_extends_the_last_section():
+    new = np.concatenate([_page(), _inserted(40)])
+    assert diff_screenshots(_page(), new)[:2] == ([(256, 256)], 40)
+
+    layout, regenerate = _plan(new)
+    assert regenerate == [3]
+    assert (layout[3]["top"], layout[3]["bottom"], layout[3]["prefix"]) == (192, 296, "s4")
+
+def test_insertion_at_the_top_shifts_the_sections_below():
+    new = np.concatenate([_inserted(40), _page()])
+    spans, height_delta, block_count = diff_screenshots(_page(), new)
+    assert (spans, height_delta) == ([(0, 0)], 40)
+    assert block_count == -(-40 // 16) * (WIDTH // 16)
+
+    layout, regenerate = _plan(new)
+    assert regenerate == [0]
+    assert (layout[0]["top"], layout[0]["bottom"], layout[0]["html"]) == (0, 104, None)
+    assert [(s["top"], s["bottom"], s["prefix"]) for s in layout[1:]] == [(104, 168, "s2"), (168, 232, "s3"), (232, 296, "s4")]
+    assert [s["html"] for s in layout[1:]] == [s["html"] for s in _sections()[1:]]
+
+def test_removing_a_whole_section_regenerates_nothing():
+    page = _page()
+    new = np.concatenate([page[:64], page[128:]])
+    assert diff_screenshots(page, new)[:2] == ([(64, 128)], -64)
+
+    layout, regenerate = _plan(new)
+    assert regenerate == []
+    assert [(s["top"], s["bottom"], s["prefix"]) for s in layout] == [(0, 64, "s1"), (64, 128, "s3"), (128, 192, "s4")]
+    assert all(s["html"] for s in layout)
+
+def test_split_region_covers_the_region_with_unused_prefixes():
+    rng = np.random.default_rng(0)
+    img = Image.fromarray(rng.integers(0, 256, (400, 100, 3), dtype=np.uint8))
+    section = {"top": 40, "bottom": 340, "prefix": "s2", "html": None}
+    taken = {"s1", "s2", "s2x2", "s3"}
+
+    split = _split_region(img, section, taken)
+    assert len(split) > 1
+    assert split[0]["top"] == 40 and split[-1]["bottom"] == 340
+    assert all(a["bottom"] == b["top"] for a, b in zip(split, split[1:]))
+    prefixes = [s["prefix"] for s in split]
+    assert prefixes[0] == "s2" and "s2x2" not in prefixes
+    assert len(set(prefixes)) == len(prefixes)
+    assert set(prefixes) <= taken
+    assert all(s["html"] is None for s in split)
@@ -0,0 +1,29 @@
+import threading
+import time
+from utils import jobs
+
+def test_shared_image_preprocesses_providers_concurrently(monkeypatch):
+    release_gemini = threading.Event()
+    calls = []
+
+    def preprocess(img_bytes, provider):
+        calls.append(provider)
+        if provider == "Google Gemini":
+            release_gemini.wait(5)
+        return provider, None
+
+    monkeypatch.setattr(jobs, "preprocess_image", preprocess)
+    shared = jobs._SharedImage(b"screenshot")
+    gemini_jobs = [threading.Thread(target=shared.get, args=("Google Gemini",)) for _ in range(2)]
+    for thread in gemini_jobs:
+        thread.start()
+    while "Google Gemini" not in calls:
+        time.sleep(0.001)
+    # OpenAI does not wait behind Gemini's preprocessing.
+    assert shared.get("OpenAI") == ("OpenAI", None)
+    assert all(thread.is_alive() for thread in gemini_jobs)
+    release_gemini.set()
+    for thread in gemini_jobs:
+        thread.join(5)
+    assert shared.get("Google Gemini") == ("Google Gemini", None)
+    assert sorted(calls) == ["Google Gemini", "OpenAI"] # Once per provider
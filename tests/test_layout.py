@@ -0,0 +1,58 @@
+import json
+import pytest
+from utils.layout import parse_layout, render_layout, count_nodes, MAX_DEPTH
+
+def _tree(root, **extra):
+    return json.dumps({"root": root, **extra})
+
+def test_parse_tolerates_fences_and_renders():
+    text = "```json\n" + _tree(
+        {"t": "col", "c": [{"t": "text", "tag": "h1", "c": "Hello <b>", "fs": 24, "fg": "primary"}, {"t": "img", "w": 120, "h": 80}]},
+        palette={"primary": "#123456"}, title="Demo"
+    ) + "\n```"
+    tree, error = parse_layout(text)
+    assert error is None and count_nodes(tree) == 3
+    html = render_layout(tree)
+    assert "<title>Demo</title>" in html
+    assert "Hello &lt;b&gt;" in html
+    assert "color:var(--primary)" in html and "--primary:#123456" in html
+    assert "add your image" in html
+
+def test_rendering_is_deterministic_and_shares_classes():
+    tree, _ = parse_layout(_tree({"t": "row", "c": [{"t": "text", "p": 8, "c": "a"}, {"t": "text", "p": 8, "c": "b"}]}))
+    html = render_layout(tree)
+    assert html == render_layout(tree)
+    assert html.count("{padding:8px}") == 1
+    assert html.count('<p class="k1">') == 2
+
+def test_style_presets_apply_and_node_wins():
+    tree, _ = parse_layout(_tree({"t": "text", "s": "card", "p": 4, "c": "x"}, styles={"card": {"p": 16, "r": 6}}))
+    html = render_layout(tree)
+    assert "padding:4px" in html and "border-radius:6px" in html
+
+@pytest.mark.parametrize("text, message", [
+    ("", "empty"),
+    ("no json here", "does not contain"),
+    ('{"root": 1}', "no \"root\""),
+    (_tree({"t": "video"}), "unknown type"),
+    (_tree({"t": "text", "c": [{"t": "text"}]}), "cannot have child nodes"),
+    (_tree({"t": "grid", "cols": 1e400}), "non-finite"),
+    (_tree({"t": "grid", "cols": 0}), "grid columns"),
+    ('{"root": {"w": NaN}}', "non-finite"),
+    (_tree({"t": "text", "tag": ["p"], "c": "x"}), "non-string tag"),
+    (_tree({"t": ["box"]}), "unknown type"),
+])
+def test_invalid_layouts_are_rejected(text, message):
+    tree, error = parse_layout(text)
+    assert tree is None and message in error
+
+def test_depth_and_json_nesting_limits():
+    root = {"t": "box"}
+    for _ in range(MAX_DEPTH + 1):
+        root = {"t": "box", "c": [root]}
+    assert "nested deeper" in parse_layout(_tree(root))[1]
+    assert parse_layout('{"root":' + '{"a":' * 100000 + "1" + "}" * 100001)[1] == "Layout output is nested too deeply."
+
+def test_disallowed_tags_fall_back():
+    tree, _ = parse_layout(_tree({"t": "text", "tag": "script", "c": "x"}))
+    assert "<script" not in render_layout(tree) and "<p" in render_layout(tree)
@@ -0,0 +1,16 @@
+from utils import leaderboard
+from utils.entry_store import EntryStore
+
+def test_runs_and_wins_from_several_writers_add_up(monkeypatch, tmp_path):
+    db_path = str(tmp_path / "leaderboard.sqlite3")
+    stats = {"provider_latency_s": 2.0, "completion_tokens": 100}
+    for _ in range(2): # Each store stands for another process sharing the data directory
+        monkeypatch.setattr(leaderboard, "_store", EntryStore(db_path, "Leaderboard"))
+        leaderboard.record_result("OpenAI", "gpt-4o", stats, "<html></html>", None)
+        leaderboard.record_result("OpenAI", "gpt-4o-mini", {}, None, "HTTP 500")
+    leaderboard.record_win("OpenAI", "gpt-4o")
+    rows = {row["model"]: row for row in leaderboard.get_leaderboard("OpenAI")}
+    assert rows["gpt-4o"]["runs"] == 2 and rows["gpt-4o"]["wins"] == 1
+    assert rows["gpt-4o"]["mean_completion_tokens"] == 100
+    assert rows["gpt-4o-mini"]["success_rate"] == 0.0
+    assert leaderboard.preferred_model("OpenAI", ["gpt-4o-mini", "gpt-4o"]) == "gpt-4o"
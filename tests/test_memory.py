@@ -0,0 +1,104 @@
+import base64
+import io
+import threading
+import time
+import pytest
+from PIL import Image
+
+from utils.config import IMAGE_MAX_PIXELS
+from utils.memory import MemoryBudget, RequestMemory, get_memory_status
+from utils.preprocessing import encode_data_url, make_thumbnail, ImageMemo
+from utils.similarity import perceptual_hashes
+from utils.tiling import split_into_bands
+
+def _wait_until(condition):
+    deadline = time.time() + 5
+    while not condition() and time.time() < deadline:
+        time.sleep(0.005)
+    assert condition()
+
+def _start(target, *args):
+    thread = threading.Thread(target=target, args=args, daemon=True)
+    thread.start()
+    return thread
+
+def test_waiting_requests_are_admitted_in_fifo_order():
+    budget = MemoryBudget(100)
+    budget.acquire(80)
+    admitted = []
+
+    def request(name, nbytes):
+        budget.acquire(nbytes)
+        admitted.append(name)
+
+    large = _start(request, "large", 60)
+    _wait_until(lambda: budget.status()["waiting"] == 1)
+    small = _start(request, "small", 10) # Would fit now, but must not overtake the large request
+    _wait_until(lambda: budget.status()["waiting"] == 2)
+    assert admitted == []
+
+    budget.release(80)
+    large.join(5)
+    small.join(5)
+    assert admitted == ["large", "small"]
+    assert budget.status() == {"limit_bytes": 100, "reserved_bytes": 70, "waiting": 0}
+
+def test_request_larger_than_budget_runs_alone():
+    budget = MemoryBudget(100)
+    budget.acquire(500)
+    assert budget.status()["reserved_bytes"] == 500
+
+    waiter = _start(budget.acquire, 1)
+    _wait_until(lambda: budget.status()["waiting"] == 1)
+    budget.release(500)
+    waiter.join(5)
+    assert budget.status()["reserved_bytes"] == 1
+
+def test_zero_limit_disables_budget():
+    budget = MemoryBudget(0)
+    budget.acquire(10**12)
+    budget.acquire(10**12)
+    assert budget.status() == {"limit_bytes": 0, "reserved_bytes": 2 * 10**12, "waiting": 0}
+
+def test_request_memory_releases_and_reports():
+    budget = MemoryBudget(1000)
+    stats = {}
+    with RequestMemory(stats, budget) as memory:
+        memory.reserve(600)
+        memory.reserve(200)
+        memory.shrink(300)
+        assert budget.status()["reserved_bytes"] == 300
+    assert budget.status()["reserved_bytes"] == 0
+    assert stats["memory"]["reserved_bytes"] == 800
+    assert stats["memory"]["queued_s"] >= 0
+    assert "memory_wait" in stats["timings"]
+
+def test_encode_data_url_matches_b64encode():
+    data = bytes(range(256)) * 41 + b"xy"
+    expected = "data:image/png;base64," + base64.b64encode(data).decode("ascii")
+    for chunk_size in (3, 4, 1000, 1 << 20):
+        assert encode_data_url("image/png", data, chunk_size) == expected
+    assert encode_data_url("image/png", b"") == "data:image/png;base64,"
+
+def _png(width, height, mode="RGB"):
+    buf = io.BytesIO()
+    Image.new(mode, (width, height), 1).save(buf, format="PNG")
+    return buf.getvalue()
+
+@pytest.mark.filterwarnings("ignore::PIL.Image.DecompressionBombWarning")
+def test_oversized_upload_is_rejected_before_decoding():
+    side = int(IMAGE_MAX_PIXELS ** 0.5) + 1
+    bomb = _png(side, side, mode="1") # A few KB that would decode to hundreds of MB
+    assert make_thumbnail(bomb) is None
+    assert ImageMemo().get(bomb) is None
+    for decode in (split_into_bands, perceptual_hashes):
+        with pytest.raises(ValueError, match="megapixels"):
+            decode(bomb)
+    assert get_memory_status()["reserved_bytes"] == 0
+
+def test_display_and_tiling_decodes_release_their_reservation():
+    tall = _png(1600, 4000)
+    assert make_thumbnail(tall) is not None
+    bands, width = split_into_bands(tall)
+    assert width == 1600 and bands[-1][1] == 4000
+    assert get_memory_status()["reserved_bytes"] == 0
@@ -0,0 +1,85 @@
+import base64
+import io
+import numpy as np
+import pytest
+from PIL import Image
+
+from benchmark import make_screenshot
+from utils.config import IMAGE_PROVIDER_LIMITS
+from utils.preprocessing import detect_mime_type, encode_data_url, preprocess_image, target_size
+
+def _decode_data_url(url):
+    header, _, payload = url.partition(",")
+    assert header.startswith("data:") and header.endswith(";base64")
+    return header[len("data:"):-len(";base64")], base64.b64decode(payload, validate=True)
+
+def _jpeg(img, orientation=None):
+    buf = io.BytesIO()
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    img.save(buf, format="JPEG", quality=95, exif=exif)
+    return buf.getvalue()
+
+@pytest.mark.parametrize("provider, size, expected", [
+    ("OpenAI", (800, 600), (800, 600)), # Never upscaled
+    ("OpenAI", (4000, 3000), (1024, 768)), # 2048px longest side, then 768px shortest side
+    ("OpenAI", (1440, 6000), (492, 2048)), # Already under 768px on the shortest side
+    ("Google Gemini", (2400, 1600), (2400, 1600)),
+    ("Google Gemini", (1440, 6000), (737, 3072)),
+    ("OpenRouter", (1920, 1080), (1568, 882)),
+])
+def test_target_size(provider, size, expected):
+    assert target_size(*size, IMAGE_PROVIDER_LIMITS[provider]) == expected
+
+@pytest.mark.parametrize("provider, expected_size", [
+    ("OpenAI", (1152, 768)),
+    ("Google Gemini", (2400, 1600)),
+    ("OpenRouter", (1568, 1045)),
+])
+def test_prepared_image_round_trips_through_the_data_url(provider, expected_size):
+    prepared, error = preprocess_image(make_screenshot(2400, 1600), provider)
+    assert error is None
+    assert (prepared.width, prepared.height) == expected_size
+    assert prepared.stats["final_format"] in IMAGE_PROVIDER_LIMITS[provider]["formats"]
+    assert prepared.mime_type == detect_mime_type(prepared.data)
+
+    for chunk_size in (999, 1000, 3 * 256 * 1024): # Chunks that are not whole 3-byte groups are rounded down
+        mime_type, data = _decode_data_url(encode_data_url(prepared.mime_type, prepared.data, chunk_size))
+        assert (mime_type, data) == (prepared.mime_type, prepared.data)
+    with Image.open(io.BytesIO(data)) as img:
+        assert img.size == expected_size
+        assert Image.MIME[img.format] == prepared.mime_type
+
+def test_smallest_allowed_format_is_chosen():
+    # Noise compresses far better lossily; OpenRouter allows PNG and JPEG only.
+    rng = np.random.default_rng(0)
+    noise = Image.fromarray(rng.integers(0, 256, (300, 400, 3), dtype=np.uint8))
+    buf = io.BytesIO()
+    noise.save(buf, format="PNG")
+    prepared, error = preprocess_image(buf.getvalue(), "OpenRouter")
+    assert error is None
+    assert (prepared.stats["final_format"], prepared.mime_type) == ("JPEG", "image/jpeg")
+    assert prepared.stats["final_bytes"] == len(prepared.data) < len(buf.getvalue())
+
+def test_exif_orientation_is_applied():
+    img = Image.new("RGB", (400, 100), (255, 255, 255))
+    img.paste((255, 0, 0), (0, 0, 40, 40)) # Marks the stored top-left corner
+    prepared, error = preprocess_image(_jpeg(img, orientation=6), "Google Gemini")
+    assert error is None
+    assert prepared.stats["original_size"] == (400, 100)
+    assert (prepared.width, prepared.height) == (100, 400)
+
+    with Image.open(io.BytesIO(prepared.data)) as out:
+        assert out.size == (100, 400)
+        assert not out.getexif().get(0x0112) # Metadata is stripped, so viewers do not rotate it again
+        red, green, _ = out.convert("RGB").getpixel((80, 20)) # Orientation 6 turns the top-left corner to the top right
+        assert red > 200 and green < 60
+
+def test_rotated_jpeg_is_downscaled_to_the_oriented_target():
+    img = Image.new("RGB", (4000, 1000), (240, 240, 240))
+    prepared, error = preprocess_image(_jpeg(img, orientation=6), "OpenAI")
+    assert error is None
+    assert (prepared.width, prepared.height) == target_size(1000, 4000, IMAGE_PROVIDER_LIMITS["OpenAI"]) == (512, 2048)
+    with Image.open(io.BytesIO(prepared.data)) as out:
+        assert out.size == (512, 2048)
@@ -0,0 +1,43 @@
+import threading
+import time
+import pytest
+from utils import generation
+from utils.resilience import CircuitOpenError, call_with_retries, get_circuit_breaker
+
+class _Transient(Exception):
+    pass
+
+def test_breaker_is_per_api_key(monkeypatch):
+    monkeypatch.setattr("utils.resilience.is_retryable", lambda e: isinstance(e, _Transient))
+    monkeypatch.setattr("utils.resilience.backoff_delay", lambda attempt, retry_after=None: 0)
+
+    def failing():
+        raise _Transient("429")
+
+    for _ in range(3):
+        with pytest.raises((_Transient, CircuitOpenError)):
+            call_with_retries("TestProvider", failing, max_attempts=3, api_key="exhausted-key")
+    assert get_circuit_breaker("TestProvider", "exhausted-key").state() == "open"
+    assert get_circuit_breaker("TestProvider", "other-key").state() == "closed"
+    assert call_with_retries("TestProvider", lambda: "ok", api_key="other-key") == "ok"
+
+def test_hedge_merges_only_the_winners_stats(monkeypatch):
+    monkeypatch.setattr(generation, "HEDGE_AFTER_SECONDS", 0.05)
+    release_primary = threading.Event()
+
+    def attempt(model_id, attempt_stats):
+        if model_id == "slow":
+            release_primary.wait(5)
+            attempt_stats.update(finish_reason="length", completion_tokens=999)
+            return "primary", None
+        attempt_stats.update(finish_reason="stop", completion_tokens=10, timings={"provider_call": 0.1})
+        return "fallback", None
+
+    stats = {"timings": {"cache_lookup": 0.01}}
+    text, error, used_fallback = generation._attempt_hedged("TestProvider", attempt, "slow", "fast", stats)
+    release_primary.set()
+    time.sleep(0.05) # Let the losing call finish and write its own stats
+    assert (text, error, used_fallback) == ("fallback", None, True)
+    assert stats["finish_reason"] == "stop" and stats["completion_tokens"] == 10
+    assert stats["hedged_to"] == "fast"
+    assert stats["timings"] == {"cache_lookup": 0.01, "provider_call": 0.1}
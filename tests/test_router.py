@@ -0,0 +1,27 @@
+import os
+import subprocess
+import sys
+from utils import router
+from utils.entry_store import EntryStore
+
+_REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_OBSERVE = """
+from utils.router import record_observation
+for _ in range(10):
+    record_observation("OpenAI", "gpt-4o", {"provider_latency_s": 1.0, "completion_tokens": 100}, None)
+"""
+
+def test_processes_sharing_the_data_dir_keep_each_others_observations(tmp_path):
+    env = {**os.environ, "UI_CLONER_DATA_DIR": str(tmp_path)}
+    processes = [subprocess.Popen([sys.executable, "-c", _OBSERVE], cwd=_REPO, env=env) for _ in range(2)]
+    assert [process.wait(60) for process in processes] == [0, 0]
+    entry = EntryStore(str(tmp_path / "router_stats.sqlite3"), "Router").get("OpenAI|gpt-4o")
+    assert entry["calls"] == 20
+    assert len(entry["latencies_s"]) == 20
+
+def test_cache_hits_are_not_observed(monkeypatch, tmp_path):
+    monkeypatch.setattr(router, "_store", EntryStore(str(tmp_path / "router.sqlite3"), "Router"))
+    router.record_observation("OpenAI", "gpt-4o", {"provider_latency_s": 1.0, "cache_hit": True}, None)
+    router.record_observation("OpenAI", "gpt-4o", {"provider_latency_s": 2.0}, "HTTP 500")
+    entry = router.get_model_stats("OpenAI", "gpt-4o")
+    assert entry["calls"] == 1 and entry["error_rate"] == 1.0 and entry["latencies_s"] == []
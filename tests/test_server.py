@@ -0,0 +1,32 @@
+import os
+import pytest
+
+pytest.importorskip("openai")
+
+from benchmark import make_screenshot
+from server import GenerationService
+from utils import config
+from utils.jobs import Job
+from utils.stub_server import StubServer, StubConfig
+
+def test_compaction_runs_on_the_worker_processes(monkeypatch):
+    service = GenerationService(concurrency=1, queue_depth=1, processes=2)
+    try:
+        assert service._offload(os.getpid) != os.getpid()
+        offloaded = []
+        run_on_workers = service._offload
+
+        def recording_offload(fn, *args):
+            offloaded.append(fn.__name__)
+            return run_on_workers(fn, *args)
+
+        monkeypatch.setattr(service, "_offload", recording_offload)
+        with StubServer(StubConfig(latency_s=0, html_bytes=5000)) as stub:
+            monkeypatch.setitem(config.PROVIDER_BASE_URLS, "OpenAI", stub.base_url)
+            job = Job(id="j1", mode="blocking", provider="OpenAI", model_id="gpt-4o", label="", image=None)
+            html, error = service._generate(job, "sk-server", make_screenshot(64, 64), use_cache=False)
+        assert error is None and html.rstrip().endswith("</html>")
+        assert offloaded == ["compact_html"]
+        assert job.stats["compaction"]["output_bytes"] <= job.stats["compaction"]["input_bytes"]
+    finally:
+        service.close()
@@ -0,0 +1,67 @@
+import io
+import random
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+from utils import similarity
+from utils.similarity import MultiIndexHash, hamming, perceptual_hashes, index_screenshot, find_similar, clear_similarity_index
+
+def _screenshot(seed, width=800, height=1200, shift=0, fmt="PNG"):
+    rng = random.Random(seed)
+    img = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(img)
+    for _ in range(40):
+        x, y = rng.randrange(width - 200), rng.randrange(height - 100) + shift
+        draw.rectangle((x, y, x + rng.randrange(40, 200), y + rng.randrange(20, 100)), fill=tuple(rng.randrange(256) for _ in range(3)))
+    buffer = io.BytesIO()
+    img.save(buffer, fmt)
+    return buffer.getvalue()
+
+def _flip(value, bits):
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+@pytest.mark.parametrize("has_bitwise_count", [True, False])
+def test_popcount_matches_python(monkeypatch, has_bitwise_count):
+    if not has_bitwise_count:
+        monkeypatch.delattr(np, "bitwise_count", raising=False) # The NumPy 1.x path
+    values = [0, 1, (1 << 64) - 1, 0x8000000000000001] + [random.Random(i).getrandbits(64) for i in range(100)]
+    counts = similarity._popcount(np.array(values, dtype=np.uint64))
+    assert [int(count) for count in counts] == [value.bit_count() for value in values]
+
+def test_multi_index_search_matches_brute_force():
+    rng = random.Random(7)
+    index = MultiIndexHash(chunks=4)
+    entries = [(rng.getrandbits(64), rng.getrandbits(64)) for _ in range(10000)] # Sorted tables plus an unsorted tail
+    for phash, dhash in entries:
+        index.add(phash, dhash)
+    queries = [(_flip(entries[i][0], rng.sample(range(64), rng.randrange(12))), _flip(entries[i][1], rng.sample(range(64), 3))) for i in range(0, 10000, 97)]
+    queries.append((rng.getrandbits(64), rng.getrandbits(64)))
+    for phash, dhash in queries:
+        expected = sorted(
+            (hamming(p, phash), hamming(d, dhash), row) for row, (p, d) in enumerate(entries)
+            if hamming(p, phash) <= 8 and hamming(d, dhash) <= 8
+        )
+        found = index.search(phash, dhash, 8)
+        assert sorted((p, d, row) for row, p, d in found) == expected
+        assert [(p, d) for _, p, d in found] == sorted((p, d) for _, p, d in found) # Closest first
+
+def test_hashes_are_stable_under_recompression_and_small_shifts():
+    original = perceptual_hashes(_screenshot(1))
+    for variant in (_screenshot(1, fmt="JPEG"), _screenshot(1, shift=4)):
+        phash, dhash, size = perceptual_hashes(variant)
+        assert size == (800, 1200)
+        assert hamming(phash, original[0]) <= 8 and hamming(dhash, original[1]) <= 8
+    other = perceptual_hashes(_screenshot(2))
+    assert hamming(other[0], original[0]) > 8
+
+def test_index_and_find_similar_roundtrip():
+    clear_similarity_index()
+    index_screenshot(_screenshot(1), "key-1", "OpenAI", "gpt-4o")
+    index_screenshot(_screenshot(2), "key-2", "OpenAI", "gpt-4o")
+    matches = find_similar(_screenshot(1, fmt="JPEG"))
+    assert [match.cache_key for match in matches] == ["key-1"]
+    assert matches[0].size == (800, 1200) and matches[0].provider == "OpenAI"
+    clear_similarity_index()
+    assert find_similar(_screenshot(1)) == []
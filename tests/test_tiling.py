@@ -0,0 +1,14 @@
+from utils.tiling import merge_css, stitch_fragments
+
+def test_merge_css_keeps_last_duplicate():
+    merged = merge_css([".a{color:red}", ".a{color:blue}", ".a {color:red}"])
+    assert merged.split("\n") == [".a{color:blue}", ".a {color:red}"]
+
+def test_stitch_fragments_merges_styles_in_order():
+    page = stitch_fragments([
+        "<html><head><style>.a{color:red}</style></head><body><p>1</p></body></html>",
+        "<html><head><style>.a{color:blue}\n.a{color:red}</style></head><body><p>2</p></body></html>",
+    ])
+    assert page.count("<style>") == 1
+    assert page.index("color:blue") < page.index("color:red")
+    assert page.index("<p>1</p>") < page.index("<p>2</p>")
@@ -0,0 +1,161 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from .config import CACHE_DB_PATH, CACHE_MAX_BYTES, CACHE_MAX_AGE
+
+# --- Hit/Miss Counters (process-wide, shared by all Streamlit sessions) ---
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    html TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_access REAL NOT NULL
+)
+"""
+
+_init_lock = threading.Lock()
+_initialized_paths = set()
+
+def make_cache_key(img_bytes, provider, model_id, prompt, params=None):
+    """Builds a content-addressed key from the image bytes and everything that shapes the output."""
+    digest = hashlib.sha256()
+    digest.update(img_bytes)
+    meta = json.dumps(
+        {"provider": provider, "model": model_id, "prompt": prompt, "params": params or {}},
+        sort_keys=True,
+        default=str,
+    )
+    digest.update(b"\0")
+    digest.update(meta.encode("utf-8"))
+    return digest.hexdigest()
+
+def _connect(db_path):
+    """Opens a connection with settings that tolerate several concurrent readers/writers."""
+    if db_path not in _initialized_paths:
+        with _init_lock:
+            if db_path not in _initialized_paths:
+                os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+                conn = sqlite3.connect(db_path, timeout=30)
+                try:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute(_SCHEMA)
+                    conn.execute("CREATE INDEX IF NOT EXISTS idx_results_last_access ON results(last_access)")
+                    conn.commit()
+                finally:
+                    conn.close()
+                _initialized_paths.add(db_path)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def _bump(counter, amount=1):
+    with _stats_lock:
+        _stats[counter] += amount
+
+def get_cached_result(key, db_path=CACHE_DB_PATH, max_age=CACHE_MAX_AGE):
+    """Returns the cached HTML for a key, or None on a miss or expired entry."""
+    try:
+        conn = _connect(db_path)
+        try:
+            now = time.time()
+            row = conn.execute("SELECT html, created FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                _bump("misses")
+                return None
+            html, created = row
+            if now - created > max_age:
+                with conn:
+                    conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                _bump("misses")
+                _bump("evictions")
+                return None
+            with conn:
+                conn.execute("UPDATE results SET last_access = ? WHERE key = ?", (now, key))
+            _bump("hits")
+            return html
+        finally:
+            conn.close()
+    except (sqlite3.Error, OSError) as e:
+        # The cache must never break generation (e.g. an unusable data dir); treat errors as a miss.
+        logging.warning(f"Result cache read failed: {e}")
+        _bump("misses")
+        return None
+
+def store_result(key, html, db_path=CACHE_DB_PATH, max_bytes=CACHE_MAX_BYTES, max_age=CACHE_MAX_AGE):
+    """Stores generated HTML under a key and evicts expired/least-recently-used entries."""
+    if not html:
+        return
+    size = len(html.encode("utf-8"))
+    if size > max_bytes:
+        logging.info(f"Result cache: skipping entry of {size} bytes (larger than cache budget).")
+        return
+    try:
+        conn = _connect(db_path)
+        try:
+            now = time.time()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO results (key, html, size, created, last_access) VALUES (?, ?, ?, ?, ?)",
+                    (key, html, size, now, now),
+                )
+            _bump("writes")
+            _evict(conn, now, max_bytes, max_age)
+        finally:
+            conn.close()
+    except (sqlite3.Error, OSError) as e:
+        logging.warning(f"Result cache write failed: {e}")
+
+def _evict(conn, now, max_bytes, max_age):
+    """Drops entries older than max_age, then the least recently used until under max_bytes."""
+    with conn:
+        expired = conn.execute("DELETE FROM results WHERE created < ?", (now - max_age,)).rowcount
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        evicted = 0
+        if total > max_bytes:
+            for key, size in conn.execute("SELECT key, size FROM results ORDER BY last_access ASC").fetchall():
+                if total <= max_bytes:
+                    break
+                conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                total -= size
+                evicted += 1
+    if expired or evicted:
+        _bump("evictions", expired + evicted)
+        logging.info(f"Result cache: evicted {expired} expired and {evicted} LRU entries.")
+
+def get_cache_stats(db_path=CACHE_DB_PATH):
+    """Returns hit/miss counters for this process plus the current size of the cache."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["entries"] = 0
+    stats["bytes"] = 0
+    try:
+        conn = _connect(db_path)
+        try:
+            stats["entries"], stats["bytes"] = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results"
+            ).fetchone()
+        finally:
+            conn.close()
+    except (sqlite3.Error, OSError) as e:
+        logging.warning(f"Result cache stats unavailable: {e}")
+    return stats
+
+def clear_cache(db_path=CACHE_DB_PATH):
+    """Removes every cached result."""
+    try:
+        conn = _connect(db_path)
+        try:
+            with conn:
+                conn.execute("DELETE FROM results")
+        finally:
+            conn.close()
+    except (sqlite3.Error, OSError) as e:
+        logging.warning(f"Result cache clear failed: {e}")
@@ -0,0 +1,130 @@
+import json
+import logging
+import os
+import threading
+import time
+from .clients import key_fingerprint
+from .config import CATALOG_PATH, CATALOG_TTL, CATALOG_MAX_AGE, CATALOG_RETRY_BACKOFF
+
+# --- Persistent Model Catalog ---
+# Listings are stored per (provider, key fingerprint) so the raw API key is never written to disk.
+# Each entry: {"fetched_at": unix time, "models": [model record, ...]} where a model record is
+#   {"id", "display", "vision": True/False/None, "free": True/False/None, "context": int/None}
+# After a failed background refresh the entry also holds "failures" and "retry_at" (unix time).
+_lock = threading.Lock()
+_index = None # entry key -> entry, loaded from CATALOG_PATH on first use
+_capabilities = {} # (provider, model id) -> model record, for constant-time lookups
+_refreshing = set()
+
+def _entry_key(provider, api_key):
+    return f"{provider}:{key_fingerprint(api_key)}"
+
+def _index_capabilities(provider, models):
+    for record in models:
+        _capabilities[(provider, record["id"])] = record
+
+def _load_locked():
+    global _index
+    if _index is not None:
+        return
+    _index = {}
+    try:
+        with open(CATALOG_PATH, encoding="utf-8") as f:
+            _index = json.load(f)
+    except FileNotFoundError:
+        pass
+    except (OSError, json.JSONDecodeError) as e:
+        logging.warning(f"Model catalog: ignoring unreadable index {CATALOG_PATH}: {e}")
+    for entry_key, entry in _index.items():
+        _index_capabilities(entry_key.split(":", 1)[0], entry.get("models", []))
+
+def _save_locked():
+    try:
+        os.makedirs(os.path.dirname(CATALOG_PATH) or ".", exist_ok=True)
+        tmp_path = f"{CATALOG_PATH}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(_index, f)
+        os.replace(tmp_path, CATALOG_PATH)
+    except OSError as e:
+        logging.warning(f"Model catalog: could not persist index: {e}")
+
+def _store(provider, api_key, models):
+    with _lock:
+        _load_locked()
+        _index[_entry_key(provider, api_key)] = {"fetched_at": time.time(), "models": models}
+        _index_capabilities(provider, models)
+        _save_locked()
+
+def _record_failure(provider, api_key):
+    with _lock:
+        _load_locked()
+        entry = _index.get(_entry_key(provider, api_key))
+        if entry is None:
+            return
+        entry["failures"] = entry.get("failures", 0) + 1
+        delay = min(CATALOG_RETRY_BACKOFF * 2 ** (entry["failures"] - 1), CATALOG_TTL)
+        entry["retry_at"] = time.time() + delay
+        _save_locked()
+
+def _refresh_in_background(provider, api_key, fetch_fn):
+    entry_key = _entry_key(provider, api_key)
+    with _lock:
+        if entry_key in _refreshing:
+            return
+        _refreshing.add(entry_key)
+
+    def run():
+        try:
+            models, error_message = fetch_fn(api_key)
+            if error_message:
+                _record_failure(provider, api_key)
+                logging.warning(f"Model catalog: background refresh for {provider} failed, keeping cached list. {error_message}")
+            else:
+                _store(provider, api_key, models)
+                logging.info(f"Model catalog: refreshed {provider} listing ({len(models)} models).")
+        finally:
+            with _lock:
+                _refreshing.discard(entry_key)
+
+    threading.Thread(target=run, name=f"catalog-refresh-{provider}", daemon=True).start()
+
+def get_models(provider, api_key, fetch_fn):
+    """Returns (model records, error_message) for a provider/key, serving stale data while revalidating.
+
+    `fetch_fn(api_key)` must return (model records, error_message). It is only called inline the
+    first time a key is seen (or when the stored listing is older than CATALOG_MAX_AGE); otherwise
+    stale listings are refreshed on a background thread and the stored list is returned at once.
+    A failed background refresh is retried after an exponential backoff rather than on every call.
+    """
+    with _lock:
+        _load_locked()
+        entry = _index.get(_entry_key(provider, api_key))
+    if entry is not None:
+        age = time.time() - entry["fetched_at"]
+        if age <= CATALOG_MAX_AGE:
+            if age > CATALOG_TTL and time.time() >= entry.get("retry_at", 0):
+                _refresh_in_background(provider, api_key, fetch_fn)
+            return entry["models"], None
+
+    models, error_message = fetch_fn(api_key)
+    if not error_message:
+        _store(provider, api_key, models)
+    return models, error_message
+
+def get_model_capabilities(provider, model_id):
+    """Returns the catalog record for a model (vision, free, context), or None if it was never listed."""
+    with _lock:
+        _load_locked()
+        return _capabilities.get((provider, model_id))
+
+def matches_known_model(model_id, known_models):
+    """Checks a model ID against a set of known base names in constant time.
+
+    Dated or suffixed variants match their base name, e.g. 'gpt-4o-2024-08-06' -> 'gpt-4o' and
+    'models/gemini-1.5-pro-002' -> 'gemini-1.5-pro'.
+    """
+    parts = model_id.split("/")[-1].split("-")
+    for end in range(len(parts), 0, -1):
+        if "-".join(parts[:end]) in known_models:
+            return True
+    return False
@@ -0,0 +1,122 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from .config import (
+    PROVIDER_BASE_URLS,
+    CLIENT_POOL_MAX_CLIENTS,
+    CLIENT_IDLE_TIMEOUT,
+    CLIENT_MAX_CONNECTIONS,
+    CLIENT_KEEPALIVE_EXPIRY
+)
+from .sdk import load
+
+# --- Long-lived Client Pool ---
+# Entries are keyed by (provider, hashed key, base URL) so raw API keys never appear in pool keys
+# and two sessions with different keys never share (or reconfigure) a client.
+_pool = OrderedDict() # pool key -> [client, close_fn, last_used]
+_pool_lock = threading.Lock()
+_http_session = None
+
+def key_fingerprint(api_key):
+    """Returns a short, non-reversible identifier for an API key."""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+def _close_quietly(close_fn, pool_key):
+    try:
+        close_fn()
+    except Exception as e:
+        logging.warning(f"Client pool: error closing {pool_key[0]} client: {e}")
+
+def _evict_idle_locked(now):
+    """Closes clients unused for CLIENT_IDLE_TIMEOUT. Caller holds _pool_lock."""
+    while _pool:
+        pool_key, (_, close_fn, last_used) = next(iter(_pool.items()))
+        if now - last_used < CLIENT_IDLE_TIMEOUT:
+            break
+        _pool.popitem(last=False)
+        logging.info(f"Client pool: closing idle {pool_key[0]} client.")
+        _close_quietly(close_fn, pool_key)
+
+def _get_or_create(pool_key, factory):
+    now = time.monotonic()
+    with _pool_lock:
+        _evict_idle_locked(now)
+        entry = _pool.get(pool_key)
+        if entry is not None:
+            entry[2] = now
+            _pool.move_to_end(pool_key)
+            return entry[0]
+        client, close_fn = factory()
+        _pool[pool_key] = [client, close_fn, now]
+        logging.info(f"Client pool: created {pool_key[0]} client ({len(_pool)} pooled).")
+        while len(_pool) > CLIENT_POOL_MAX_CLIENTS:
+            # Least recently used; may still be referenced by an in-flight call, so it is
+            # dropped rather than closed and its connections are released once unreferenced.
+            _pool.popitem(last=False)
+        return client
+
+def get_openai_client(provider, api_key):
+    """Returns a pooled OpenAI-compatible client for OpenAI or OpenRouter.
+
+    The endpoint comes from PROVIDER_BASE_URLS at call time, so pointing it at another server
+    (e.g. the benchmark stub) takes effect for new calls without restarting. The SDK's own retries
+    are disabled: call_with_retries is the only retry layer, so attempts, backoff and the circuit
+    breaker all see every request.
+    """
+    base_url = PROVIDER_BASE_URLS.get(provider)
+
+    def factory():
+        httpx, openai = load("httpx"), load("openai")
+        http_client = openai.DefaultHttpxClient(
+            limits=httpx.Limits(
+                max_connections=CLIENT_MAX_CONNECTIONS,
+                max_keepalive_connections=CLIENT_MAX_CONNECTIONS,
+                keepalive_expiry=CLIENT_KEEPALIVE_EXPIRY,
+            )
+        )
+        client = openai.OpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+        return client, client.close
+
+    return _get_or_create((provider, key_fingerprint(api_key), base_url), factory)
+
+def get_gemini_client(api_key, service="generative"):
+    """Returns a pooled Gemini service client ("generative" or "model") bound to one API key.
+
+    Unlike genai.configure(), this never touches process-global state, so concurrent sessions
+    with different keys cannot use each other's credentials.
+    """
+    def factory():
+        glm = load("google.ai.generativelanguage")
+        service_cls = {"generative": glm.GenerativeServiceClient, "model": glm.ModelServiceClient}[service]
+        client = service_cls(client_options={"api_key": api_key})
+        return client, client.transport.close
+
+    return _get_or_create((f"Google Gemini/{service}", key_fingerprint(api_key), None), factory)
+
+def get_http_session():
+    """Returns the shared requests session used for plain REST calls (keep-alive across calls)."""
+    global _http_session
+    if _http_session is None:
+        with _pool_lock:
+            if _http_session is None:
+                requests = load("requests")
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=CLIENT_MAX_CONNECTIONS)
+                session.mount("https://", adapter)
+                _http_session = session
+    return _http_session
+
+def close_idle_clients():
+    """Closes every client idle for longer than CLIENT_IDLE_TIMEOUT."""
+    with _pool_lock:
+        _evict_idle_locked(time.monotonic())
+
+def get_pool_stats():
+    """Returns how many clients are pooled, per provider."""
+    with _pool_lock:
+        counts = {}
+        for provider, _, _ in _pool:
+            counts[provider] = counts.get(provider, 0) + 1
+        return counts
@@ -0,0 +1,335 @@
+import gzip
+import html as html_lib
+import re
+from .config import COMPACTION_MIN_STYLE_REPEATS, COMPACTION_CLASS_PREFIX, DOWNLOAD_GZIP_LEVEL, DOWNLOAD_BROTLI_QUALITY
+from .sdk import load
+
+# --- Output Compaction ---
+# Generated clones repeat the same inline style= attributes on dozens of elements (the image
+# placeholder above all), restate rules and carry the model's indentation. compact_html() rewrites a
+# document in a fixed number of regex passes, so it stays linear on multi-megabyte output:
+#   1. inline styles used often enough become generated classes,
+#   2. duplicate CSS rules are dropped and adjacent rules merged,
+#   3. CSS, inline styles and text whitespace are minified.
+# Each step is skipped where it could change what is rendered (see _can_hoist and _keeps_whitespace).
+_HTML_TOKEN_RE = re.compile(
+    r"<!--.*?-->"
+    r"|<(script|style|pre|textarea)\b(?:\"[^\"]*\"|'[^']*'|[^'\">])*>.*?</\1\s*>"
+    r"|<[!/?]?[A-Za-z](?:\"[^\"]*\"|'[^']*'|[^'\">])*>"
+    r"|[^<]+|<",
+    re.DOTALL | re.IGNORECASE
+)
+_TAG_NAME_RE = re.compile(r"<([A-Za-z][^\s/>]*)")
+_ATTR_RE = re.compile(r"""\s*([^\s"'>/=]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+)))?""")
+_RAW_OPEN_RE = re.compile(r"(<[^>]*>)(.*)(</[^>]*>)$", re.DOTALL)
+_CSS_MINIFY_RE = re.compile(r"(\"(?:\\.|[^\"\\])*\"|'(?:\\.|[^'\\])*')|(/\*.*?\*/)|([ \t\r\n\f]+)", re.DOTALL)
+_CSS_SEMICOLON_RE = re.compile(r"(?P<string>\"(?:\\.|[^\"\\])*\"|'(?:\\.|[^'\\])*')|(?P<last>;+(?=\}))|;{2,}")
+_CSS_STRUCTURE_RE = re.compile(r"\"(?:\\.|[^\"\\])*\"|'(?:\\.|[^'\\])*'|[{}();]")
+_PRESERVED_WHITESPACE_RE = re.compile(r"white-space(?:-collapse)?\s*:\s*(?:pre|break-spaces|preserve)", re.IGNORECASE)
+_HOIST_BLOCKERS_RE = re.compile(r"!\s*important|\[\s*(?:style|class)\b|@keyframes", re.IGNORECASE)
+_NEWLINE_RUN_RE = re.compile(r"[ \t\r\f]*\n[ \t\r\n\f]*")
+_SPACE_RUN_RE = re.compile(r"[ \t\r\f]+")
+_HEAD_CLOSE_RE = re.compile(r"</head\s*>", re.IGNORECASE)
+_NO_SPACE_AFTER = frozenset("{};,>:(")
+_NO_SPACE_BEFORE = frozenset("{};,>)!")
+_WHITESPACE = frozenset(" \t\r\n\f")
+
+def minify_css(css):
+    """Removes comments and the whitespace CSS does not need. Strings are left untouched.
+
+    Whitespace before ':' is kept ('a :hover' is not 'a:hover'), and so is whitespace around '+'
+    and '-' ('calc(1px + 2px)').
+    """
+    def replace(match):
+        if match.group(1):
+            return match.group(1)
+        source, start, end = match.string, match.start(), match.end()
+        before = source[start - 1] if start else "{"
+        after = source[end] if end < len(source) else "}"
+        if before in _NO_SPACE_AFTER or after in _NO_SPACE_BEFORE:
+            return ""
+        if match.group(2) and (before in _WHITESPACE or after in _WHITESPACE):
+            return "" # A comment next to whitespace: the whitespace already separates the tokens
+        return " "
+
+    css = _CSS_MINIFY_RE.sub(replace, css).strip()
+    return _CSS_SEMICOLON_RE.sub(lambda m: m.group("string") or ("" if m.group("last") else ";"), css)
+
+def _split_rules(css):
+    """Splits minified CSS into top-level rules; at-rule blocks such as @media stay whole."""
+    rules, depth, start = [], 0, 0
+    for match in _CSS_STRUCTURE_RE.finditer(css):
+        token = match.group(0)
+        if token == "{":
+            depth += 1
+        elif token == "}":
+            depth -= 1
+            if depth == 0:
+                rules.append(css[start:match.end()])
+                start = match.end()
+        elif token == ";" and depth == 0: # Block-less at-rules such as @import or @charset
+            rules.append(css[start:match.end()])
+            start = match.end()
+    tail = css[start:].strip()
+    return [rule for rule in rules if rule.strip()] + ([tail] if tail else [])
+
+def _split_declarations(css):
+    """Splits a declaration list on ';' outside strings and parentheses (data: URLs contain ';')."""
+    declarations, depth, start = [], 0, 0
+    for match in _CSS_STRUCTURE_RE.finditer(css):
+        token = match.group(0)
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth = max(0, depth - 1)
+        elif token == ";" and depth == 0:
+            declarations.append(css[start:match.start()])
+            start = match.end()
+    declarations.append(css[start:])
+    return [declaration for declaration in declarations if declaration.strip()]
+
+def _style_rule_parts(rule):
+    """Returns (selector, body) of a plain style rule, or None for at-rules and nested rules."""
+    if rule.startswith("@") or rule.count("{") != 1 or not rule.endswith("}"):
+        return None
+    selector, body = rule[:-1].split("{", 1)
+    return selector, body
+
+def compact_css(css, counts):
+    """Minifies a stylesheet, drops repeated rules and merges adjacent ones. Updates `counts`.
+
+    Of identical rules only the last is kept: it is the one that wins the cascade, so the earlier
+    copies never apply. Only adjacent rules are merged (same selector, or same declarations),
+    which cannot reorder anything.
+    """
+    rules = _split_rules(minify_css(css))
+    seen = set()
+    kept = []
+    for rule in reversed(rules):
+        if "{" in rule and rule in seen:
+            counts["duplicate_rules"] += 1
+            continue
+        seen.add(rule)
+        kept.append(rule)
+    kept.reverse()
+
+    merged = []
+    for rule in kept:
+        parts = _style_rule_parts(rule)
+        previous = _style_rule_parts(merged[-1]) if merged and parts else None
+        if previous:
+            (selector, body), (previous_selector, previous_body) = parts, previous
+            if selector == previous_selector:
+                merged[-1] = f"{selector}{{{previous_body};{body}}}" if previous_body and body else f"{selector}{{{previous_body or body}}}"
+                counts["merged_rules"] += 1
+                continue
+            # A selector list is dropped entirely if one selector is invalid, so vendor pseudo-classes stay apart.
+            if body == previous_body and ":-" not in selector and ":-" not in previous_selector:
+                merged[-1] = f"{previous_selector},{selector}{{{body}}}"
+                counts["merged_rules"] += 1
+                continue
+        merged.append(rule)
+    return "".join(merged)
+
+def _tag_attributes(tag):
+    """Returns [(name, value, quote, span)] of an opening tag; value is None for bare attributes."""
+    name_match = _TAG_NAME_RE.match(tag)
+    if not name_match:
+        return []
+    attributes = []
+    for match in _ATTR_RE.finditer(tag, name_match.end(), len(tag) - 1):
+        if match.group(2) is not None:
+            value, quote = match.group(2), '"'
+        elif match.group(3) is not None:
+            value, quote = match.group(3), "'"
+        else:
+            value, quote = match.group(4), ""
+        attributes.append((match.group(1).lower(), value, quote, match.span()))
+    return attributes
+
+def _normalize_style(value, memo):
+    """Returns the minified declarations of a style attribute value, or None if it cannot be hoisted.
+
+    `memo` maps raw values to results; generated pages repeat the same few styles many times.
+    """
+    if value in memo:
+        return memo[value]
+    css = html_lib.unescape(value)
+    declarations = None
+    if css.strip() and "<" not in css and "{" not in css and "}" not in css:
+        declarations = minify_css(css).rstrip(";")
+    memo[value] = declarations
+    return declarations
+
+def _quote_attribute(value, quote):
+    value = value.replace("&", "&amp;")
+    return value.replace('"', "&quot;") if quote == '"' else value.replace("'", "&#39;")
+
+def _can_hoist(tokens):
+    """Hoisting is only rendering-neutral in documents without scripts, !important, [style]/[class]
+    selectors or animations: the generated rules are !important so they still beat every stylesheet
+    rule, as the inline styles did. Inline styles with !important of their own are left inline."""
+    for kind, text in tokens:
+        if kind == "raw" and text[1:7].lower() == "script":
+            return False
+        if kind == "raw" and text[1:6].lower() == "style" and _HOIST_BLOCKERS_RE.search(text):
+            return False
+    return True
+
+def _keeps_whitespace(document):
+    """True if any element may preserve whitespace, in which case text is not collapsed."""
+    return _PRESERVED_WHITESPACE_RE.search(document) is not None
+
+def _class_prefix(document):
+    """Returns a prefix for generated class names that does not occur anywhere in the document."""
+    prefix = COMPACTION_CLASS_PREFIX
+    while prefix in document:
+        prefix += "_"
+    return prefix
+
+def _tokenize(document):
+    tokens = []
+    for match in _HTML_TOKEN_RE.finditer(document):
+        text = match.group(0)
+        if match.group(1):
+            kind = "raw" # <script>, <style>, <pre>, <textarea> with their contents
+        elif text.startswith("<!--"):
+            kind = "comment"
+        elif text.startswith("<") and len(text) > 1:
+            kind = "tag"
+        else:
+            kind = "text"
+        tokens.append((kind, text))
+    return tokens
+
+def compact_html(document):
+    """Returns (compacted_html, stats) for a generated HTML document.
+
+    stats: input/output bytes, the reduction in percent, and how many inline styles were hoisted,
+    duplicate rules dropped and rules merged.
+    """
+    tokens = _tokenize(document)
+    counts = {"hoisted_styles": 0, "hoisted_attributes": 0, "duplicate_rules": 0, "merged_rules": 0}
+
+    # --- Pass 1: count repeated inline styles ---
+    style_uses = {}
+    style_memo = {}
+    has_stylesheet = False
+    if _can_hoist(tokens):
+        for kind, text in tokens:
+            if kind == "tag" and "style" in text.lower():
+                styles = [(value, quote) for name, value, quote, _ in _tag_attributes(text) if name == "style"]
+                if len(styles) == 1 and styles[0][1]:
+                    declarations = _normalize_style(styles[0][0], style_memo)
+                    if declarations and not _HOIST_BLOCKERS_RE.search(declarations): # Already !important: stays inline
+                        style_uses[declarations] = style_uses.get(declarations, 0) + 1
+            elif kind == "raw" and text[1:6].lower() == "style":
+                has_stylesheet = True
+    if not has_stylesheet and not _HEAD_CLOSE_RE.search(document):
+        style_uses = {} # Nowhere to put the generated rules
+
+    prefix = _class_prefix(document)
+    hoisted = {} # declarations -> class name
+    for declarations, uses in style_uses.items():
+        if uses < COMPACTION_MIN_STYLE_REPEATS:
+            continue
+        name = f"{prefix}{len(hoisted):x}"
+        # Each use swaps the declarations for the class name; the rule costs ".name{...}" plus "!important" per declaration.
+        rule_length = len(name) + 3 + len(declarations) + 10 * (declarations.count(";") + 1)
+        if uses * (len(declarations) - len(name)) > rule_length:
+            hoisted[declarations] = name
+
+    # --- Pass 2: rewrite ---
+    collapse_text = not _keeps_whitespace(document)
+    parts = []
+    first_stylesheet = None
+    for kind, text in tokens:
+        if kind == "comment":
+            if text.startswith("<!--[if"): # Conditional comments are markup in old browsers
+                parts.append(text)
+            continue
+        if kind == "text":
+            if collapse_text:
+                text = _SPACE_RUN_RE.sub(" ", _NEWLINE_RUN_RE.sub("\n", text))
+            parts.append(text)
+            continue
+        if kind == "raw" and text[1:6].lower() == "style":
+            open_tag, css, close_tag = _RAW_OPEN_RE.match(text).groups()
+            if first_stylesheet is None:
+                first_stylesheet = len(parts)
+            parts.append(f"{open_tag}{compact_css(css, counts)}{close_tag}")
+            continue
+        if kind == "tag" and "style" in text.lower():
+            text = _rewrite_style_attribute(text, hoisted, style_memo, counts)
+        parts.append(text)
+
+    if hoisted:
+        rules = "".join(
+            f".{name}{{{';'.join(d + '!important' for d in _split_declarations(declarations))}}}"
+            for declarations, name in hoisted.items()
+        )
+        counts["hoisted_styles"] = len(hoisted)
+        if first_stylesheet is not None:
+            stylesheet = parts[first_stylesheet]
+            close_start = stylesheet.rindex("</")
+            parts[first_stylesheet] = stylesheet[:close_start] + rules + stylesheet[close_start:]
+    compacted = "".join(parts)
+    if hoisted and first_stylesheet is None:
+        compacted = _HEAD_CLOSE_RE.sub(lambda m: f"<style>{rules}</style>{m.group(0)}", compacted, count=1)
+
+    input_bytes, output_bytes = len(document.encode("utf-8")), len(compacted.encode("utf-8"))
+    stats = {
+        "input_bytes": input_bytes,
+        "output_bytes": output_bytes,
+        "saved_percent": round(100 * (1 - output_bytes / input_bytes), 1) if input_bytes else 0.0,
+        **counts,
+    }
+    return compacted, stats
+
+def _rewrite_style_attribute(tag, hoisted, style_memo, counts):
+    """Replaces the style attribute of a tag by its generated class, or minifies it in place."""
+    attributes = _tag_attributes(tag)
+    styles = [attribute for attribute in attributes if attribute[0] == "style"]
+    if len(styles) != 1 or not styles[0][2]:
+        return tag
+    _, value, quote, (start, end) = styles[0]
+    declarations = _normalize_style(value, style_memo)
+    if declarations is None:
+        return tag
+    name = hoisted.get(declarations)
+    if name is None:
+        minified = _quote_attribute(declarations, quote)
+        return f"{tag[:start]} style={quote}{minified}{quote}{tag[end:]}" if len(minified) < len(value) else tag
+
+    counts["hoisted_attributes"] += 1
+    classes = [attribute for attribute in attributes if attribute[0] == "class"]
+    if not classes:
+        return f"{tag[:start]} class=\"{name}\"{tag[end:]}"
+    _, class_value, class_quote, (class_start, class_end) = classes[0]
+    class_quote = class_quote or '"' # An unquoted or bare class attribute gains quotes along with the name
+    class_attribute = f" class={class_quote}{f'{class_value} {name}'.strip()}{class_quote}"
+    # Edit the later span first so the earlier one's offsets stay valid.
+    edits = sorted([(start, end, ""), (class_start, class_end, class_attribute)], reverse=True)
+    for edit_start, edit_end, replacement in edits:
+        tag = tag[:edit_start] + replacement + tag[edit_end:]
+    return tag
+
+# --- Compressed Downloads ---
+def compression_formats():
+    """Returns the download encodings available here: gzip always, brotli if the package is installed."""
+    formats = ["gzip"]
+    try:
+        load("brotli")
+        formats.append("brotli")
+    except ImportError:
+        pass
+    return formats
+
+def compress_html(html, encoding):
+    """Returns the document compressed with "gzip" or "brotli", for a smaller download."""
+    data = html.encode("utf-8")
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=DOWNLOAD_GZIP_LEVEL, mtime=0)
+    if encoding == "brotli":
+        return load("brotli").compress(data, quality=DOWNLOAD_BROTLI_QUALITY)
+    raise ValueError(f"Unknown encoding: {encoding}")
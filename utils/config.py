@@ -1,14 +1,24 @@
+import os
+
 # --- Known Vision Models---
-KNOWN_GEMINI_VISION_MODELS = ["gemini-1.5-pro", "gemini-1.5-flash", "gemini-pro-vision"]
-KNOWN_OPENROUTER_FREE_VISION_MODELS = [
+# Sets, so capability checks are constant-time lookups (see utils/catalog.py)
+KNOWN_GEMINI_VISION_MODELS = frozenset({"gemini-1.5-pro", "gemini-1.5-flash", "gemini-pro-vision"})
+KNOWN_OPENROUTER_FREE_VISION_MODELS = frozenset({
     "nousresearch/nous-hermes-2-vision-alpha",
-]
+})
 # Add the user's requested default, but it's likely text-only
-KNOWN_OPENROUTER_FREE_MODELS_WITH_WARNING = [
+KNOWN_OPENROUTER_FREE_MODELS_WITH_WARNING = frozenset({
     "deepseek/deepseek-chat-v3-0324:free",
-]
+})
 # --- Known OpenAI Vision Models ---
-KNOWN_OPENAI_VISION_MODELS = ["gpt-4o", "gpt-4o-mini", "gpt-4-turbo"]
+KNOWN_OPENAI_VISION_MODELS = frozenset({"gpt-4o", "gpt-4o-mini", "gpt-4-turbo"})
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+# Endpoint overrides, e.g. a proxy or the local stub server used by benchmark.py (None = SDK default)
+PROVIDER_BASE_URLS = {
+    "OpenAI": os.environ.get("OPENAI_BASE_URL") or None,
+    "OpenRouter": os.environ.get("OPENROUTER_BASE_URL") or OPENROUTER_BASE_URL,
+}
 
 DEFAULT_OPENROUTER_MODEL_ID = "deepseek/deepseek-chat-v3-0324:free"
 DEFAULT_OPENAI_MODEL_ID = "gpt-4o"
@@ -17,4 +27,189 @@ DEFAULT_OPENAI_MODEL_ID = "gpt-4o"
 DEFAULT_PROVIDER = "OpenAI"
 
 # --- API Call Timeout ---
-API_TIMEOUT = 300 # seconds
\ No newline at end of file
+API_TIMEOUT = 300 # seconds
+# --- Sampling Parameters ---
+GEMINI_TEMPERATURE = 0.25
+OPENAI_TEMPERATURE = 0.1 # Used for both OpenAI and OpenRouter
+# --- Output Completion ---
+HTML_STOP_SEQUENCE = "</html>" # Generation stops here instead of running on into commentary
+CONTINUATION_MAX_ROUNDS = 2 # Follow-up requests when output is cut off by the length limit
+CONTINUATION_MAX_OVERLAP = 2000 # Characters compared when removing text a continuation repeats
+
+# --- Local Data Directory ---
+DATA_DIR = os.environ.get("UI_CLONER_DATA_DIR", os.path.join(os.path.expanduser("~"), ".ui_cloner"))
+
+# --- Result Cache ---
+CACHE_DB_PATH = os.path.join(DATA_DIR, "result_cache.sqlite3")
+CACHE_MAX_BYTES = 256 * 1024 * 1024 # Total size of cached HTML before LRU eviction
+CACHE_MAX_AGE = 7 * 24 * 3600 # seconds
+
+# --- Image Preprocessing ---
+# Images are downscaled to what each provider actually looks at, then re-encoded to the
+# smallest of the allowed formats. Token figures are estimates used for reporting only.
+IMAGE_PROVIDER_LIMITS = {
+    "OpenAI": {
+        "max_side": 2048, "short_side": 768, # 'detail: high' fits 2048x2048, then 768px shortest side
+        "formats": ("PNG", "JPEG", "WEBP"),
+        "token_tile": 512, "tokens_per_tile": 170, "base_tokens": 85,
+    },
+    "Google Gemini": {
+        "max_side": 3072, "short_side": None,
+        "formats": ("PNG", "JPEG", "WEBP"),
+        "token_tile": 768, "tokens_per_tile": 258, "base_tokens": 0, "single_tile_max_side": 384,
+    },
+    "OpenRouter": {
+        "max_side": 1568, "short_side": None, # Conservative limit that suits most routed vision models
+        "formats": ("PNG", "JPEG"),
+        "token_tile": 512, "tokens_per_tile": 170, "base_tokens": 85,
+    },
+}
+IMAGE_LOSSY_QUALITY = 90 # JPEG/WEBP quality; high enough to keep UI text legible
+IMAGE_THUMBNAIL_MAX_WIDTH = 1024 # px; uploads are shown in the UI at most this wide
+IMAGE_THUMBNAIL_MAX_BYTES = 1024 * 1024 # Narrow uploads larger than this are re-encoded for display too
+IMAGE_MEMO_MAX_ENTRIES = 32 # Decoded uploads (size, thumbnail) remembered per session
+IMAGE_MAX_BYTES = 50 * 1024 * 1024 # Larger uploads are refused before anything is decoded
+IMAGE_MAX_PIXELS = 60_000_000 # Checked from the header; a decoded image takes 4 bytes per pixel
+IMAGE_BASE64_CHUNK_BYTES = 3 * 256 * 1024 # Data URLs are base64-encoded this much at a time (a multiple of 3)
+
+# --- Memory Budget (utils/memory.py) ---
+# Generations reserve the memory they are expected to hold (decoded pixels while preprocessing, then
+# the request payload) and wait in line while the process total would exceed the budget. 0 disables it.
+MEMORY_BUDGET_BYTES = int(os.environ.get("UI_CLONER_MEMORY_BUDGET_MB", "1024")) * 1024 * 1024
+MEMORY_RSS_SAMPLE_INTERVAL = 0.05 # seconds between RSS samples while generations are running
+
+# --- Streaming Preview ---
+STREAM_PREVIEW_REFRESH_INTERVAL = 2.0 # seconds between live HTML preview re-renders (iframe reloads are costly)
+
+# --- Headless Entry Points (batch CLI) ---
+PROVIDER_ALIASES = {"openai": "OpenAI", "gemini": "Google Gemini", "openrouter": "OpenRouter"}
+PROVIDER_API_KEY_ENV_VARS = {
+    "OpenAI": "OPENAI_API_KEY",
+    "Google Gemini": "GOOGLE_API_KEY",
+    "OpenRouter": "OPENROUTER_API_KEY",
+}
+PROVIDER_REQUESTS_PER_MINUTE = {"OpenAI": 60, "Google Gemini": 15, "OpenRouter": 20}
+BATCH_DEFAULT_CONCURRENCY = 4
+SUPPORTED_IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+
+# --- Provider Client Pool ---
+CLIENT_POOL_MAX_CLIENTS = 32 # Distinct (provider, key, base URL) clients kept alive per process
+CLIENT_IDLE_TIMEOUT = 900 # seconds; must exceed API_TIMEOUT so an in-flight client is never closed
+CLIENT_MAX_CONNECTIONS = 20 # Per client
+CLIENT_KEEPALIVE_EXPIRY = 120 # seconds an idle HTTP connection stays open for reuse
+
+# --- Tiled Generation (tall full-page screenshots) ---
+TILING_MIN_ASPECT_RATIO = 2.5 # Height/width above which tiling is used
+TILING_TARGET_BAND_RATIO = 1.0 # Target band height as a multiple of the image width
+TILING_MIN_BAND_RATIO = 0.5
+TILING_MAX_BAND_RATIO = 1.6
+TILING_MAX_BANDS = 12
+TILING_MAX_WORKERS = 4
+TILING_UNIFORM_TOLERANCE = 6 # Max grey-level spread for a row to count as whitespace
+
+# --- Incremental Regeneration (updated screenshots of an already generated page) ---
+INCREMENTAL_TARGET_BAND_RATIO = 0.4 # Pages are generated in sections this tall (x width) so edits stay local
+INCREMENTAL_MAX_BANDS = 16
+INCREMENTAL_BLOCK_SIZE = 16 # px; screenshots are compared block by block
+INCREMENTAL_PIXEL_TOLERANCE = 24 # Per-channel difference ignored as compression noise or antialiasing
+INCREMENTAL_MAX_CHANGED_RATIO = 0.6 # Above this share of changed sections, the whole page is regenerated
+PROJECTS_DIR = os.path.join(DATA_DIR, "projects") # Saved baselines of named projects
+
+# --- Output Compaction (utils/compaction.py) ---
+COMPACT_OUTPUT = True # Compact full-page clones (hoist repeated inline styles, dedupe CSS, minify) before caching
+COMPACTION_MIN_STYLE_REPEATS = 2 # An inline style must be used this often to become a generated class
+COMPACTION_CLASS_PREFIX = "hc" # Generated class names are prefix + counter; lengthened if the page already uses it
+DOWNLOAD_GZIP_LEVEL = 9
+DOWNLOAD_BROTLI_QUALITY = 11 # Only used if the optional 'brotli' package is installed
+
+# --- Similar Screenshot Reuse (utils/similarity.py) ---
+SIMILARITY_DB_PATH = os.path.join(DATA_DIR, "similarity.sqlite3")
+SIMILARITY_MAX_DISTANCE = 8 # Differing bits (of 64) up to which two screenshots count as the same page
+SIMILARITY_INDEX_CHUNKS = 4 # Multi-index hashing: each 64-bit hash is split into this many lookup tables
+SIMILARITY_MAX_MATCHES = 3 # Earlier results offered for one upload
+
+# --- Site Mode (several pages of one site sharing one design system) ---
+SITE_MAX_PAGES = 12
+SITE_MAX_WORKERS = 4 # Pages generated in parallel once the design system exists
+SITE_STYLESHEET_NAME = "site.css"
+SITE_COMPONENTS_NAME = "components.html"
+
+# --- Model Comparison and Leaderboard ---
+COMPARE_MAX_MODELS = 6 # Models per comparison run
+LEADERBOARD_DB_PATH = os.path.join(DATA_DIR, "leaderboard.sqlite3")
+LEADERBOARD_LATENCY_SAMPLES = 50 # Recent latencies kept per model for the median
+
+# --- Automatic Model Routing ("Auto" model option) ---
+ROUTER_DB_PATH = os.path.join(DATA_DIR, "router_stats.sqlite3")
+ROUTER_LATENCY_BUDGET = 60.0 # seconds; default target for the routed request's expected latency
+ROUTER_LATENCY_SAMPLES = 50 # Recent latencies kept per model
+ROUTER_MIN_SAMPLES = 3 # Below this, a model's latency is assumed to be ROUTER_PRIOR_LATENCY
+ROUTER_PRIOR_LATENCY = 45.0 # seconds
+ROUTER_EWMA_ALPHA = 0.2 # Weight of the newest observation in the error rate and output length averages
+ROUTER_MAX_ERROR_RATE = 0.5 # Models failing more often than this are skipped
+ROUTER_ERROR_HALF_LIFE = 600 # seconds; a skipped model's error rate fades so it is eventually retried
+ROUTER_DEFAULT_OUTPUT_TOKENS = 4000 # Expected completion length before a model has been observed
+MODEL_PRICES_PER_MTOK = { # USD per million (input, output) tokens, matched on the model's base name
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4-turbo": (10.00, 30.00),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gemini-1.5-pro": (1.25, 5.00),
+    "gemini-1.5-flash": (0.075, 0.30),
+    "gemini-2.0-flash": (0.10, 0.40),
+}
+ROUTER_UNKNOWN_PRICE_PER_MTOK = (5.00, 15.00) # Assumed for unlisted paid models, so known prices win ties
+
+# --- Model Catalog ---
+CATALOG_PATH = os.path.join(DATA_DIR, "model_catalog.json")
+CATALOG_TTL = 3600 # seconds before a listing is refreshed in the background
+CATALOG_MAX_AGE = 7 * 24 * 3600 # seconds after which a listing is too old to serve while refreshing
+CATALOG_RETRY_BACKOFF = 60 # seconds before retrying a failed background refresh; doubles per failure, capped at CATALOG_TTL
+
+# --- Resilience (retries, circuit breaker, hedging) ---
+RETRY_MAX_ATTEMPTS = 4 # Including the first attempt
+RETRY_BASE_DELAY = 2.0 # seconds; doubled per attempt with full jitter
+RETRY_MAX_DELAY = 60.0 # seconds; also caps honoured Retry-After values
+CIRCUIT_FAILURE_THRESHOLD = 5 # Consecutive transient failures before a provider's circuit opens
+CIRCUIT_RESET_TIMEOUT = 60 # seconds an open circuit fails fast before letting a trial request through
+HEDGE_AFTER_SECONDS = 90 # Start the fallback model if the primary has not answered by then
+HEDGE_FALLBACK_MODELS = {
+    "OpenAI": "gpt-4o-mini",
+    "Google Gemini": "models/gemini-1.5-flash",
+    "OpenRouter": None,
+}
+
+# --- Instrumentation ---
+TRACE_LOG_PATH = os.path.join(DATA_DIR, "traces.jsonl")
+METRICS_PROM_PATH = os.path.join(DATA_DIR, "metrics.prom") # Prometheus text format, rewritten after each request
+METRICS_PORT = int(os.environ.get("UI_CLONER_METRICS_PORT", "0")) # Serve /metrics on this port when non-zero
+RECENT_TRACES_LIMIT = 50 # Requests kept in memory for the sidebar panel
+RECENT_RERUNS_LIMIT = 200 # Streamlit script runs whose durations are kept for the panel
+STAGE_SECONDS_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# --- Benchmarks (benchmark.py / utils/stub_server.py) ---
+BENCH_RESULTS_SCHEMA_VERSION = 1
+BENCH_RESULTS_PATH = os.path.join(DATA_DIR, "benchmark_results.json") # Default --output; keeps runs out of the source tree
+BENCH_IMAGE_RESOLUTIONS = ((800, 600), (1440, 900), (1920, 1080), (2560, 1440), (3840, 2160), (1440, 6000))
+BENCH_POSTPROCESS_SIZES_MB = (1, 4, 8)
+STUB_DEFAULT_MODELS = ("gpt-4o", "gpt-4o-mini")
+
+# --- Background Jobs (utils/jobs.py) ---
+JOB_MAX_WORKERS = 8 # Generations running at once across all sessions; more are queued
+JOB_STORE_MAX_FINISHED = 100 # Finished jobs kept in memory for their sessions to collect
+JOB_RESULT_TTL = 3600 # seconds a finished job is kept
+JOB_POLL_INTERVAL = 1.0 # seconds between UI refreshes while a session has unfinished jobs
+
+# --- HTTP API Service (server.py) ---
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8500
+SERVICE_CONCURRENCY = 8 # Generations running at once; each holds a thread while it waits on the provider
+SERVICE_QUEUE_DEPTH = 32 # Accepted jobs waiting for a worker; further uploads are answered 429
+SERVICE_PROCESSES = os.cpu_count() or 1 # Worker processes for image preprocessing and output compaction (1 = in the generation thread)
+SERVICE_MAX_UPLOAD_BYTES = 25 * 1024 * 1024
+SERVICE_MAX_HEADER_BYTES = 16 * 1024
+SERVICE_READ_CHUNK_BYTES = 256 * 1024 # Upload bytes read from the socket at a time
+SERVICE_RETRY_AFTER = 10 # seconds suggested to clients turned away with 429
+SERVICE_SSE_KEEPALIVE = 15 # seconds between comment lines on an idle event stream
@@ -0,0 +1,77 @@
+import copy
+import json
+import logging
+import os
+import sqlite3
+
+# --- Shared JSON Entries ---
+# Statistics that several processes learn at once (the Streamlit app, server.py and batch.py may
+# share DATA_DIR) are kept as one JSON document per key in a SQLite table. Every update reads the
+# current entry and writes it back in one write transaction, so no process overwrites what another
+# one recorded, unlike rewriting a whole file from a copy loaded at startup.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    entry TEXT NOT NULL -- JSON object
+)
+"""
+
+class EntryStore:
+    """JSON entries keyed by string in a SQLite file, safe to update from several processes.
+
+    Errors are logged (prefixed with `label`) and never raised: reads return nothing and updates
+    are dropped, so a broken data directory only costs the statistics.
+    """
+
+    def __init__(self, db_path, label):
+        self.db_path = db_path
+        self.label = label
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None) # Transactions are explicit
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(_SCHEMA)
+        return conn
+
+    def update(self, key, default, update_fn):
+        """Applies update_fn(entry) to the stored entry of `key` (a copy of `default` if there is none)."""
+        try:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE") # Other writers wait until this entry is written back
+                row = conn.execute("SELECT entry FROM entries WHERE key = ?", (key,)).fetchone()
+                entry = json.loads(row[0]) if row else copy.deepcopy(default)
+                update_fn(entry)
+                conn.execute("INSERT OR REPLACE INTO entries (key, entry) VALUES (?, ?)", (key, json.dumps(entry)))
+                conn.execute("COMMIT")
+            finally:
+                conn.close() # Rolls back an unfinished transaction
+        except (sqlite3.Error, OSError, ValueError) as e:
+            logging.warning(f"{self.label}: could not persist statistics: {e}")
+
+    def get(self, key):
+        """Returns the entry of `key`, or None."""
+        try:
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT entry FROM entries WHERE key = ?", (key,)).fetchone()
+            finally:
+                conn.close()
+            return json.loads(row[0]) if row else None
+        except (sqlite3.Error, OSError, ValueError) as e:
+            logging.warning(f"{self.label}: could not read statistics: {e}")
+            return None
+
+    def values(self):
+        """Returns every entry."""
+        try:
+            conn = self._connect()
+            try:
+                rows = conn.execute("SELECT entry FROM entries").fetchall()
+            finally:
+                conn.close()
+            return [json.loads(entry) for entry, in rows]
+        except (sqlite3.Error, OSError, ValueError) as e:
+            logging.warning(f"{self.label}: could not read statistics: {e}")
+            return []
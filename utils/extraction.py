@@ -0,0 +1,156 @@
+import logging
+import string
+
+# --- Incremental HTML Extraction ---
+# Model output is scanned chunk by chunk: each chunk is lowercased once (plus a few carried-over
+# characters, so markers split across chunks are still found), never the whole accumulated text.
+# Only A-Z are lowercased: str.lower() can change the length of a string ("İ" becomes two code
+# points), and offsets found in the lowercased window must be valid in the raw output.
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+_START_MARKERS = ("<!doctype html", "<html")
+_END_MARKER = "</html>"
+_FENCE_MARKER = "```html"
+_CARRY = max(len(marker) for marker in _START_MARKERS + (_END_MARKER, _FENCE_MARKER, "<head", "<body")) - 1
+
+class HtmlExtractor:
+    """Finds the HTML document inside streamed model output in a single pass.
+
+    Call feed() with each piece of output as it arrives; once `closed` is True the document is
+    complete and the rest of the output can be dropped. result() returns (html, error_message)
+    with the same rules as before: the document from <!DOCTYPE html>/<html> to </html>, else the
+    contents of a ```html block, else the raw text if it at least has <head> and <body>.
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self._parts = []
+        self._length = 0
+        self._carry = "" # Lowercased tail of the previous chunk
+        self.start = None # Offset of the document start in the raw output
+        self.end = None # Offset just past </html>
+        self._fence_start = None
+        self._saw_head = False
+        self._saw_body = False
+
+    @property
+    def closed(self):
+        return self.end is not None
+
+    @property
+    def started(self):
+        return self.start is not None
+
+    def feed(self, text):
+        """Consumes a chunk. Returns the part of it that belongs to the output: from the document start
+        (once found) up to </html>."""
+        if self.end is not None or not text:
+            return ""
+        window = self._carry + text.translate(_ASCII_LOWER)
+        base = self._length - len(self._carry) # Raw offset of window[0]
+
+        started_here = None
+        if self.start is None:
+            found = [i for i in (window.find(marker) for marker in _START_MARKERS) if i >= 0]
+            if found:
+                self.start = started_here = base + min(found)
+            elif self._fence_start is None:
+                i = window.find(_FENCE_MARKER)
+                if i >= 0:
+                    self._fence_start = base + i + len(_FENCE_MARKER)
+            self._saw_head = self._saw_head or "<head" in window
+            self._saw_body = self._saw_body or "<body" in window
+
+        if self.start is not None:
+            i = window.find(_END_MARKER, max(0, self.start - base))
+            if i >= 0:
+                self.end = base + i + len(_END_MARKER)
+
+        offset = self._length # Raw offset of text[0]
+        self._parts.append(text)
+        self._length += len(text)
+        self._carry = window[-_CARRY:]
+        # Anything before the document (a code fence, "Here is the code:") is left out.
+        begin = max(0, started_here - offset) if started_here is not None else 0
+        return text[begin:self.end - offset if self.end is not None else len(text)]
+
+    def extend(self, continuation, max_overlap):
+        """Splices a continuation of truncated output onto what was consumed. Returns the text it adds."""
+        restarted, addition = splice_continuation(self.text()[-max_overlap:], continuation)
+        if restarted:
+            logging.warning("Continuation restarted the document; keeping the new attempt.")
+            self._reset()
+        return self.feed(addition)
+
+    def text(self):
+        """Returns the raw output consumed so far."""
+        return "".join(self._parts)
+
+    def result(self, provider):
+        """Returns (html, error_message) for the output consumed so far."""
+        raw = self.text()
+        if not raw:
+            return raw, None
+        if self.start is not None:
+            if self.start > 0:
+                logging.info(f"{provider}: Dropped {self.start} characters of text before the HTML document.")
+            if self.end is not None:
+                return raw[self.start:self.end], None
+            # No </html> (cut off): drop a trailing code fence if the model managed to write one.
+            document = raw[self.start:].rstrip()
+            if document.endswith("```"):
+                document = document[:-3].rstrip()
+            return document, None
+        if self._fence_start is not None:
+            end = raw.find("```", self._fence_start)
+            logging.info("Extracted HTML from markdown code block.")
+            return raw[self._fence_start:end if end >= 0 else len(raw)].strip(), None
+        if self._saw_head and self._saw_body:
+            logging.warning("HTML detected but missing doctype. Proceeding cautiously.")
+            return raw, None
+        error_message = f"{provider}: Generated output does not appear to be valid HTML code. It might be an error message or explanation instead."
+        logging.error(error_message)
+        return None, error_message
+
+def extract_html(provider, generated_html):
+    """Validates complete model output and strips anything around the document. Returns (html, error_message)."""
+    if not generated_html:
+        return generated_html, None
+    extractor = HtmlExtractor()
+    extractor.feed(generated_html)
+    return extractor.result(provider)
+
+# --- Continuations ---
+_MIN_OVERLAP = 8 # Shorter repeats are more likely coincidence ("</div>") than a restated tail
+
+def _starts_document(text):
+    return text[:len(_START_MARKERS[0])].translate(_ASCII_LOWER).startswith(_START_MARKERS)
+
+def splice_continuation(previous_tail, continuation):
+    """Returns (restarted, text_to_append) for a continuation of truncated output.
+
+    Models asked to continue often open a new code fence or repeat the last few characters (or
+    lines) they already wrote; the fence and the longest suffix of `previous_tail` that the
+    continuation starts with are dropped. If the continuation starts the document over instead,
+    `restarted` is True and the text should replace the previous output.
+    """
+    stripped = continuation.lstrip()
+    if stripped[:len(_FENCE_MARKER)].translate(_ASCII_LOWER) == _FENCE_MARKER:
+        newline = stripped.find("\n")
+        continuation = stripped[newline + 1:] if newline >= 0 else ""
+        stripped = continuation.lstrip()
+    if _starts_document(stripped):
+        return True, stripped
+
+    probe = continuation[:32]
+    position = previous_tail.find(probe) if probe else -1
+    while position >= 0:
+        overlap = len(previous_tail) - position
+        if continuation[:overlap] == previous_tail[position:]:
+            return False, continuation[overlap:]
+        position = previous_tail.find(probe, position + 1)
+    for overlap in range(min(len(probe), len(previous_tail)) - 1, _MIN_OVERLAP - 1, -1):
+        if previous_tail.endswith(continuation[:overlap]):
+            return False, continuation[overlap:]
+    return False, continuation
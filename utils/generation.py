@@ -1,163 +1,828 @@
-import google.generativeai as genai
-from openai import OpenAI
-import requests
-import base64
 import io
-import re
-from PIL import Image
+import json
 import logging
+import time
 import traceback
-from .config import API_TIMEOUT
-from .prompts import SYSTEM_PROMPT
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from .config import (
+    API_TIMEOUT,
+    GEMINI_TEMPERATURE,
+    OPENAI_TEMPERATURE,
+    HTML_STOP_SEQUENCE,
+    CONTINUATION_MAX_ROUNDS,
+    CONTINUATION_MAX_OVERLAP,
+    TILING_MIN_ASPECT_RATIO,
+    TILING_MAX_WORKERS,
+    HEDGE_AFTER_SECONDS,
+    COMPACT_OUTPUT
+)
+from .prompts import SYSTEM_PROMPT, SECTION_PROMPT_TEMPLATE, CONTINUATION_PROMPT, LAYOUT_PROMPT
+from .cache import make_cache_key, get_cached_result, store_result
+from .preprocessing import preprocess_image, passthrough_image, check_image_size, estimate_preprocessing_memory, estimate_decode_memory, encode_data_url
+from .clients import get_openai_client, get_gemini_client
+from .tiling import split_into_bands, stitch_fragments
+from .compaction import compact_html
+from .similarity import index_screenshot
+from .resilience import call_with_retries, get_provider_rate_limiter, run_hedged, CircuitOpenError
+from .metrics import timed, record_usage, record_generation
+from .extraction import HtmlExtractor
+from .layout import parse_layout, render_layout, count_nodes
+from .router import record_observation
+from .memory import RequestMemory
+from .sdk import load, loaded
+
+def get_sampling_params(provider):
+    """Returns the sampling parameters sent to the given provider.
+
+    Generation stops at HTML_STOP_SEQUENCE, so no tokens are spent on commentary after the document;
+    the stop sequence itself is not returned and is added back by _complete_document.
+    """
+    if provider == "Google Gemini":
+        return {"temperature": GEMINI_TEMPERATURE, "stop_sequences": [HTML_STOP_SEQUENCE]}
+    return {"temperature": OPENAI_TEMPERATURE, "stop": [HTML_STOP_SEQUENCE]}
+
+def get_layout_sampling_params(provider):
+    """Returns the sampling parameters for layout mode: JSON output where the provider can enforce it."""
+    if provider == "Google Gemini":
+        return {"temperature": GEMINI_TEMPERATURE, "response_mime_type": "application/json"}
+    if provider == "OpenAI":
+        return {"temperature": OPENAI_TEMPERATURE, "response_format": {"type": "json_object"}}
+    return {"temperature": OPENAI_TEMPERATURE} # Not every OpenRouter model supports response_format
+
+def _validate_inputs(provider, api_key, model_id_to_use, img_bytes):
+    """Returns an error message for missing inputs, or None."""
+    if not api_key: return f"{provider} API Key is missing."
+    if not model_id_to_use: return "Model ID is missing."
+    if not img_bytes: return "Image data is missing."
+    return check_image_size(img_bytes)
+
+def _prepare_image(provider, img_bytes, preprocess, stats, memory, prepare=None):
+    """Returns (PreparedImage, error_message) for the given provider, recording decode/encode timings.
+
+    The memory preprocessing needs is reserved from the process budget first (waiting if it is full).
+    `prepare`, if given, returns the (PreparedImage, error_message) of `img_bytes` in place of preprocessing it here.
+    """
+    memory.reserve(estimate_preprocessing_memory(img_bytes, preprocess))
+    if prepare is not None:
+        prepared, error_message = prepare()
+    elif preprocess:
+        prepared, error_message = preprocess_image(img_bytes, provider)
+    else:
+        prepared, error_message = passthrough_image(img_bytes), None
+    if prepared is not None:
+        stats["preprocessing"] = prepared.stats
+        stats.setdefault("timings", {}).update(prepared.stats.get("timings", {}))
+    memory.sample()
+    return prepared, error_message
+
+def _index_screenshot(img_bytes, cache_key, provider, model_id, stats, memory):
+    """Indexes a generated page's screenshot for similarity lookups, decoding it within the request's budget.
+
+    The request has been answered, so its reservation drops to nothing before waiting for room to
+    decode: a request never waits for budget while holding some that queued requests wait for.
+    """
+    memory.shrink(0)
+    memory.reserve(estimate_decode_memory(img_bytes))
+    index_screenshot(img_bytes, cache_key, provider, model_id, stats)
+
+def _make_openai_client(provider, api_key):
+    """Returns the pooled OpenAI-compatible client for OpenAI or OpenRouter."""
+    return get_openai_client(provider, api_key)
+
+def _build_request(provider, prompt, prepared, stats, memory):
+    """Builds the provider payload once (reused across retries): Gemini contents or chat messages.
+
+    Once it is built, the memory reservation shrinks to what the payload holds while being sent
+    (the payload, the SDK's JSON body and the bytes on the wire).
+    """
+    with timed(stats, "request_serialization"):
+        payload = _build_payload(provider, prompt, prepared, stats)
+    memory.shrink(3 * stats["request_bytes"])
+    return payload
+
+def _build_payload(provider, prompt, prepared, stats):
+    if provider == "Google Gemini":
+        stats["request_bytes"] = len(prompt.encode("utf-8")) + len(prepared.data)
+        return [prompt, {"mime_type": prepared.mime_type, "data": prepared.data}]
+    with timed(stats, "base64_encode"):
+        image_url = {"url": encode_data_url(prepared.mime_type, prepared.data)}
+    if provider == "OpenAI":
+        image_url["detail"] = "high"
+    stats["request_bytes"] = len(prompt.encode("utf-8")) + len(image_url["url"])
+    return [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": prompt},
+                {"type": "image_url", "image_url": image_url},
+            ],
+        }
+    ]
+
+def _make_gemini_model(api_key, model_id_to_use, sampling_params):
+    genai = load("google.generativeai")
+    generation_config = genai.GenerationConfig(**sampling_params)
+    model = genai.GenerativeModel(model_id_to_use, generation_config=generation_config)
+    # Bind the model to a per-key pooled client instead of the process-global genai.configure(), which
+    # would need a lock held for every call (streams included). _client is private to the SDK: the
+    # version is pinned in requirements.txt and tests/test_gemini_client.py fails if it stops being used.
+    model._client = get_gemini_client(api_key)
+    return model
+
+def _gemini_failure_reason(response):
+    reason = "Unknown reason."
+    if hasattr(response, 'prompt_feedback') and response.prompt_feedback.block_reason:
+        reason = f"Blocked: {response.prompt_feedback.block_reason}"
+    elif hasattr(response, 'candidates') and response.candidates and response.candidates[0].finish_reason != 'STOP':
+        reason = f"Finished early: {response.candidates[0].finish_reason}"
+    return reason
+
+def _finish_reason(provider, response):
+    """Returns "stop", "length" or the provider's own reason for a response or stream chunk (None if not finished)."""
+    if provider == "Google Gemini":
+        candidates = getattr(response, "candidates", None)
+        if not candidates:
+            return None
+        reason = candidates[0].finish_reason
+        name = getattr(reason, "name", str(reason))
+        return {"STOP": "stop", "MAX_TOKENS": "length", "FINISH_REASON_UNSPECIFIED": None}.get(name, name.lower())
+    choices = getattr(response, "choices", None)
+    return choices[0].finish_reason if choices else None
+
+def _add_usage(stats, round_stats):
+    """Adds the token usage and attempts of a continuation request to the totals in `stats`."""
+    for key in ("prompt_tokens", "completion_tokens"):
+        if round_stats.get(key):
+            stats[key] = stats.get(key, 0) + round_stats[key]
+    if round_stats.get("attempts"):
+        stats["continuation_attempts"] = stats.get("continuation_attempts", 0) + round_stats["attempts"]
+
+def _continuation_payload(provider, payload, partial_text):
+    """Returns the original request followed by the cut-off reply and a request to carry on from there."""
+    if provider == "Google Gemini":
+        return [
+            {"role": "user", "parts": payload},
+            {"role": "model", "parts": [partial_text]},
+            {"role": "user", "parts": [CONTINUATION_PROMPT]},
+        ]
+    return payload + [
+        {"role": "assistant", "content": partial_text},
+        {"role": "user", "content": CONTINUATION_PROMPT},
+    ]
+
+def _complete_document(provider, extractor, finish_reason, stats):
+    """Closes a document that ended on the stop sequence and returns (html, error_message).
+
+    Output still missing </html> after the allowed continuations is returned as-is and flagged
+    with stats["truncated"].
+    """
+    with timed(stats, "postprocess"):
+        if extractor.started and not extractor.closed and finish_reason == "stop":
+            extractor.feed(HTML_STOP_SEQUENCE)
+        if extractor.started and not extractor.closed:
+            stats["truncated"] = True
+            logging.warning(f"{provider}: Output ended without </html> (finish reason: {finish_reason}); the clone may be incomplete.")
+        return extractor.result(provider)
+
+def _run_inline(fn, *args):
+    return fn(*args)
+
+def _compact_output(provider, html, stats, offload=None):
+    """Compacts a finished full-page clone (see utils/compaction.py); the savings go to stats["compaction"].
+
+    `offload(fn, *args)`, if given, runs the compaction (e.g. on another process) and returns its result.
+    """
+    if not COMPACT_OUTPUT or not html:
+        return html
+    try:
+        with timed(stats, "compact"):
+            compacted, stats["compaction"] = (offload or _run_inline)(compact_html, html)
+    except Exception as e: # The clone is still usable uncompacted
+        logging.warning(f"{provider}: Could not compact the output, keeping it as generated: {e}")
+        return html
+    logging.info(f"{provider}: Compacted output from {stats['compaction']['input_bytes']} to {stats['compaction']['output_bytes']} bytes.")
+    return compacted
+
+def _describe_error(provider, e):
+    """Maps a provider/network exception to the user-facing error message."""
+    # Subclasses are checked before their bases (e.g. RateLimitError before APIStatusError).
+    # SDKs that were never imported cannot have raised, so only loaded ones are checked.
+    genai, requests, openai = loaded("google.generativeai"), loaded("requests"), loaded("openai")
+    if isinstance(e, CircuitOpenError):
+        return f"{provider}: Temporarily unavailable. {e}"
+    if genai and isinstance(e, genai.types.BlockedPromptException):
+        return f"Gemini: Prompt blocked. {e}"
+    if genai and isinstance(e, genai.types.StopCandidateException):
+        return f"Gemini: Generation stopped unexpectedly. {e}"
+    if requests and isinstance(e, requests.exceptions.RequestException):
+        return f"{provider}: API request failed (Network/Connection Error): {e}"
+    if openai and isinstance(e, openai.AuthenticationError):
+        return f"{provider}: Authentication Error - Check your API Key. {e}"
+    if openai and isinstance(e, openai.RateLimitError):
+        return f"{provider}: Rate Limit Exceeded (after retries). Please wait and try again. {e}"
+    if openai and isinstance(e, openai.APIStatusError):
+        return f"{provider}: API Error ({e.status_code}): {e.message}"
+    if openai and isinstance(e, openai.APITimeoutError):
+        return f"{provider}: API Request Timed Out. {e}"
+    if openai and isinstance(e, openai.APIConnectionError):
+        return f"{provider}: API Connection Error: {e}"
+    return f"{provider}: An unexpected error occurred during code generation: {e}\n{traceback.format_exc()}"
+
+def _call_provider(provider, api_key, model_id_to_use, payload, sampling_params, stats):
+    """Makes one blocking provider call. Returns (raw_text, error_message); API errors are raised.
+
+    Token usage reported by the provider is stored in `stats`.
+    """
+    api_timeout = API_TIMEOUT
+    if provider == "Google Gemini":
+        model = _make_gemini_model(api_key, model_id_to_use, sampling_params)
+        logging.info(f"Calling Gemini model {model_id_to_use}...")
+        response = model.generate_content(payload, request_options={'timeout': api_timeout})
+        usage = getattr(response, "usage_metadata", None)
+        if usage:
+            record_usage(stats, usage.prompt_token_count, usage.candidates_token_count)
+        stats["finish_reason"] = _finish_reason(provider, response)
 
-def generate_code_from_image(provider, api_key, model_id_to_use, img_bytes):
-    """Generates a single HTML file using the selected provider and model."""
-    if not api_key: return None, f"{provider} API Key is missing."
-    if not model_id_to_use: return None, "Model ID is missing."
-    if not img_bytes: return None, "Image data is missing."
+        if not response.parts:
+             error_message = f"Gemini: Failed to generate content. {_gemini_failure_reason(response)}"
+             logging.error(error_message)
+             return None, error_message
+
+        generated_html = response.text
+        logging.info(f"Gemini: Code generation successful (length: {len(generated_html)}).")
+        return generated_html, None
+
+    if provider in ("OpenAI", "OpenRouter"):
+        client = _make_openai_client(provider, api_key)
+        logging.info(f"Calling {provider} model {model_id_to_use}...")
+        response = client.chat.completions.create(
+            model=model_id_to_use,
+            messages=payload,
+            #max_tokens=4096,
+            **sampling_params,
+            timeout=api_timeout
+        )
+        if response.usage:
+            record_usage(stats, response.usage.prompt_tokens, response.usage.completion_tokens)
+        stats["finish_reason"] = _finish_reason(provider, response)
+        generated_html = response.choices[0].message.content
+        logging.info(f"{provider}: Code generation successful (length: {len(generated_html)}).")
+        return generated_html, None
+
+    return None, f"Unknown provider '{provider}'."
+
+def generate_code_from_image(provider, api_key, model_id_to_use, img_bytes, use_cache=True, preprocess=True, stats=None, rate_limiter=None, prompt=None, hedge_model=None, prepare=None, offload=None):
+    """Generates a single HTML file using the selected provider and model.
+
+    If a dict is passed as `stats`, it is filled with per-call details such as image preprocessing savings,
+    per-stage timings, token usage, provider latency and retry attempts; the call is also recorded as a
+    trace (see utils.metrics). Transient failures are retried with backoff under the provider's shared
+    rate limiter (or `rate_limiter`, if given) and circuit breaker. If `hedge_model` is set and the
+    primary model has not answered after HEDGE_AFTER_SECONDS, the same request is also sent to it and the
+    first answer wins. `prompt` defaults to SYSTEM_PROMPT; only such full-page requests update the
+    model router's statistics (utils.router). The call waits while the process memory budget is full
+    (utils.memory); stats["memory"] records that wait and the peak RSS while it ran. `prepare` lets
+    callers that share one preprocessed image across requests (comparisons) supply it: it is called
+    on a cache miss and returns (PreparedImage, error_message) for `img_bytes`, which stays the
+    original upload so the cache key and similarity index match other runs. `offload(fn, *args)` lets
+    callers with worker processes (the HTTP service) run the CPU-heavy output compaction there.
+    """
+    if stats is None:
+        stats = {}
+    with RequestMemory(stats) as memory:
+        generated_html, error_message = _generate_code(
+            provider, api_key, model_id_to_use, img_bytes, use_cache, preprocess, stats, rate_limiter, prompt, hedge_model, memory, prepare, offload
+        )
+    record_generation(provider, model_id_to_use, stats, generated_html, error_message)
+    if prompt is None and not stats.get("hedged_to"): # Full-page requests answered by this model teach the router
+        record_observation(provider, model_id_to_use, stats, error_message)
+    return generated_html, error_message
+
+def _attempt_hedged(provider, attempt, model_id_to_use, hedge_model, stats):
+    """Runs attempt(model_id, stats) for the primary model, hedged with `hedge_model` if set.
+
+    Returns (raw_text, error_message, used_fallback). Each call records into its own stats, and only
+    the answering call's are merged into `stats`: the slower one keeps running in the background.
+    """
+    if not hedge_model or hedge_model == model_id_to_use:
+        return (*attempt(model_id_to_use, stats), False)
+    primary_stats, fallback_stats = {}, {}
+    try:
+        (text, error_message), used_fallback = run_hedged(
+            lambda: attempt(model_id_to_use, primary_stats),
+            lambda: attempt(hedge_model, fallback_stats),
+            HEDGE_AFTER_SECONDS
+        )
+    except Exception:
+        _merge_attempt_stats(stats, primary_stats) # Both calls have finished
+        raise
+    _merge_attempt_stats(stats, fallback_stats if used_fallback else primary_stats)
+    if used_fallback:
+        stats["hedged_to"] = hedge_model
+        logging.info(f"{provider}: Hedge model {hedge_model} answered before {model_id_to_use}.")
+    return text, error_message, used_fallback
+
+def _merge_attempt_stats(stats, attempt_stats):
+    """Copies one call's stats (usage, finish reason, retries, stage timings) into the request's."""
+    for key, value in attempt_stats.items():
+        if key == "timings":
+            timings = stats.setdefault("timings", {})
+            for stage, seconds in value.items():
+                timings[stage] = timings.get(stage, 0.0) + seconds
+        else:
+            stats[key] = value
+
+def _generate_code(provider, api_key, model_id_to_use, img_bytes, use_cache, preprocess, stats, rate_limiter, prompt, hedge_model, memory, prepare, offload):
+    input_error = _validate_inputs(provider, api_key, model_id_to_use, img_bytes)
+    if input_error: return None, input_error
+
+    prompt = prompt or SYSTEM_PROMPT
+    sampling_params = get_sampling_params(provider)
+    if rate_limiter is None:
+        rate_limiter = get_provider_rate_limiter(provider)
+
+    # --- Result Cache Lookup ---
+    cache_key = None
+    if use_cache:
+        with timed(stats, "cache_lookup"):
+            cache_key = make_cache_key(img_bytes, provider, model_id_to_use, prompt, {**sampling_params, "preprocess": preprocess})
+            cached_html = get_cached_result(cache_key)
+        stats["cache_hit"] = cached_html is not None
+        if cached_html is not None:
+            logging.info(f"Cache hit for {provider} model {model_id_to_use} (length: {len(cached_html)}).")
+            return cached_html, None
+
+    # --- Preprocess Image (downscale, strip metadata, re-encode) ---
+    prepared, prep_error = _prepare_image(provider, img_bytes, preprocess, stats, memory, prepare)
+    if prep_error:
+        return None, prep_error
+    payload = _build_request(provider, prompt, prepared, stats, memory)
+    del prepared # The payload holds what is sent; the re-encoded image alone is no longer needed
 
     logging.info(f"Generating code using {provider} model: {model_id_to_use}")
+    request_started = time.monotonic()
 
-    prompt = SYSTEM_PROMPT
+    def attempt(model_id, attempt_stats, request_payload=payload):
+        return call_with_retries(
+            provider,
+            lambda: _call_provider(provider, api_key, model_id, request_payload, sampling_params, attempt_stats),
+            rate_limiter,
+            attempt_stats,
+            api_key=api_key
+        )
 
     try:
-        # --- Encode Image for APIs that need it ---
-        base64_image = base64.b64encode(img_bytes).decode('utf-8')
-        image_data_url = f"data:image/png;base64,{base64_image}"
-
-        # --- Provider-Specific API Calls ---
-        generated_html = None
-        error_message = None
-        api_timeout = API_TIMEOUT
-
-        if provider == "Google Gemini":
-            genai.configure(api_key=api_key)
-            img_pil = Image.open(io.BytesIO(img_bytes))
-            generation_config = genai.GenerationConfig(temperature=0.25)
-            model = genai.GenerativeModel(model_id_to_use, generation_config=generation_config)
-            logging.info(f"Calling Gemini model {model_id_to_use}...")
-            response = model.generate_content([prompt, img_pil], request_options={'timeout': api_timeout})
-
-            if not response.parts:
-                 reason = "Unknown reason."
-                 if hasattr(response, 'prompt_feedback') and response.prompt_feedback.block_reason:
-                     reason = f"Blocked: {response.prompt_feedback.block_reason}"
-                 elif hasattr(response, 'candidates') and response.candidates and response.candidates[0].finish_reason != 'STOP':
-                     reason = f"Finished early: {response.candidates[0].finish_reason}"
-                 error_message = f"Gemini: Failed to generate content. {reason}"
-                 logging.error(error_message)
-                 return None, error_message
-
-            generated_html = response.text
-            logging.info(f"Gemini: Code generation successful (length: {len(generated_html)}).")
-
-        elif provider == "OpenRouter":
-            client = OpenAI(
-                base_url="https://openrouter.ai/api/v1",
-                api_key=api_key,
-            )
-            logging.info(f"Calling OpenRouter model {model_id_to_use}...")
-            response = client.chat.completions.create(
-                model=model_id_to_use,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": image_data_url
-                                },
-                            },
-                        ],
-                    }
-                ],
-                #max_tokens=4096,
-                temperature=0.1,
-                timeout=api_timeout
-            )
-            generated_html = response.choices[0].message.content
-            logging.info(f"OpenRouter: Code generation successful (length: {len(generated_html)}).")
-
-        elif provider == "OpenAI":
-            client = OpenAI(api_key=api_key)
-            logging.info(f"Calling OpenAI model {model_id_to_use}...")
-            response = client.chat.completions.create(
-                model=model_id_to_use,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": image_data_url,
-                                    "detail": "high"
-                                },
-                            },
-                        ],
-                    }
-                ],
-                #max_tokens=4096,
-                temperature=0.1,
-                timeout=api_timeout
-            )
-            generated_html = response.choices[0].message.content
-            logging.info(f"OpenAI: Code generation successful (length: {len(generated_html)}).")
+        # --- Provider Call (with retries, optionally hedged) ---
+        generated_html, error_message, used_fallback = _attempt_hedged(provider, attempt, model_id_to_use, hedge_model, stats)
+        if error_message:
+            stats["provider_latency_s"] = time.monotonic() - request_started
+            return None, error_message
+
+        # --- Continue Output Cut Off by the Length Limit ---
+        extractor = HtmlExtractor()
+        with timed(stats, "postprocess"):
+            extractor.feed(generated_html or "")
+        finish_reason = stats.get("finish_reason")
+        answering_model = hedge_model if used_fallback else model_id_to_use
+        rounds = 0
+        while finish_reason == "length" and not extractor.closed and rounds < CONTINUATION_MAX_ROUNDS:
+            rounds += 1
+            logging.info(f"{provider}: Output was cut off at {len(extractor.text())} characters; requesting continuation {rounds}/{CONTINUATION_MAX_ROUNDS}.")
+            round_stats = {}
+            continuation, error_message = attempt(answering_model, round_stats, _continuation_payload(provider, payload, extractor.text()))
+            _add_usage(stats, round_stats)
+            finish_reason = round_stats.get("finish_reason")
+            if error_message or not continuation:
+                logging.warning(f"{provider}: Continuation {rounds} failed: {error_message or 'No content received.'}")
+                break
+            with timed(stats, "postprocess"):
+                extractor.extend(continuation, CONTINUATION_MAX_OVERLAP)
+        stats["continuations"] = rounds
+        stats["provider_latency_s"] = time.monotonic() - request_started
 
         # --- Post-processing and Validation ---
-        if generated_html:
-            if not generated_html.strip().lower().startswith("<!doctype html") and not generated_html.strip().lower().startswith("<html"):
-                logging.warning(f"{provider}: Output doesn't start with <!DOCTYPE html> or <html>. It might be incomplete or contain extra text.")
-                match = re.search(r"```html\n(.*?)```", generated_html, re.DOTALL | re.IGNORECASE)
-                if match:
-                    generated_html = match.group(1).strip()
-                    logging.info("Extracted HTML from markdown code block.")
-                else:
-                    if "<head>" in generated_html.lower() and "<body>" in generated_html.lower():
-                         logging.warning("HTML detected but missing doctype. Proceeding cautiously.")
-                    else:
-                        error_message = f"{provider}: Generated output does not appear to be valid HTML code. It might be an error message or explanation instead."
-                        logging.error(error_message)
-                        return None, error_message
-
-        return generated_html, None 
-
-    except genai.types.BlockedPromptException as e:
-        error_message = f"Gemini: Prompt blocked. {e}"
-        logging.error(error_message)
-        return None, error_message
-    except genai.types.StopCandidateException as e:
-        error_message = f"Gemini: Generation stopped unexpectedly. {e}"
-        logging.error(error_message)
-        return None, error_message
-    except requests.exceptions.RequestException as e:
-        error_message = f"{provider}: API request failed (Network/Connection Error): {e}"
-        logging.error(error_message)
-        return None, error_message
-    except OpenAI.APIStatusError as e:
-        error_message = f"{provider}: API Error ({e.status_code}): {e.message}"
+        generated_html, error_message = _complete_document(provider, extractor, finish_reason, stats)
+        if error_message:
+            return None, error_message
+        if prompt == SYSTEM_PROMPT: # Section and site prompts are compacted (if at all) once assembled
+            generated_html = _compact_output(provider, generated_html, stats, offload)
+
+        # A hedge answer came from a different model, so it is not cached under the primary's key;
+        # a clone that is still cut off is not cached either, so the next attempt can do better.
+        if cache_key and generated_html and not used_fallback and not stats.get("truncated"):
+            store_result(cache_key, generated_html)
+            if prompt == SYSTEM_PROMPT: # Full pages can be offered for similar screenshots later
+                _index_screenshot(img_bytes, cache_key, provider, model_id_to_use, stats, memory)
+
+        return generated_html, None
+
+    except Exception as e:
+        stats["provider_latency_s"] = time.monotonic() - request_started
+        error_message = _describe_error(provider, e)
         logging.error(error_message)
         return None, error_message
-    except OpenAI.APIConnectionError as e:
-        error_message = f"{provider}: API Connection Error: {e}"
+
+def generate_layout_code_from_image(provider, api_key, model_id_to_use, img_bytes, use_cache=True, preprocess=True, stats=None, rate_limiter=None, hedge_model=None):
+    """Generates a single HTML file via a compact layout tree (LAYOUT_PROMPT) rendered by utils.layout.
+
+    The model only writes the JSON tree, typically several times fewer output tokens than the HTML,
+    and the page is expanded locally. Retries, hedging, caching and tracing work as in
+    generate_code_from_image; the cache holds the tree, so renderer changes apply to cached results.
+    stats["layout"] records the tree size. Returns (html, error_message).
+    """
+    if stats is None:
+        stats = {}
+    with RequestMemory(stats) as memory:
+        generated_html, error_message = _generate_layout(
+            provider, api_key, model_id_to_use, img_bytes, use_cache, preprocess, stats, rate_limiter, hedge_model, memory
+        )
+    record_generation(provider, model_id_to_use, stats, generated_html, error_message, kind="layout")
+    return generated_html, error_message
+
+def _render_layout_output(provider, layout_text, stats):
+    """Validates and renders a layout tree. Returns (html, canonical_json, error_message)."""
+    with timed(stats, "postprocess"):
+        tree, error_message = parse_layout(layout_text)
+    if error_message:
+        error_message = f"{provider}: {error_message}"
         logging.error(error_message)
-        return None, error_message
-    except OpenAI.AuthenticationError as e:
-        error_message = f"{provider}: Authentication Error - Check your API Key. {e}"
+        return None, None, error_message
+    try:
+        with timed(stats, "layout_render"):
+            generated_html = render_layout(tree)
+    except (TypeError, ValueError, OverflowError, RecursionError) as e: # Model output is untrusted; fail the request, not the worker
+        error_message = f"{provider}: The layout could not be rendered: {e}"
         logging.error(error_message)
-        return None, error_message
-    except OpenAI.RateLimitError as e:
-        error_message = f"{provider}: Rate Limit Exceeded. Please wait and try again. {e}"
+        return None, None, error_message
+    canonical = json.dumps(tree, separators=(",", ":"), ensure_ascii=False)
+    stats["layout"] = {"nodes": count_nodes(tree), "json_bytes": len(canonical.encode("utf-8")), "html_bytes": len(generated_html.encode("utf-8"))}
+    return generated_html, canonical, None
+
+def _generate_layout(provider, api_key, model_id_to_use, img_bytes, use_cache, preprocess, stats, rate_limiter, hedge_model, memory):
+    input_error = _validate_inputs(provider, api_key, model_id_to_use, img_bytes)
+    if input_error: return None, input_error
+
+    sampling_params = get_layout_sampling_params(provider)
+    if rate_limiter is None:
+        rate_limiter = get_provider_rate_limiter(provider)
+
+    cache_key = None
+    if use_cache:
+        with timed(stats, "cache_lookup"):
+            cache_key = make_cache_key(img_bytes, provider, model_id_to_use, LAYOUT_PROMPT, {**sampling_params, "preprocess": preprocess})
+            cached_layout = get_cached_result(cache_key)
+        stats["cache_hit"] = cached_layout is not None
+        if cached_layout is not None:
+            logging.info(f"Cache hit for {provider} model {model_id_to_use} layout (length: {len(cached_layout)}).")
+            generated_html, _, error_message = _render_layout_output(provider, cached_layout, stats)
+            return generated_html, error_message
+
+    prepared, prep_error = _prepare_image(provider, img_bytes, preprocess, stats, memory)
+    if prep_error:
+        return None, prep_error
+    payload = _build_request(provider, LAYOUT_PROMPT, prepared, stats, memory)
+    del prepared
+
+    logging.info(f"Generating layout using {provider} model: {model_id_to_use}")
+    request_started = time.monotonic()
+
+    def attempt(model_id, attempt_stats):
+        return call_with_retries(
+            provider,
+            lambda: _call_provider(provider, api_key, model_id, payload, sampling_params, attempt_stats),
+            rate_limiter,
+            attempt_stats,
+            api_key=api_key
+        )
+
+    try:
+        layout_text, error_message, used_fallback = _attempt_hedged(provider, attempt, model_id_to_use, hedge_model, stats)
+        stats["provider_latency_s"] = time.monotonic() - request_started
+        if error_message:
+            return None, error_message
+        if stats.get("finish_reason") == "length":
+            # A cut-off JSON tree cannot be rendered; unlike HTML it is short enough that this is rare.
+            stats["truncated"] = True
+            error_message = f"{provider}: The layout was cut off by the output length limit. Try the HTML output mode instead."
+            logging.error(error_message)
+            return None, error_message
+
+        generated_html, canonical, error_message = _render_layout_output(provider, layout_text, stats)
+        if error_message:
+            return None, error_message
+        if cache_key and not used_fallback:
+            store_result(cache_key, canonical)
+        logging.info(
+            f"{provider}: Rendered a {stats['layout']['nodes']}-node layout ({stats['layout']['json_bytes']} bytes) "
+            f"into {stats['layout']['html_bytes']} bytes of HTML."
+        )
+        return generated_html, None
+
+    except Exception as e:
+        stats["provider_latency_s"] = time.monotonic() - request_started
+        error_message = _describe_error(provider, e)
         logging.error(error_message)
         return None, error_message
-    except OpenAI.APITimeoutError as e:
-        error_message = f"{provider}: API Request Timed Out. {e}"
+
+def _open_stream(provider, api_key, model_id_to_use, payload, sampling_params):
+    """Starts a streaming provider call. Errors before the first chunk are raised here."""
+    if provider == "Google Gemini":
+        model = _make_gemini_model(api_key, model_id_to_use, sampling_params)
+        return model.generate_content(payload, stream=True, request_options={'timeout': API_TIMEOUT})
+    client = _make_openai_client(provider, api_key)
+    return client.chat.completions.create(
+        model=model_id_to_use,
+        messages=payload,
+        **sampling_params,
+        timeout=API_TIMEOUT,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+
+def _cancelled(cancel_event):
+    return cancel_event is not None and cancel_event.is_set()
+
+def _close_stream(stream):
+    close = getattr(stream, "close", None)
+    if callable(close):
+        try:
+            close()
+        except Exception:
+            pass
+
+def _iter_stream(provider, stream, stats):
+    """Yields (text, finish_reason) from a provider stream, recording the token usage it reports."""
+    if provider == "Google Gemini":
+        for chunk in stream:
+            if getattr(chunk, "usage_metadata", None):
+                record_usage(stats, chunk.usage_metadata.prompt_token_count, chunk.usage_metadata.candidates_token_count)
+            yield (chunk.text if chunk.parts else ""), _finish_reason(provider, chunk)
+        return
+    for event in stream:
+        if event.usage:
+            record_usage(stats, event.usage.prompt_tokens, event.usage.completion_tokens)
+        text = event.choices[0].delta.content if event.choices else None
+        yield text or "", _finish_reason(provider, event)
+
+def _consume_stream(provider, stream, extractor, stats, usage_stats, cancel_event, request_started, splice=False):
+    """Feeds a provider stream into `extractor`, yielding ("chunk", text) for the text each chunk adds.
+
+    Reading stops as soon as the document is closed, so no tokens are spent after </html>. With
+    `splice`, the stream is a continuation: its start is buffered until it can be spliced onto the
+    existing output without repeating it. Token usage goes to `usage_stats`. Returns the finish
+    reason ("stop", "length", ...).
+    """
+    finish_reason = None
+    buffered, buffered_chars = ([], 0) if splice else (None, 0)
+    for text, reason in _iter_stream(provider, stream, usage_stats):
+        if _cancelled(cancel_event):
+            return None
+        finish_reason = reason or finish_reason
+        if not text:
+            continue
+        with timed(stats, "postprocess"):
+            if buffered is not None:
+                buffered.append(text)
+                buffered_chars += len(text)
+                if buffered_chars < CONTINUATION_MAX_OVERLAP:
+                    continue
+                added = extractor.extend("".join(buffered), CONTINUATION_MAX_OVERLAP)
+                buffered = None
+            else:
+                added = extractor.feed(text)
+        if added:
+            stats.setdefault("time_to_first_token_s", time.monotonic() - request_started)
+            yield "chunk", added
+        if extractor.closed:
+            return "stop"
+    if buffered:
+        with timed(stats, "postprocess"):
+            added = extractor.extend("".join(buffered), CONTINUATION_MAX_OVERLAP)
+        if added:
+            yield "chunk", added
+    return finish_reason
+
+def stream_code_from_image(provider, api_key, model_id_to_use, img_bytes, use_cache=True, preprocess=True, stats=None, cancel_event=None, rate_limiter=None, prompt=None, offload=None):
+    """Streams HTML generation as it arrives from the provider.
+
+    Yields ("chunk", text) events while tokens arrive, then exactly one of ("done", html) with the
+    validated document or ("error", message). Opening the stream is retried like generate_code_from_image;
+    hedging is not used. Setting `cancel_event` (a threading.Event) or closing
+    the generator stops consuming the stream and closes the underlying connection.
+    `stats` additionally receives time_to_first_token_s, and the call is recorded as a trace.
+    `offload` runs the output compaction as in generate_code_from_image.
+    """
+    if stats is None:
+        stats = {}
+    generated_html, error_message = None, None
+    memory = RequestMemory(stats)
+    events = _stream_code(provider, api_key, model_id_to_use, img_bytes, use_cache, preprocess, stats, cancel_event, rate_limiter, prompt, memory, offload)
+    try:
+        with memory:
+            try:
+                for kind, payload in events:
+                    if kind == "done":
+                        generated_html = payload
+                    elif kind == "error":
+                        error_message = payload
+                    yield kind, payload
+            finally:
+                # Also runs when the consumer abandons the stream: close the provider stream now, then trace it.
+                events.close()
+    finally:
+        record_generation(provider, model_id_to_use, stats, generated_html, error_message or (None if generated_html else "Generation abandoned."), kind="stream")
+        if prompt is None and (generated_html or error_message):
+            record_observation(provider, model_id_to_use, stats, error_message)
+
+def _stream_code(provider, api_key, model_id_to_use, img_bytes, use_cache, preprocess, stats, cancel_event, rate_limiter, prompt, memory, offload):
+    input_error = _validate_inputs(provider, api_key, model_id_to_use, img_bytes)
+    if input_error:
+        yield "error", input_error
+        return
+
+    prompt = prompt or SYSTEM_PROMPT
+    sampling_params = get_sampling_params(provider)
+
+    # --- Result Cache Lookup ---
+    cache_key = None
+    if use_cache:
+        with timed(stats, "cache_lookup"):
+            cache_key = make_cache_key(img_bytes, provider, model_id_to_use, prompt, {**sampling_params, "preprocess": preprocess})
+            cached_html = get_cached_result(cache_key)
+        stats["cache_hit"] = cached_html is not None
+        if cached_html is not None:
+            logging.info(f"Cache hit for {provider} model {model_id_to_use} (length: {len(cached_html)}).")
+            yield "chunk", cached_html
+            yield "done", cached_html
+            return
+
+    prepared, prep_error = _prepare_image(provider, img_bytes, preprocess, stats, memory)
+    if prep_error:
+        yield "error", prep_error
+        return
+    payload = _build_request(provider, prompt, prepared, stats, memory)
+    del prepared
+
+    if rate_limiter is None:
+        rate_limiter = get_provider_rate_limiter(provider)
+    logging.info(f"Streaming code using {provider} model: {model_id_to_use}")
+    request_started = time.monotonic()
+
+    def open_stream(request_payload, attempt_stats):
+        # Only opening the stream is retried; a failure mid-stream would duplicate streamed output.
+        return call_with_retries(
+            provider,
+            lambda: _open_stream(provider, api_key, model_id_to_use, request_payload, sampling_params),
+            rate_limiter,
+            attempt_stats,
+            api_key=api_key
+        )
+
+    stream = None
+    extractor = HtmlExtractor()
+    try:
+        stream = open_stream(payload, stats)
+        round_stats = stats
+        rounds = 0
+        while True:
+            finish_reason = yield from _consume_stream(
+                provider, stream, extractor, stats, round_stats, cancel_event, request_started, splice=rounds > 0
+            )
+            if rounds:
+                _add_usage(stats, round_stats)
+            if provider == "Google Gemini" and not extractor.text() and not _cancelled(cancel_event):
+                error_message = f"Gemini: Failed to generate content. {_gemini_failure_reason(stream)}"
+                logging.error(error_message)
+                yield "error", error_message
+                return
+            if finish_reason != "length" or extractor.closed or rounds >= CONTINUATION_MAX_ROUNDS:
+                break
+            rounds += 1
+            logging.info(f"{provider}: Output was cut off at {len(extractor.text())} characters; requesting continuation {rounds}/{CONTINUATION_MAX_ROUNDS}.")
+            _close_stream(stream)
+            round_stats = {}
+            stream = open_stream(_continuation_payload(provider, payload, extractor.text()), round_stats)
+
+        stats["continuations"] = rounds
+        stats["provider_latency_s"] = time.monotonic() - request_started
+        if _cancelled(cancel_event):
+            logging.info(f"{provider}: Generation cancelled after {len(extractor.text())} characters.")
+            yield "error", "Generation cancelled."
+            return
+
+        generated_html, error_message = _complete_document(provider, extractor, finish_reason, stats)
+        if error_message:
+            yield "error", error_message
+            return
+        if prompt == SYSTEM_PROMPT:
+            generated_html = _compact_output(provider, generated_html, stats, offload)
+        logging.info(f"{provider}: Streaming generation successful (length: {len(generated_html)}).")
+
+        if cache_key and generated_html and not stats.get("truncated"):
+            store_result(cache_key, generated_html)
+            if prompt == SYSTEM_PROMPT:
+                _index_screenshot(img_bytes, cache_key, provider, model_id_to_use, stats, memory)
+        yield "done", generated_html
+
+    except Exception as e:
+        stats["provider_latency_s"] = time.monotonic() - request_started
+        error_message = _describe_error(provider, e)
         logging.error(error_message)
-        return None, error_message
+        yield "error", error_message
+    finally:
+        # Runs on normal exit, cancellation and generator close (e.g. a Streamlit rerun).
+        _close_stream(stream)
+
+def is_tall_screenshot(img_bytes):
+    """Returns True when a screenshot is tall enough to benefit from tiled generation."""
+    try:
+        with Image.open(io.BytesIO(img_bytes)) as img:
+            width, height = img.size
+    except Exception:
+        return False
+    return width > 0 and height / width >= TILING_MIN_ASPECT_RATIO
+
+def generate_section_fragments(provider, api_key, model_id_to_use, sections, page_width, section_count, use_cache=True, preprocess=True, rate_limiter=None, hedge_model=None):
+    """Generates one HTML document per cropped section of a page, in parallel.
+
+    `sections` is a list of (index, top, bottom, prefix, png_bytes); index/top/bottom describe where
+    the crop sits on a page `page_width` wide with `section_count` sections, and every class and id
+    the model defines is prefixed with `prefix`. Returns [(html, error_message, stats), ...] in order.
+    """
+    def generate_section(index, top, bottom, prefix, section_bytes):
+        prompt = SECTION_PROMPT_TEMPLATE.format(
+            index=index, count=section_count, top=top, bottom=bottom, page_width=page_width, prefix=prefix
+        )
+        section_stats = {}
+        html, error = generate_code_from_image(
+            provider, api_key, model_id_to_use, section_bytes,
+            use_cache=use_cache, preprocess=preprocess, stats=section_stats, rate_limiter=rate_limiter, prompt=prompt,
+            hedge_model=hedge_model
+        )
+        return html, error, section_stats
+
+    if not sections:
+        return []
+    with ThreadPoolExecutor(max_workers=min(TILING_MAX_WORKERS, len(sections))) as pool:
+        futures = [pool.submit(generate_section, *section) for section in sections]
+        return [future.result() for future in futures]
+
+def generate_tiled_code_from_image(provider, api_key, model_id_to_use, img_bytes, use_cache=True, preprocess=True, stats=None, rate_limiter=None, hedge_model=None):
+    """Generates HTML for a tall screenshot by cloning horizontal bands in parallel and stitching them.
+
+    Screenshots that are not tall enough are passed straight to generate_code_from_image. Each section
+    is traced as its own request, and the whole page as a "tiled" trace. Returns (html, error_message) like generate_code_from_image.
+    """
+    if stats is None:
+        stats = {}
+    if not is_tall_screenshot(img_bytes):
+        return generate_code_from_image(
+            provider, api_key, model_id_to_use, img_bytes,
+            use_cache=use_cache, preprocess=preprocess, stats=stats, rate_limiter=rate_limiter, hedge_model=hedge_model
+        )
+    input_error = _validate_inputs(provider, api_key, model_id_to_use, img_bytes)
+    if input_error: return None, input_error
+
+    try:
+        with timed(stats, "tile_split"):
+            bands, page_width = split_into_bands(img_bytes)
     except Exception as e:
-        error_message = f"{provider}: An unexpected error occurred during code generation: {e}\n{traceback.format_exc()}"
+        error_message = f"Could not split the screenshot into sections: {e}"
         logging.error(error_message)
-        return None, error_message
\ No newline at end of file
+        record_generation(provider, model_id_to_use, stats, None, error_message, kind="tiled")
+        return None, error_message
+
+    started = time.monotonic()
+    results = generate_section_fragments(
+        provider, api_key, model_id_to_use,
+        [(index, top, bottom, f"s{index}", data) for index, (top, bottom, data) in enumerate(bands, start=1)],
+        page_width, len(bands), use_cache=use_cache, preprocess=preprocess, rate_limiter=rate_limiter, hedge_model=hedge_model
+    )
+    stats["provider_latency_s"] = time.monotonic() - started
+    stats["tiling"] = {
+        "bands": [(top, bottom) for top, bottom, _ in bands],
+        "band_latencies_s": [band_stats.get("provider_latency_s", 0.0) for _, _, band_stats in results],
+        "cache_hits": sum(1 for _, _, band_stats in results if band_stats.get("cache_hit")),
+    }
+
+    for index, (html, error, _) in enumerate(results, start=1):
+        if error or not html:
+            error_message = f"{provider}: Section {index}/{len(bands)} failed: {error or 'No HTML content received.'}"
+            logging.error(error_message)
+            record_generation(provider, model_id_to_use, stats, None, error_message, kind="tiled")
+            return None, error_message
+
+    with timed(stats, "stitch"):
+        generated_html = stitch_fragments([html for html, _, _ in results])
+    generated_html = _compact_output(provider, generated_html, stats)
+    for _, _, band_stats in results:
+        for key in ("prompt_tokens", "completion_tokens"):
+            if band_stats.get(key):
+                stats[key] = stats.get(key, 0) + band_stats[key]
+    logging.info(
+        f"{provider}: Tiled generation of {len(bands)} sections finished in {stats['provider_latency_s']:.1f}s "
+        f"(slowest section {max(stats['tiling']['band_latencies_s']):.1f}s, length: {len(generated_html)})."
+    )
+    record_generation(provider, model_id_to_use, stats, generated_html, None, kind="tiled")
+    return generated_html, None
@@ -0,0 +1,268 @@
+import json
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass, field, asdict
+import numpy as np
+from .config import (
+    INCREMENTAL_TARGET_BAND_RATIO,
+    INCREMENTAL_MAX_BANDS,
+    INCREMENTAL_BLOCK_SIZE,
+    INCREMENTAL_PIXEL_TOLERANCE,
+    INCREMENTAL_MAX_CHANGED_RATIO,
+    PROJECTS_DIR
+)
+from .tiling import find_band_boundaries, crop_band, stitch_fragments
+from .generation import generate_section_fragments, _validate_inputs
+from .metrics import timed, record_generation
+from .memory import reserve_memory
+from .preprocessing import open_image, estimate_decode_memory
+
+# --- Incremental Regeneration ---
+# A page is generated as a stack of <section> elements, one per horizontal band of the screenshot,
+# so every section maps to a known pixel range. When an updated screenshot arrives, only the
+# sections whose pixels changed are sent to the model again; the rest of the HTML is reused.
+
+@dataclass
+class PageSnapshot:
+    """A generated page and the screenshot it was generated from: the baseline for the next update."""
+    image: bytes = field(repr=False)
+    width: int
+    height: int
+    provider: str
+    model_id: str
+    sections: list # [{"top", "bottom", "prefix", "html"}, ...] from the top of the page down
+    html: str = field(repr=False)
+    created_at: float = field(default_factory=time.time)
+
+def _load_rgb(img_bytes):
+    with open_image(img_bytes) as src:
+        return src.convert("RGB")
+
+def _changed_pixels(old, new):
+    """Returns a bool array (rows, cols) of pixels that differ by more than the tolerance in any channel."""
+    # max - min stays within uint8, so no wider copy of either image is needed.
+    diff = np.maximum(old, new) - np.minimum(old, new)
+    return diff.max(axis=2) > INCREMENTAL_PIXEL_TOLERANCE
+
+def changed_blocks(old, new, block=INCREMENTAL_BLOCK_SIZE):
+    """Compares two equally sized RGB arrays block by block. Returns a bool array (block rows, block cols)."""
+    changed = _changed_pixels(old, new)
+    height, width = changed.shape
+    rows, cols = -(-height // block), -(-width // block)
+    padded = np.zeros((rows * block, cols * block), dtype=bool)
+    padded[:height, :width] = changed
+    return padded.reshape(rows, block, cols, block).any(axis=(1, 3))
+
+def _runs(flags):
+    """Returns [(start, end), ...] runs of True values."""
+    edges = np.diff(np.concatenate(([0], flags.astype(np.int8), [0])))
+    return list(zip(np.flatnonzero(edges == 1).tolist(), np.flatnonzero(edges == -1).tolist()))
+
+def diff_screenshots(old, new, block=INCREMENTAL_BLOCK_SIZE):
+    """Finds the rows of `old` that changed in `new` (two RGB arrays of the same width).
+
+    Returns ([(top, bottom), ...] in `old` coordinates, height_delta, changed_block_count). For
+    screenshots of equal height every changed block row is reported. When the height changed, content
+    was inserted or removed: the page is aligned at the top and at the bottom, and the single span
+    between the unchanged head and the unchanged tail is reported (possibly empty, for a pure insertion).
+    """
+    old_height, new_height = old.shape[0], new.shape[0]
+    if old_height == new_height:
+        blocks = changed_blocks(old, new, block)
+        spans = [(start * block, min(old_height, end * block)) for start, end in _runs(blocks.any(axis=1))]
+        return spans, 0, int(blocks.sum())
+
+    overlap = min(old_height, new_height)
+    head_changed = _changed_pixels(old[:overlap], new[:overlap]).any(axis=1)
+    head = int(np.argmax(head_changed)) if head_changed.any() else overlap
+    tail_changed = _changed_pixels(old[old_height - overlap:], new[new_height - overlap:]).any(axis=1)
+    tail = overlap - 1 - int(np.flatnonzero(tail_changed)[-1]) if tail_changed.any() else overlap
+    tail = min(tail, overlap - head) # The head and tail may not overlap in the shorter image
+    top, bottom = head, old_height - tail
+    changed_rows = max(bottom - top, new_height - tail - top)
+    return [(top, bottom)], new_height - old_height, -(-changed_rows // block) * -(-old.shape[1] // block)
+
+def plan_update(sections, spans, height_delta, old_height):
+    """Maps changed rows to the page sections they touch.
+
+    Returns (layout, regenerate): the new list of sections from top to bottom, with the pixel ranges of
+    the updated screenshot, and the indexes into it of the sections that must be generated again.
+    Unchanged sections keep their HTML (and shift by `height_delta` when below an insertion or removal).
+    """
+    def touches(section, top, bottom):
+        if top == bottom: # Pure insertion at row `top`
+            return section["top"] <= top < section["bottom"] or (top == old_height and section["bottom"] == old_height)
+        return section["top"] < bottom and top < section["bottom"]
+
+    if height_delta == 0:
+        layout = [dict(section) for section in sections]
+        regenerate = [i for i, section in enumerate(sections) if any(touches(section, top, bottom) for top, bottom in spans)]
+        for i in regenerate:
+            layout[i]["html"] = None
+        return layout, regenerate
+
+    top, bottom = spans[0]
+    touched = [i for i, section in enumerate(sections) if touches(section, top, bottom)]
+    first, last = touched[0], touched[-1]
+    layout = [dict(section) for section in sections[:first]]
+    regenerate = []
+    region_top, region_bottom = sections[first]["top"], sections[last]["bottom"] + height_delta
+    if region_bottom > region_top: # Otherwise the touched sections were removed entirely
+        regenerate.append(len(layout))
+        layout.append({"top": region_top, "bottom": region_bottom, "prefix": sections[first]["prefix"], "html": None})
+    for section in sections[last + 1:]:
+        layout.append({**section, "top": section["top"] + height_delta, "bottom": section["bottom"] + height_delta})
+    return layout, regenerate
+
+def _split_region(img, section, taken):
+    """Splits a regenerated region that grew too tall into several sections with unused prefixes."""
+    region = img.crop((0, section["top"], img.width, section["bottom"]))
+    pieces = find_band_boundaries(region, target_ratio=INCREMENTAL_TARGET_BAND_RATIO, max_bands=INCREMENTAL_MAX_BANDS)
+    split = []
+    for k, (top, bottom) in enumerate(pieces):
+        prefix, suffix = section["prefix"], 1
+        while k and prefix in taken:
+            suffix += 1
+            prefix = f"{section['prefix']}x{suffix}"
+        taken.add(prefix)
+        split.append({"top": section["top"] + top, "bottom": section["top"] + bottom, "prefix": prefix, "html": None})
+    return split
+
+def generate_incremental_code_from_image(provider, api_key, model_id_to_use, img_bytes, previous=None, use_cache=True, preprocess=True, stats=None, rate_limiter=None, hedge_model=None):
+    """Generates HTML for a screenshot, regenerating only the sections that changed since `previous`.
+
+    `previous` is the PageSnapshot returned for an earlier screenshot of the same page, or None to
+    generate every section. The whole page is also regenerated when its width changed or when more
+    than INCREMENTAL_MAX_CHANGED_RATIO of its sections changed. stats["incremental"] describes what
+    was reused. Returns (html, snapshot, error_message); the snapshot is the baseline for the next update.
+    """
+    if stats is None:
+        stats = {}
+    input_error = _validate_inputs(provider, api_key, model_id_to_use, img_bytes)
+    if input_error: return None, None, input_error
+
+    # Both screenshots are decoded within the process memory budget and freed before the sections are requested.
+    decode_memory = estimate_decode_memory(img_bytes) + (estimate_decode_memory(previous.image) if previous is not None else 0)
+    try:
+        with reserve_memory(decode_memory):
+            with timed(stats, "image_decode"):
+                img = _load_rgb(img_bytes)
+            with timed(stats, "screenshot_diff"):
+                new = np.asarray(img)
+                layout, regenerate, details = None, None, {"mode": "full"}
+                if previous is None:
+                    details["reason"] = "no previous version"
+                elif previous.width != img.width:
+                    details["reason"] = f"page width changed ({previous.width}px -> {img.width}px)"
+                else:
+                    spans, height_delta, block_count = diff_screenshots(np.asarray(_load_rgb(previous.image)), new)
+                    details.update(changed_spans=spans, height_delta=height_delta, changed_blocks=block_count)
+                    if not block_count and not height_delta:
+                        layout, regenerate = [dict(section) for section in previous.sections], []
+                        details.update(mode="unchanged", reason="screenshot unchanged")
+                    else:
+                        layout, regenerate = plan_update(previous.sections, spans, height_delta, previous.height)
+                        if len(regenerate) > INCREMENTAL_MAX_CHANGED_RATIO * max(len(layout), 1):
+                            layout, regenerate = None, None
+                            details["reason"] = f"more than {INCREMENTAL_MAX_CHANGED_RATIO:.0%} of the page changed"
+                        else:
+                            details.update(mode="partial", reason=f"{len(regenerate)} of {len(layout)} sections changed")
+                if layout is None:
+                    layout = [
+                        {"top": top, "bottom": bottom, "prefix": f"s{index}", "html": None}
+                        for index, (top, bottom) in enumerate(
+                            find_band_boundaries(img, target_ratio=INCREMENTAL_TARGET_BAND_RATIO, max_bands=INCREMENTAL_MAX_BANDS), start=1
+                        )
+                    ]
+                    regenerate = list(range(len(layout)))
+                # A region that grew well past the section height is split again, keeping its edit local next time.
+                if details["mode"] == "partial":
+                    max_height = img.width * INCREMENTAL_TARGET_BAND_RATIO * 2
+                    taken = {section["prefix"] for section in layout}
+                    for i in reversed(regenerate):
+                        if layout[i]["bottom"] - layout[i]["top"] > max_height:
+                            layout[i:i + 1] = _split_region(img, layout[i], taken)
+                regenerate = [i for i, section in enumerate(layout) if section["html"] is None]
+                requests = [
+                    (i + 1, section["top"], section["bottom"], section["prefix"], crop_band(img, section["top"], section["bottom"]))
+                    for i, section in enumerate(layout) if section["html"] is None
+                ]
+            page_width, page_height = img.size
+            del img, new
+    except Exception as e:
+        error_message = f"Could not compare the screenshot with the previous version: {e}"
+        logging.error(error_message)
+        record_generation(provider, model_id_to_use, stats, None, error_message, kind="incremental")
+        return None, None, error_message
+    details.update(sections=len(layout), regenerated=[i + 1 for i in regenerate])
+    stats["incremental"] = details
+    logging.info(f"{provider}: Incremental generation: {details['mode']} ({details['reason']}), regenerating sections {details['regenerated']}.")
+
+    started = time.monotonic()
+    results = generate_section_fragments(
+        provider, api_key, model_id_to_use, requests, page_width, len(layout),
+        use_cache=use_cache, preprocess=preprocess, rate_limiter=rate_limiter, hedge_model=hedge_model
+    )
+    stats["provider_latency_s"] = time.monotonic() - started
+    for i, (html, error, section_stats) in zip(regenerate, results):
+        if error or not html:
+            error_message = f"{provider}: Section {i + 1}/{len(layout)} failed: {error or 'No HTML content received.'}"
+            logging.error(error_message)
+            record_generation(provider, model_id_to_use, stats, None, error_message, kind="incremental")
+            return None, None, error_message
+        layout[i]["html"] = html
+        for key in ("prompt_tokens", "completion_tokens"):
+            if section_stats.get(key):
+                stats[key] = stats.get(key, 0) + section_stats[key]
+
+    if regenerate or previous is None:
+        with timed(stats, "stitch"):
+            generated_html = stitch_fragments([section["html"] for section in layout])
+    else:
+        generated_html = previous.html
+    snapshot = PageSnapshot(
+        image=img_bytes, width=page_width, height=page_height, provider=provider, model_id=model_id_to_use,
+        sections=layout, html=generated_html
+    )
+    record_generation(provider, model_id_to_use, stats, generated_html, None, kind="incremental")
+    return generated_html, snapshot, None
+
+# --- Saved Projects ---
+_SNAPSHOT_FILE = "snapshot.json"
+_SCREENSHOT_FILE = "screenshot.img"
+
+def _project_dir(project, projects_dir):
+    slug = re.sub(r"[^A-Za-z0-9_.-]+", "-", project.strip()).strip("-.")
+    if not slug:
+        raise ValueError(f"Invalid project name: {project!r}")
+    return os.path.join(projects_dir, slug)
+
+def save_snapshot(project, snapshot, projects_dir=PROJECTS_DIR):
+    """Stores a snapshot as the baseline of a named project, replacing the previous one."""
+    directory = _project_dir(project, projects_dir)
+    os.makedirs(directory, exist_ok=True)
+    metadata = asdict(snapshot)
+    del metadata["image"]
+    for name, data in ((_SCREENSHOT_FILE, snapshot.image), (_SNAPSHOT_FILE, json.dumps(metadata).encode("utf-8"))):
+        tmp_path = os.path.join(directory, f"{name}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, os.path.join(directory, name))
+    logging.info(f"Saved baseline of project '{project}' ({len(snapshot.sections)} sections).")
+
+def load_snapshot(project, projects_dir=PROJECTS_DIR):
+    """Returns the saved baseline of a named project, or None if there is none (or it is unreadable)."""
+    try:
+        directory = _project_dir(project, projects_dir)
+        with open(os.path.join(directory, _SNAPSHOT_FILE), encoding="utf-8") as f:
+            metadata = json.load(f)
+        with open(os.path.join(directory, _SCREENSHOT_FILE), "rb") as f:
+            image = f.read()
+        return PageSnapshot(image=image, **metadata)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, TypeError) as e:
+        logging.warning(f"Could not load the baseline of project '{project}': {e}")
+        return None
@@ -0,0 +1,282 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from .config import JOB_MAX_WORKERS, JOB_STORE_MAX_FINISHED, JOB_RESULT_TTL
+from .generation import generate_code_from_image, stream_code_from_image, generate_tiled_code_from_image, generate_layout_code_from_image
+from .incremental import generate_incremental_code_from_image, load_snapshot, save_snapshot
+from .site import generate_site, inline_stylesheet
+from .preprocessing import preprocess_image, passthrough_image, make_thumbnail
+from .leaderboard import record_result
+
+# --- Background Generation Jobs ---
+# Generations run on a process-wide thread pool instead of the Streamlit script thread, so a rerun
+# (any widget interaction) never abandons a request that is already being paid for. Sessions keep
+# only job IDs; the jobs themselves live here until they are evicted from the bounded store.
+FINISHED_STATUSES = ("done", "error", "cancelled")
+
+@dataclass
+class Job:
+    """One generation request and its progress, shared by the worker thread and the sessions polling it."""
+    id: str
+    mode: str # "stream", "blocking", "tiled", "incremental", "layout" or "site"
+    provider: str
+    model_id: str
+    label: str
+    image: bytes = field(repr=False) # The upload while queued; only its display thumbnail once the job has started (None if undecodable)
+    status: str = "queued" # queued -> running -> done / error / cancelled
+    created_at: float = field(default_factory=time.time)
+    started_at: float = None
+    finished_at: float = None
+    html: str = None
+    error: str = None
+    stats: dict = field(default_factory=dict)
+    chunks: list = field(default_factory=list, repr=False) # Streamed output so far
+    cancel_event: threading.Event = field(default_factory=threading.Event, repr=False)
+    snapshot: object = field(default=None, repr=False) # PageSnapshot of an incremental job, the next baseline
+    group: str = None # Comparison run this job belongs to, if any
+    site: object = field(default=None, repr=False) # SiteBundle of a site job; `html` is its first page as a single file
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATUSES
+
+    @property
+    def cancellable(self):
+        """Queued jobs can always be cancelled; running ones only while streaming."""
+        return self.status == "queued" or (self.status == "running" and self.mode == "stream")
+
+    def partial_html(self):
+        return "".join(list(self.chunks))
+
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+_executor = ThreadPoolExecutor(max_workers=JOB_MAX_WORKERS, thread_name_prefix="generation-job")
+_jobs = OrderedDict() # job id -> Job, in submission order
+_lock = threading.Lock()
+
+class _SharedImage:
+    """Preprocesses one screenshot once per provider for all jobs of a comparison.
+
+    get() is passed to generate_code_from_image as `prepare`, so it only runs on a cache miss and
+    inside the generation's memory budget reservation.
+    """
+
+    def __init__(self, img_bytes, preprocess=True):
+        self.img_bytes = img_bytes
+        self.preprocess = preprocess
+        self._prepared = {} # provider -> (PreparedImage, error_message)
+        self._provider_locks = {} # provider -> Lock held while that provider's copy is made
+        self._guard = threading.Lock() # Only for creating provider locks
+        self._thumbnail = None
+        self._thumbnail_lock = threading.Lock()
+
+    def thumbnail(self):
+        """Returns the display thumbnail shared by the comparison's jobs, made once."""
+        with self._thumbnail_lock:
+            if self._thumbnail is None:
+                self._thumbnail = make_thumbnail(self.img_bytes) or b""
+            return self._thumbnail or None
+
+    def get(self, provider):
+        with self._guard:
+            lock = self._provider_locks.setdefault(provider, threading.Lock())
+        # Held while preprocessing: jobs of the same provider wait for the first one instead of
+        # repeating it, while other providers preprocess their own copies at the same time.
+        with lock:
+            if provider not in self._prepared:
+                self._prepared[provider] = preprocess_image(self.img_bytes, provider) if self.preprocess else (passthrough_image(self.img_bytes), None)
+            return self._prepared[provider]
+
+def _prune_locked(now):
+    """Drops finished jobs past JOB_RESULT_TTL, then the oldest beyond JOB_STORE_MAX_FINISHED. Caller holds _lock."""
+    finished = [job for job in _jobs.values() if job.finished]
+    expired = {job.id for job in finished if now - job.finished_at > JOB_RESULT_TTL}
+    overflow = len(finished) - len(expired) - JOB_STORE_MAX_FINISHED
+    if overflow > 0:
+        remaining = sorted((job for job in finished if job.id not in expired), key=lambda job: job.finished_at)
+        expired.update(job.id for job in remaining[:overflow])
+    for job_id in expired:
+        del _jobs[job_id]
+
+def _finish(job, status, html=None, error=None):
+    job.html = html
+    job.error = error
+    job.finished_at = time.time()
+    job.status = status
+    logging.info(f"Job {job.id} ({job.provider} {job.model_id}) finished: {status} after {job.elapsed():.1f}s.")
+
+def _run(job, api_key, use_cache, preprocess, hedge_model, previous_snapshot=None, project=None, shared_image=None, site_pages=None):
+    with _lock:
+        cancelled = job.finished # Cancelled while queued
+        if not cancelled:
+            job.started_at = time.time()
+            job.status = "running"
+    # Finished jobs stay in the store for JOB_RESULT_TTL; they keep a thumbnail, not the full-size upload.
+    img_bytes, job.image = job.image, shared_image.thumbnail() if shared_image is not None else make_thumbnail(job.image)
+    if cancelled:
+        return
+    try:
+        if shared_image is not None:
+            html, error = generate_code_from_image(
+                job.provider, api_key, job.model_id, img_bytes, use_cache=use_cache, preprocess=preprocess,
+                stats=job.stats, prepare=lambda: shared_image.get(job.provider)
+            )
+            record_result(job.provider, job.model_id, job.stats, html, error)
+        elif job.mode == "stream":
+            html, error = None, None
+            for kind, payload in stream_code_from_image(
+                job.provider, api_key, job.model_id, img_bytes,
+                use_cache=use_cache, preprocess=preprocess, stats=job.stats, cancel_event=job.cancel_event
+            ):
+                if kind == "chunk":
+                    job.chunks.append(payload)
+                elif kind == "done":
+                    html = payload
+                else:
+                    error = payload
+            if job.cancel_event.is_set() and not html:
+                _finish(job, "cancelled")
+                return
+        elif job.mode == "tiled":
+            html, error = generate_tiled_code_from_image(
+                job.provider, api_key, job.model_id, img_bytes,
+                use_cache=use_cache, preprocess=preprocess, stats=job.stats, hedge_model=hedge_model
+            )
+        elif job.mode == "layout":
+            html, error = generate_layout_code_from_image(
+                job.provider, api_key, job.model_id, img_bytes,
+                use_cache=use_cache, preprocess=preprocess, stats=job.stats, hedge_model=hedge_model
+            )
+        elif job.mode == "site":
+            job.site, error = generate_site(
+                job.provider, api_key, job.model_id, site_pages,
+                use_cache=use_cache, preprocess=preprocess, stats=job.stats, hedge_model=hedge_model
+            )
+            html = None
+            if job.site is not None:
+                first_page = next(page for page in job.site.pages if page.html)
+                html = inline_stylesheet(first_page.html, job.site.design.css)
+        elif job.mode == "incremental":
+            if previous_snapshot is None and project:
+                previous_snapshot = load_snapshot(project)
+            html, job.snapshot, error = generate_incremental_code_from_image(
+                job.provider, api_key, job.model_id, img_bytes, previous=previous_snapshot,
+                use_cache=use_cache, preprocess=preprocess, stats=job.stats, hedge_model=hedge_model
+            )
+            if job.snapshot is not None and project:
+                save_snapshot(project, job.snapshot)
+        else:
+            html, error = generate_code_from_image(
+                job.provider, api_key, job.model_id, img_bytes,
+                use_cache=use_cache, preprocess=preprocess, stats=job.stats, hedge_model=hedge_model
+            )
+    except Exception as e:
+        logging.exception(f"Job {job.id} failed unexpectedly.")
+        html, error = None, f"An unexpected error occurred in the generation job: {e}"
+    if error or not html:
+        _finish(job, "error", error=error or "No HTML content received.")
+    else:
+        _finish(job, "done", html=html)
+
+def submit_generation(mode, provider, api_key, model_id, img_bytes, label="", use_cache=True, preprocess=True, hedge_model=None, previous_snapshot=None, project=None):
+    """Queues a generation on the background pool and returns its job ID immediately.
+
+    `mode` is "stream" (output is available as it arrives and can be stopped), "blocking", "tiled",
+    "layout" (compact layout tree rendered locally) or "incremental". Incremental jobs only regenerate what changed since `previous_snapshot`, or since
+    the saved baseline of `project` (which is then replaced by the result); see utils/incremental.py.
+    The API key is only held by the queued task, never stored on the job.
+    """
+    job = Job(id=uuid.uuid4().hex[:12], mode=mode, provider=provider, model_id=model_id, label=label, image=img_bytes)
+    with _lock:
+        _prune_locked(time.time())
+        _jobs[job.id] = job
+    _executor.submit(_run, job, api_key, use_cache, preprocess, hedge_model, previous_snapshot, project)
+    logging.info(f"Job {job.id} queued: {mode} generation with {provider} {model_id}.")
+    return job.id
+
+def submit_comparison(targets, img_bytes, label="", use_cache=True, preprocess=True):
+    """Queues the same screenshot for several models at once. Returns (group_id, job_ids).
+
+    `targets` is a list of (provider, api_key, model_id). The jobs run concurrently on the background
+    pool, the screenshot is preprocessed once per provider, and each result is added to the local
+    leaderboard (utils/leaderboard.py) when it finishes.
+    """
+    group_id = uuid.uuid4().hex[:12]
+    shared_image = _SharedImage(img_bytes, preprocess)
+    jobs = [
+        (Job(id=uuid.uuid4().hex[:12], mode="blocking", provider=provider, model_id=model_id, label=label, image=img_bytes, group=group_id), api_key)
+        for provider, api_key, model_id in targets
+    ]
+    with _lock:
+        _prune_locked(time.time())
+        for job, _ in jobs:
+            _jobs[job.id] = job
+    for job, api_key in jobs:
+        _executor.submit(_run, job, api_key, use_cache, preprocess, None, shared_image=shared_image)
+    logging.info(f"Comparison {group_id} queued: {', '.join(f'{job.provider} {job.model_id}' for job, _ in jobs)}.")
+    return group_id, [job.id for job, _ in jobs]
+
+def submit_site(provider, api_key, model_id, pages, label="", use_cache=True, preprocess=True, hedge_model=None):
+    """Queues the pages of one site as a single job and returns its ID (see utils/site.py).
+
+    `pages` is a list of (label, img_bytes); the design system is derived from the first one.
+    """
+    job = Job(id=uuid.uuid4().hex[:12], mode="site", provider=provider, model_id=model_id, label=label, image=pages[0][1])
+    with _lock:
+        _prune_locked(time.time())
+        _jobs[job.id] = job
+    _executor.submit(_run, job, api_key, use_cache, preprocess, hedge_model, site_pages=pages)
+    logging.info(f"Job {job.id} queued: site generation of {len(pages)} pages with {provider} {model_id}.")
+    return job.id
+
+def add_reused_result(provider, model_id, img_bytes, html, label="", reuse=None):
+    """Adds an already finished job holding an earlier result (see utils/similarity.py) and returns its ID.
+
+    `reuse` describes where the result came from and is kept in the job's stats["similar_reuse"].
+    """
+    job = Job(
+        id=uuid.uuid4().hex[:12], mode="blocking", provider=provider, model_id=model_id, label=label, image=make_thumbnail(img_bytes),
+        stats={"cache_hit": True, "similar_reuse": reuse or {}}
+    )
+    job.started_at = job.created_at
+    _finish(job, "done", html=html)
+    with _lock:
+        _prune_locked(time.time())
+        _jobs[job.id] = job
+    return job.id
+
+def get_group_jobs(group_id):
+    """Returns the jobs of a comparison that are still in the store, in submission order."""
+    with _lock:
+        return [job for job in _jobs.values() if job.group == group_id]
+
+def get_job(job_id):
+    """Returns the Job, or None if it never existed or has been evicted."""
+    with _lock:
+        return _jobs.get(job_id)
+
+def cancel_job(job_id):
+    """Stops a queued job, or a streaming job at its next chunk. Returns False if it cannot be cancelled."""
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is None or not job.cancellable:
+            return False
+        job.cancel_event.set()
+        if job.status == "queued":
+            _finish(job, "cancelled")
+    return True
+
+def get_job_counts():
+    """Returns the number of jobs per status across all sessions."""
+    with _lock:
+        counts = {}
+        for job in _jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
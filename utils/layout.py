@@ -0,0 +1,280 @@
+import html
+import json
+import math
+import re
+
+# --- Compact Layout Trees ---
+# In layout mode the model describes the page as a small JSON tree (see LAYOUT_PROMPT) instead of
+# writing the HTML itself; render_layout() expands it locally into the same kind of single-file page.
+# Output tokens dominate generation time, and the tree is several times shorter than the HTML.
+
+NODE_TYPES = ("box", "row", "col", "grid", "text", "img", "button", "input", "hr")
+CONTAINER_TYPES = ("box", "row", "col", "grid")
+ALLOWED_TAGS = {
+    "div", "header", "nav", "main", "section", "article", "aside", "footer", "form", "ul", "ol", "li",
+    "h1", "h2", "h3", "h4", "h5", "h6", "p", "span", "a", "label", "small", "strong", "em", "blockquote"
+}
+DEFAULT_TAGS = {"text": "p", "button": "button", "input": "input", "hr": "hr"}
+MAX_DEPTH = 64
+MAX_NODES = 20000
+MAX_GRID_COLUMNS = 48
+
+_BASE_CLASSES = {
+    "row": "display:flex;flex-direction:row",
+    "col": "display:flex;flex-direction:column",
+    "grid": "display:grid",
+    "img": "display:flex;align-items:center;justify-content:center;background-color:#eee;border:1px dashed #ccc;"
+           "color:#888;font-size:12px;text-align:center;box-sizing:border-box;flex-shrink:0",
+    "button": "cursor:pointer;font:inherit",
+    "input": "font:inherit;box-sizing:border-box",
+}
+_ALIGN = {"start": "flex-start", "end": "flex-end", "center": "center", "stretch": "stretch", "baseline": "baseline"}
+_JUSTIFY = {
+    "start": "flex-start", "end": "flex-end", "center": "center",
+    "between": "space-between", "around": "space-around", "evenly": "space-evenly"
+}
+_DEFAULT_SHADOW = "0 1px 3px rgba(0,0,0,0.12)"
+_UNSAFE_CSS_RE = re.compile(r"[;{}<>\\]")
+_NAME_RE = re.compile(r"[^a-z0-9-]+")
+
+def _name(key):
+    return _NAME_RE.sub("-", str(key).lower()).strip("-") or "x"
+
+def _resolve(node, styles):
+    """Returns the node with its named style preset (`s`) applied; the node's own properties win."""
+    preset = styles.get(node.get("s")) if isinstance(node.get("s"), str) else None
+    return {**preset, **node} if preset else node
+
+def _property_error(node, path):
+    """Returns an error message for node properties the renderer cannot use, or None.
+
+    Model output is untrusted: JSON allows numbers such as 1e400 (infinity) and any value type for "tag".
+    """
+    tag = node.get("tag")
+    if tag is not None and not isinstance(tag, str):
+        return f"Layout node at {path} has a non-string tag."
+    for key, value in node.items():
+        if key == "c":
+            continue
+        for item in value if isinstance(value, list) else (value,):
+            if isinstance(item, float) and not math.isfinite(item):
+                return f"Layout node at {path} has a non-finite number in {key!r}."
+    cols = node.get("cols")
+    if isinstance(cols, (int, float)) and not isinstance(cols, bool) and not 1 <= cols <= MAX_GRID_COLUMNS:
+        return f"Layout node at {path} has {cols!r} grid columns (1 to {MAX_GRID_COLUMNS} are allowed)."
+    return None
+
+def parse_layout(text):
+    """Parses and validates model output as a layout tree. Returns (tree, error_message).
+
+    Tolerates a ```json fence or text around the object. Validation covers the structure (node types,
+    children, nesting) and the property values the renderer relies on, in a single pass over the tree.
+    """
+    if not text:
+        return None, "Layout output is empty."
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start:
+        return None, "Layout output does not contain a JSON object."
+    try:
+        tree = json.loads(text[start:end + 1])
+    except json.JSONDecodeError as e:
+        return None, f"Layout output is not valid JSON: {e}"
+    except RecursionError:
+        return None, "Layout output is nested too deeply."
+    if not isinstance(tree, dict) or not isinstance(tree.get("root"), dict):
+        return None, "Layout output has no \"root\" node."
+    for key in ("palette", "fonts", "styles"):
+        if not isinstance(tree.get(key, {}), dict):
+            return None, f"Layout \"{key}\" must be an object."
+    styles = tree.get("styles") or {}
+    if not all(isinstance(preset, dict) for preset in styles.values()):
+        return None, "Layout \"styles\" must map names to property objects."
+
+    count = 0
+    stack = [(tree["root"], "root", 1)]
+    while stack:
+        node, path, depth = stack.pop()
+        count += 1
+        if count > MAX_NODES:
+            return None, f"Layout has more than {MAX_NODES} nodes."
+        if depth > MAX_DEPTH:
+            return None, f"Layout is nested deeper than {MAX_DEPTH} levels at {path}."
+        if not isinstance(node, dict):
+            return None, f"Layout node at {path} is not an object."
+        node = _resolve(node, styles)
+        node_type = node.get("t", "box")
+        if not isinstance(node_type, str) or node_type not in NODE_TYPES:
+            return None, f"Layout node at {path} has unknown type {node_type!r}."
+        property_error = _property_error(node, path)
+        if property_error:
+            return None, property_error
+        children = node.get("c")
+        if isinstance(children, list):
+            if node_type not in CONTAINER_TYPES:
+                return None, f"Layout node at {path} ({node_type}) cannot have child nodes."
+            stack.extend((child, f"{path}.{i}", depth + 1) for i, child in enumerate(children))
+        elif children is not None and not isinstance(children, (str, int, float)):
+            return None, f"Layout node at {path} has invalid content."
+    return tree, None
+
+def count_nodes(tree):
+    """Returns the number of nodes in a (validated) layout tree."""
+    count, stack = 0, [tree["root"]]
+    while stack:
+        node = stack.pop()
+        count += 1
+        if isinstance(node.get("c"), list):
+            stack.extend(node["c"])
+    return count
+
+class _Renderer:
+    def __init__(self, tree):
+        self.palette = {_name(key): str(value) for key, value in (tree.get("palette") or {}).items()}
+        self.fonts = {_name(key): str(value) for key, value in (tree.get("fonts") or {}).items()}
+        self.styles = tree.get("styles") or {}
+        self.classes = {} # declarations -> class name, in order of first use
+        self.used_bases = set()
+
+    def css_value(self, value):
+        return _UNSAFE_CSS_RE.sub("", str(value)).strip()
+
+    def color(self, value):
+        key = _name(value)
+        return f"var(--{key})" if key in self.palette else self.css_value(value)
+
+    def length(self, value):
+        if isinstance(value, bool):
+            return None
+        if isinstance(value, (int, float)):
+            return f"{value:g}px" if value else "0"
+        if isinstance(value, list):
+            parts = [self.length(part) for part in value[:4] if not isinstance(part, list)]
+            return " ".join(part for part in parts if part)
+        return self.css_value(value)
+
+    def declarations(self, node, node_type):
+        decls = []
+        def add(prop, value):
+            if value not in (None, ""):
+                decls.append(f"{prop}:{value}")
+
+        add("width", self.length(node.get("w")) if "w" in node else None)
+        add("height", self.length(node.get("h")) if "h" in node else None)
+        add("min-height", self.length(node.get("minh")) if "minh" in node else None)
+        add("max-width", self.length(node.get("maxw")) if "maxw" in node else None)
+        if node.get("maxw") is not None and node_type in CONTAINER_TYPES:
+            add("margin-left", "auto")
+            add("margin-right", "auto")
+        add("padding", self.length(node.get("p")) if "p" in node else None)
+        add("margin", self.length(node.get("m")) if "m" in node else None)
+        add("gap", self.length(node.get("gap")) if "gap" in node else None)
+        add("background", self.color(node["bg"]) if node.get("bg") else None)
+        add("color", self.color(node["fg"]) if node.get("fg") else None)
+        border = node.get("b")
+        if isinstance(border, (int, float)) and not isinstance(border, bool):
+            add("border", f"{self.length(border)} solid {self.color(node.get('bc', '#ddd'))}")
+        elif border:
+            add("border", self.css_value(border))
+        add("border-radius", self.length(node.get("r")) if "r" in node else None)
+        shadow = node.get("sh")
+        add("box-shadow", _DEFAULT_SHADOW if shadow is True else (self.css_value(shadow) if shadow else None))
+        add("align-items", _ALIGN.get(node.get("al")))
+        add("justify-content", _JUSTIFY.get(node.get("jc")))
+        add("flex-wrap", "wrap" if node.get("wrap") else None)
+        add("flex-grow", self.css_value(node["grow"]) if node.get("grow") else None)
+        cols = node.get("cols")
+        if node_type == "grid" and cols:
+            add("grid-template-columns", f"repeat({int(cols)},minmax(0,1fr))" if isinstance(cols, (int, float)) else self.css_value(cols))
+        font = _name(node["f"]) if node.get("f") else None
+        if font and font in self.fonts:
+            add("font", f"var(--font-{font})")
+        add("font-size", self.length(node.get("fs")) if "fs" in node else None)
+        add("font-weight", self.css_value(node["fw"]) if node.get("fw") else None)
+        add("font-style", "italic" if node.get("i") else None)
+        add("text-decoration", "underline" if node.get("u") else None)
+        add("text-align", self.css_value(node["ta"]) if node.get("ta") else None)
+        add("text-transform", self.css_value(node["tt"]) if node.get("tt") else None)
+        add("letter-spacing", self.length(node.get("ls")) if "ls" in node else None)
+        return ";".join(decls)
+
+    def class_for(self, decls):
+        if not decls:
+            return None
+        name = self.classes.get(decls)
+        if name is None:
+            name = self.classes[decls] = f"k{len(self.classes) + 1}"
+        return name
+
+    def render(self, root):
+        out = []
+        # Iterative, so deeply nested trees cannot hit the recursion limit: (node, depth) or closing tags.
+        stack = [(root, 0)]
+        while stack:
+            item, depth = stack.pop()
+            if isinstance(item, str):
+                out.append(item)
+                continue
+            item = _resolve(item, self.styles)
+            node_type = item.get("t", "box")
+            tag = item.get("tag")
+            tag = tag if isinstance(tag, str) and tag in ALLOWED_TAGS else DEFAULT_TAGS.get(node_type, "div")
+            class_names = []
+            if node_type in _BASE_CLASSES:
+                self.used_bases.add(node_type)
+                class_names.append(node_type)
+            own = self.class_for(self.declarations(item, node_type))
+            if own:
+                class_names.append(own)
+            attributes = f' class="{" ".join(class_names)}"' if class_names else ""
+            indent = "  " * depth
+            content = item.get("c")
+            if node_type == "hr":
+                out.append(f"{indent}<hr{attributes}>\n")
+            elif node_type == "input":
+                placeholder = html.escape(str(item.get("ph") or content or ""), quote=True)
+                out.append(f'{indent}<input{attributes} placeholder="{placeholder}">\n')
+            elif node_type == "img":
+                out.append(f"{indent}<{tag}{attributes}>add your image</{tag}>\n")
+            elif isinstance(content, list):
+                out.append(f"{indent}<{tag}{attributes}>\n")
+                stack.append((f"{indent}</{tag}>\n", depth))
+                stack.extend((child, depth + 1) for child in reversed(content))
+            else:
+                text = html.escape(str(content)) if content is not None else ""
+                out.append(f"{indent}<{tag}{attributes}>{text}</{tag}>\n")
+        return "".join(out)
+
+    def stylesheet(self):
+        root_vars = [f"--{key}:{self.css_value(value)}" for key, value in self.palette.items()]
+        root_vars += [f"--font-{key}:{self.css_value(value)}" for key, value in self.fonts.items()]
+        body = ["margin:0"]
+        if "body" in self.fonts:
+            body.append("font:var(--font-body)")
+        for key, prop in (("bg", "background"), ("text", "color")):
+            if key in self.palette:
+                body.append(f"{prop}:var(--{key})")
+        rules = ["*{box-sizing:border-box}"]
+        if root_vars:
+            rules.append(f":root{{{';'.join(root_vars)}}}")
+        rules.append(f"body{{{';'.join(body)}}}")
+        rules.append("h1,h2,h3,h4,h5,h6,p,ul,ol{margin:0}")
+        rules += [f".{name}{{{decls}}}" for name, decls in _BASE_CLASSES.items() if name in self.used_bases]
+        rules += [f".{name}{{{decls}}}" for decls, name in self.classes.items()]
+        return "\n".join(rules)
+
+def render_layout(tree):
+    """Expands a validated layout tree into a single-file HTML page.
+
+    Deterministic: the same tree always gives the same document. Nodes with identical styles share
+    one generated class, palette colors and fonts become CSS custom properties, and images become the
+    usual 'add your image' placeholders.
+    """
+    renderer = _Renderer(tree)
+    body = renderer.render(tree["root"])
+    title = html.escape(str(tree.get("title") or "Cloned Page"))
+    return (
+        "<!DOCTYPE html>\n<html lang=\"en\">\n<head>\n<meta charset=\"UTF-8\">\n"
+        "<meta name=\"viewport\" content=\"width=device-width, initial-scale=1.0\">\n"
+        f"<title>{title}</title>\n<style>\n{renderer.stylesheet()}\n</style>\n</head>\n<body>\n"
+        f"{body}</body>\n</html>"
+    )
@@ -0,0 +1,77 @@
+import statistics
+import time
+from .config import LEADERBOARD_DB_PATH, LEADERBOARD_LATENCY_SAMPLES
+from .entry_store import EntryStore
+
+# --- Local Model Leaderboard ---
+# Fed by comparison runs, where every model cloned the same screenshot, and by the user's pick of
+# the best clone in each comparison. Entries are keyed "provider|model id":
+#   {"provider", "model", "runs", "errors", "wins", "latencies_s": [recent...], "measured_runs",
+#    "prompt_tokens", "completion_tokens", "output_bytes", "updated_at"}
+# The token and byte totals cover all "measured_runs" (successful, uncached); latencies only the most recent.
+# The entries are shared by every process using the data directory (see utils/entry_store.py).
+_store = EntryStore(LEADERBOARD_DB_PATH, "Leaderboard")
+
+def _update(provider, model_id, update_fn):
+    new_entry = {
+        "provider": provider, "model": model_id, "runs": 0, "errors": 0, "wins": 0, "latencies_s": [],
+        "measured_runs": 0, "prompt_tokens": 0, "completion_tokens": 0, "output_bytes": 0, "updated_at": None,
+    }
+    _store.update(f"{provider}|{model_id}", new_entry, update_fn)
+
+def record_result(provider, model_id, stats, generated_html, error_message):
+    """Adds one comparison run of a model to the leaderboard."""
+    def update(entry):
+        entry["runs"] += 1
+        if error_message or not generated_html:
+            entry["errors"] += 1
+        elif not stats.get("cache_hit"):
+            entry["latencies_s"] = (entry["latencies_s"] + [round(stats.get("provider_latency_s", 0.0), 3)])[-LEADERBOARD_LATENCY_SAMPLES:]
+            entry["measured_runs"] += 1
+            entry["prompt_tokens"] += stats.get("prompt_tokens") or 0
+            entry["completion_tokens"] += stats.get("completion_tokens") or 0
+            entry["output_bytes"] += len(generated_html.encode("utf-8"))
+        entry["updated_at"] = time.time()
+
+    _update(provider, model_id, update)
+
+def record_win(provider, model_id):
+    """Counts the user's pick of this model's clone as the best in a comparison."""
+    def update(entry):
+        entry["wins"] += 1
+        entry["updated_at"] = time.time()
+
+    _update(provider, model_id, update)
+
+def _summarize(entry):
+    successes = entry["runs"] - entry["errors"]
+    measured = entry["measured_runs"] or None
+    return {
+        "provider": entry["provider"],
+        "model": entry["model"],
+        "runs": entry["runs"],
+        "wins": entry["wins"],
+        # Smoothed, so one lucky pick does not outrank a model that won most of many comparisons.
+        "win_rate": (entry["wins"] + 1) / (entry["runs"] + 2),
+        "success_rate": successes / entry["runs"] if entry["runs"] else 0.0,
+        "median_latency_s": statistics.median(entry["latencies_s"]) if entry["latencies_s"] else None,
+        "mean_completion_tokens": round(entry["completion_tokens"] / measured) if measured else None,
+        "mean_output_kb": round(entry["output_bytes"] / measured / 1024, 1) if measured else None,
+    }
+
+def _rank_key(row):
+    latency = row["median_latency_s"]
+    return (-row["win_rate"], -row["success_rate"], latency if latency is not None else float("inf"))
+
+def get_leaderboard(provider=None):
+    """Returns the leaderboard rows (optionally for one provider), best first."""
+    rows = [_summarize(entry) for entry in _store.values() if provider is None or entry["provider"] == provider]
+    return sorted(rows, key=_rank_key)
+
+def preferred_model(provider, model_ids):
+    """Returns the best-ranked of `model_ids` for a provider, or None if none of them was compared yet."""
+    candidates = set(model_ids)
+    for row in get_leaderboard(provider):
+        if row["model"] in candidates and row["runs"] and row["success_rate"] > 0:
+            return row["model"]
+    return None
@@ -0,0 +1,196 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from .config import MEMORY_BUDGET_BYTES, MEMORY_RSS_SAMPLE_INTERVAL
+from .metrics import timed
+
+try:
+    import resource
+except ImportError: # Not available on Windows
+    resource = None
+
+# --- Process Memory ---
+# RSS is read from /proc/self/statm where there is one (Linux, which the pods run); elsewhere only
+# the process-wide peak from getrusage() is available.
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+def current_rss():
+    """Returns the resident set size of this process in bytes, or None if it cannot be read."""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+def process_peak_rss():
+    """Returns the highest RSS this process has reached, in bytes, or None if unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if os.uname().sysname == "Darwin" else peak * 1024 # macOS reports bytes, Linux KiB
+
+# --- Per-process Memory Budget ---
+class MemoryBudget:
+    """Admits requests while the memory they are expected to hold fits under `limit_bytes`.
+
+    Requests that do not fit wait in FIFO order, so a stream of small requests cannot starve a large
+    one. A request larger than the whole budget still runs, alone. A limit of 0 disables the budget.
+    """
+
+    def __init__(self, limit_bytes):
+        self.limit = limit_bytes
+        self._used = 0
+        self._waiting = deque() # Tickets of blocked requests, oldest first
+        self._cond = threading.Condition()
+
+    def _fits(self, nbytes):
+        return self.limit <= 0 or self._used == 0 or self._used + nbytes <= self.limit
+
+    def acquire(self, nbytes):
+        """Blocks until `nbytes` fit, then reserves them."""
+        with self._cond:
+            if not self._waiting and self._fits(nbytes):
+                self._used += nbytes
+                return
+            ticket = object()
+            self._waiting.append(ticket)
+            try:
+                while self._waiting[0] is not ticket or not self._fits(nbytes):
+                    self._cond.wait()
+            finally:
+                self._waiting.remove(ticket)
+                self._cond.notify_all() # The next in line may fit as well
+            self._used += nbytes
+
+    def release(self, nbytes):
+        with self._cond:
+            self._used = max(0, self._used - nbytes)
+            self._cond.notify_all()
+
+    @contextmanager
+    def reserved(self, nbytes):
+        """Holds `nbytes` for the duration of a with-block."""
+        self.acquire(nbytes)
+        try:
+            yield
+        finally:
+            self.release(nbytes)
+
+    def status(self):
+        with self._cond:
+            return {"limit_bytes": self.limit, "reserved_bytes": self._used, "waiting": len(self._waiting)}
+
+_budget = MemoryBudget(MEMORY_BUDGET_BYTES)
+
+def reserve_memory(nbytes):
+    """Holds `nbytes` of the process budget for a with-block, e.g. around decoding an upload for display.
+
+    Only for work outside a generation request: a request that waits for more budget while holding
+    some can deadlock behind the requests queued for it. Requests use RequestMemory instead.
+    """
+    return _budget.reserved(max(0, int(nbytes)))
+
+def get_memory_status():
+    """Returns the process budget (limit, reserved bytes, waiting requests) and the current RSS."""
+    return {**_budget.status(), "rss_bytes": current_rss()}
+
+# --- Per-request Accounting ---
+# While requests are in flight, one background thread samples the RSS every
+# MEMORY_RSS_SAMPLE_INTERVAL and raises each active request's peak; requests also sample at their
+# own stage boundaries. The peak is the process RSS while the request ran, so concurrent requests share it.
+_active = set()
+_active_lock = threading.Lock()
+_sampler_wakeup = threading.Event()
+_sampler = None
+
+def _sample_active():
+    while True:
+        _sampler_wakeup.wait()
+        rss = current_rss()
+        with _active_lock:
+            if not _active:
+                _sampler_wakeup.clear()
+                continue
+            for request in _active:
+                request.observe(rss)
+        time.sleep(MEMORY_RSS_SAMPLE_INTERVAL)
+
+def _start_sampler():
+    global _sampler
+    with _active_lock:
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample_active, name="rss-sampler", daemon=True)
+            _sampler.start()
+
+class RequestMemory:
+    """Memory accounting of one generation request, used as a context manager around it.
+
+    reserve() waits for room in the process budget before the image is decoded, shrink() gives back
+    what is no longer needed once the request payload is built, and everything is released on exit.
+    The figures end up in stats["memory"]: bytes reserved, seconds queued for the budget, and the
+    RSS at the start and at its highest while the request ran.
+    """
+
+    def __init__(self, stats, budget=None):
+        self.stats = stats
+        self.budget = budget or _budget
+        self.reserved = 0
+        self._peak_reserved = 0
+        self._rss_start = None
+        self._rss_peak = None
+
+    def observe(self, rss):
+        if rss is not None and (self._rss_peak is None or rss > self._rss_peak):
+            self._rss_peak = rss
+
+    def sample(self):
+        self.observe(current_rss())
+
+    def reserve(self, nbytes):
+        """Reserves `nbytes` more, waiting (recorded as the "memory_wait" stage) while the budget is full."""
+        nbytes = max(0, int(nbytes))
+        started = time.perf_counter()
+        with timed(self.stats, "memory_wait"):
+            self.budget.acquire(nbytes)
+        waited = time.perf_counter() - started
+        if waited > 0.05:
+            logging.info(f"Waited {waited:.2f}s for {nbytes / 2**20:.0f} MB of the process memory budget.")
+        self.reserved += nbytes
+        self._peak_reserved = max(self._peak_reserved, self.reserved)
+        self.sample()
+
+    def shrink(self, nbytes):
+        """Lowers the reservation to `nbytes` if it is higher, letting waiting requests in."""
+        nbytes = max(0, int(nbytes))
+        if nbytes < self.reserved:
+            self.budget.release(self.reserved - nbytes)
+            self.reserved = nbytes
+        self.sample()
+
+    def __enter__(self):
+        self._rss_start = current_rss()
+        self.observe(self._rss_start)
+        with _active_lock:
+            _active.add(self)
+        _start_sampler()
+        _sampler_wakeup.set()
+        return self
+
+    def __exit__(self, *exc_info):
+        with _active_lock:
+            _active.discard(self)
+        self.sample()
+        if self.reserved:
+            self.budget.release(self.reserved)
+            self.reserved = 0
+        self.stats["memory"] = {
+            "reserved_bytes": self._peak_reserved,
+            "queued_s": self.stats.get("timings", {}).get("memory_wait", 0.0),
+            "rss_start_bytes": self._rss_start,
+            "rss_peak_bytes": self._rss_peak,
+            "process_peak_rss_bytes": process_peak_rss(),
+        }
+        return False
@@ -0,0 +1,232 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .config import (
+    TRACE_LOG_PATH,
+    METRICS_PROM_PATH,
+    RECENT_TRACES_LIMIT,
+    RECENT_RERUNS_LIMIT,
+    STAGE_SECONDS_BUCKETS
+)
+
+# --- Stage Timing ---
+@contextmanager
+def timed(stats, stage):
+    """Adds the wall time of the block to stats["timings"][stage] (seconds, accumulated)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = stats.setdefault("timings", {})
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - started
+
+def record_usage(stats, prompt_tokens=None, completion_tokens=None):
+    """Stores token usage reported by a provider response."""
+    if prompt_tokens is not None:
+        stats["prompt_tokens"] = int(prompt_tokens)
+    if completion_tokens is not None:
+        stats["completion_tokens"] = int(completion_tokens)
+
+# --- Registry (Prometheus-style counters and histograms) ---
+_lock = threading.Lock()
+_recent = deque(maxlen=RECENT_TRACES_LIMIT)
+_counters = {} # (metric name, sorted label items) -> value
+_histograms = {} # (metric name, sorted label items) -> [bucket counts..., sum, count]
+
+def _inc(name, labels, amount=1):
+    key = (name, tuple(sorted(labels.items())))
+    _counters[key] = _counters.get(key, 0) + amount
+
+def _observe(name, labels, value):
+    key = (name, tuple(sorted(labels.items())))
+    hist = _histograms.get(key)
+    if hist is None:
+        hist = _histograms[key] = [0] * len(STAGE_SECONDS_BUCKETS) + [0.0, 0]
+    for i, bound in enumerate(STAGE_SECONDS_BUCKETS):
+        if value <= bound:
+            hist[i] += 1
+    hist[-2] += value
+    hist[-1] += 1
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(items):
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape_label(v)}"' for k, v in items) + "}"
+
+def render_prometheus():
+    """Returns all metrics in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        seen = set()
+        for (name, items), value in sorted(_counters.items()):
+            if name not in seen:
+                lines.append(f"# TYPE {name} counter")
+                seen.add(name)
+            lines.append(f"{name}{_format_labels(items)} {value}")
+        for (name, items), hist in sorted(_histograms.items()):
+            if name not in seen:
+                lines.append(f"# TYPE {name} histogram")
+                seen.add(name)
+            for bound, count in zip(STAGE_SECONDS_BUCKETS, hist):
+                lines.append(f"{name}_bucket{_format_labels(items + (('le', bound),))} {count}")
+            lines.append(f"{name}_bucket{_format_labels(items + (('le', '+Inf'),))} {hist[-1]}")
+            lines.append(f"{name}_sum{_format_labels(items)} {hist[-2]}")
+            lines.append(f"{name}_count{_format_labels(items)} {hist[-1]}")
+    return "\n".join(lines) + "\n"
+
+def _write_exports(record):
+    try:
+        os.makedirs(os.path.dirname(TRACE_LOG_PATH) or ".", exist_ok=True)
+        with open(TRACE_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+        tmp_path = f"{METRICS_PROM_PATH}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(render_prometheus())
+        os.replace(tmp_path, METRICS_PROM_PATH)
+    except OSError as e:
+        logging.warning(f"Metrics: could not write exports: {e}")
+
+# --- Trace Recording ---
+def record_generation(provider, model_id, stats, generated_html, error_message, kind="generation"):
+    """Records one generation request: updates metrics, appends to the trace log and the recent list.
+
+    Returns the trace ID (also stored as stats["trace_id"]) so later stages, such as the preview
+    render in app.py, can be attached with record_stage().
+    """
+    trace_id = stats.get("trace_id") or uuid.uuid4().hex[:12]
+    stats["trace_id"] = trace_id
+    status = "cache_hit" if stats.get("cache_hit") else ("error" if error_message else "ok")
+    prep = stats.get("preprocessing") or {}
+    memory = stats.get("memory") or {}
+    record = {
+        "trace_id": trace_id,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "kind": kind,
+        "provider": provider,
+        "model": model_id,
+        "status": status,
+        "error": error_message,
+        "timings": {stage: round(seconds, 4) for stage, seconds in stats.get("timings", {}).items()},
+        "provider_latency_s": round(stats.get("provider_latency_s", 0.0), 3),
+        "time_to_first_token_s": round(stats["time_to_first_token_s"], 3) if "time_to_first_token_s" in stats else None,
+        "rate_limit_wait_s": round(stats.get("rate_limit_wait_s", 0.0), 3),
+        "attempts": stats.get("attempts"),
+        "prompt_tokens": stats.get("prompt_tokens"),
+        "completion_tokens": stats.get("completion_tokens"),
+        "input_bytes": prep.get("original_bytes"),
+        "sent_image_bytes": prep.get("final_bytes"),
+        "request_bytes": stats.get("request_bytes"),
+        "output_bytes": len(generated_html.encode("utf-8")) if generated_html else 0,
+        "memory_wait_s": round(memory.get("queued_s", 0.0), 3),
+        "reserved_bytes": memory.get("reserved_bytes"),
+        "peak_rss_bytes": memory.get("rss_peak_bytes"), # Process RSS while the request ran (shared by concurrent requests)
+    }
+    labels = {"provider": provider, "model": model_id}
+    with _lock:
+        _inc("ui_cloner_requests_total", {**labels, "kind": kind, "status": status})
+        for stage, seconds in record["timings"].items():
+            _observe("ui_cloner_stage_seconds", {"stage": stage}, seconds)
+        if status != "cache_hit":
+            _observe("ui_cloner_provider_latency_seconds", labels, record["provider_latency_s"])
+        if record["time_to_first_token_s"] is not None:
+            _observe("ui_cloner_time_to_first_token_seconds", labels, record["time_to_first_token_s"])
+        if record["prompt_tokens"]:
+            _inc("ui_cloner_tokens_total", {**labels, "kind": "prompt"}, record["prompt_tokens"])
+        if record["completion_tokens"]:
+            _inc("ui_cloner_tokens_total", {**labels, "kind": "completion"}, record["completion_tokens"])
+        for direction, key in (("input", "input_bytes"), ("sent", "request_bytes"), ("output", "output_bytes")):
+            if record[key]:
+                _inc("ui_cloner_bytes_total", {"direction": direction}, record[key])
+        _recent.append(record)
+    _write_exports(record)
+    return trace_id
+
+def record_stage(trace_id, stage, seconds):
+    """Attaches a stage measured outside the generation path (e.g. preview render) to a trace."""
+    with _lock:
+        _observe("ui_cloner_stage_seconds", {"stage": stage}, seconds)
+        for record in _recent:
+            if record["trace_id"] == trace_id:
+                record["timings"][stage] = round(seconds, 4)
+                break
+    _write_exports({"trace_id": trace_id, "stage": stage, "seconds": round(seconds, 4)})
+
+def get_recent_traces(limit=None):
+    """Returns the most recent trace records, newest first."""
+    with _lock:
+        records = list(_recent)
+    records.reverse()
+    return records[:limit] if limit else records
+
+# --- App Responsiveness (lazy imports and Streamlit reruns) ---
+_import_seconds = {} # module name -> seconds its first import took
+_rerun_seconds = deque(maxlen=RECENT_RERUNS_LIMIT)
+
+def record_import(module, seconds):
+    """Records how long the first import of a module (a provider SDK, or app.py's own imports) took.
+
+    Later calls for the same module are ignored, so app.py can report its imports on every run.
+    """
+    with _lock:
+        if module in _import_seconds:
+            return
+        _import_seconds[module] = seconds
+        _observe("ui_cloner_import_seconds", {"module": module}, seconds)
+
+def record_rerun(seconds, scope="script"):
+    """Records the wall time of one Streamlit run: the whole "script" or the polling "fragment".
+
+    Not exported to disk, as it happens on every interaction.
+    """
+    with _lock:
+        _rerun_seconds.append((scope, seconds))
+        _observe("ui_cloner_rerun_seconds", {"scope": scope}, seconds)
+
+def get_responsiveness():
+    """Returns {"imports": {module: seconds}, "reruns": {scope: [recent run seconds, oldest first]}}."""
+    with _lock:
+        reruns = {}
+        for scope, seconds in _rerun_seconds:
+            reruns.setdefault(scope, []).append(seconds)
+        return {"imports": dict(_import_seconds), "reruns": reruns}
+
+# --- Optional /metrics HTTP endpoint ---
+_server = None
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Scrapes are too frequent for the access log
+
+def start_metrics_server(port):
+    """Serves /metrics on the given port from a daemon thread (once per process)."""
+    global _server
+    with _lock:
+        if _server is not None or not port:
+            return
+        try:
+            _server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+        except OSError as e:
+            logging.warning(f"Metrics: could not listen on port {port}: {e}")
+            return
+    threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+    logging.info(f"Metrics: serving Prometheus metrics on :{port}/metrics")
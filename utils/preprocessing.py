@@ -0,0 +1,311 @@
+import binascii
+import hashlib
+import io
+import logging
+import math
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from PIL import Image, ImageOps
+from .config import (
+    IMAGE_PROVIDER_LIMITS,
+    IMAGE_LOSSY_QUALITY,
+    IMAGE_MEMO_MAX_ENTRIES,
+    IMAGE_THUMBNAIL_MAX_WIDTH,
+    IMAGE_THUMBNAIL_MAX_BYTES,
+    IMAGE_MAX_BYTES,
+    IMAGE_MAX_PIXELS,
+    IMAGE_BASE64_CHUNK_BYTES
+)
+from .memory import reserve_memory
+
+_MIME_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp", "GIF": "image/gif"}
+
+# Backstop for decodes that do not go through open_image(): Pillow then refuses images of more than
+# twice this many pixels before decoding them.
+Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+
+@dataclass
+class PreparedImage:
+    """Image bytes ready to be sent to a provider, plus what preprocessing did to them."""
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+    stats: dict = field(default_factory=dict)
+
+def detect_mime_type(img_bytes):
+    """Returns the MIME type from the file signature, falling back to PNG."""
+    if img_bytes.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if img_bytes.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if img_bytes[:4] == b"RIFF" and img_bytes[8:12] == b"WEBP":
+        return "image/webp"
+    if img_bytes[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return "image/png"
+
+def target_size(width, height, limits):
+    """Returns the (width, height) the provider would actually look at, never upscaling."""
+    scale = 1.0
+    max_side = limits.get("max_side")
+    if max_side and max(width, height) > max_side:
+        scale = max_side / max(width, height)
+    short_side = limits.get("short_side")
+    if short_side and min(width, height) * scale > short_side:
+        scale = short_side / min(width, height)
+    if scale >= 1.0:
+        return width, height
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def estimate_image_tokens(width, height, provider):
+    """Estimates the input tokens billed for an image of this size."""
+    limits = IMAGE_PROVIDER_LIMITS.get(provider, {})
+    tile = limits.get("token_tile", 512)
+    per_tile = limits.get("tokens_per_tile", 170)
+    base = limits.get("base_tokens", 85)
+    if provider == "OpenAI":
+        # OpenAI rescales server-side before tiling, so count tiles on the rescaled image.
+        width, height = target_size(width, height, {"max_side": 2048, "short_side": 768})
+    small_side = limits.get("single_tile_max_side")
+    if small_side and width <= small_side and height <= small_side:
+        return base + per_tile
+    return base + per_tile * math.ceil(width / tile) * math.ceil(height / tile)
+
+def _encode(img, fmt):
+    buf = io.BytesIO()
+    if fmt == "PNG":
+        img.save(buf, format="PNG", optimize=True)
+    elif fmt == "JPEG":
+        img.save(buf, format="JPEG", quality=IMAGE_LOSSY_QUALITY, optimize=True, progressive=True)
+    elif fmt == "WEBP":
+        img.save(buf, format="WEBP", quality=IMAGE_LOSSY_QUALITY, method=4)
+    return buf.getvalue()
+
+def _flatten(img):
+    """Converts to a mode every target format accepts, compositing transparency onto white."""
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        return background
+    if img.mode != "RGB":
+        return img.convert("RGB")
+    return img
+
+def check_image_size(img_bytes, width=0, height=0):
+    """Returns an error message if an upload is too large to handle (or decode) safely, else None."""
+    if len(img_bytes) > IMAGE_MAX_BYTES:
+        return f"The image is {len(img_bytes) / 2**20:.0f} MB; at most {IMAGE_MAX_BYTES // 2**20} MB are accepted."
+    if width * height > IMAGE_MAX_PIXELS:
+        return f"The image is {width}x{height} pixels; at most {IMAGE_MAX_PIXELS / 1e6:.0f} megapixels are accepted."
+    return None
+
+def open_image(img_bytes):
+    """Opens an upload lazily, after rejecting it from its header alone if it is too large to decode.
+
+    Every decode of an upload starts here, so a decompression bomb fails before any pixel is read.
+    Raises ValueError (with the message of check_image_size) for oversized images.
+    """
+    src = Image.open(io.BytesIO(img_bytes))
+    size_error = check_image_size(img_bytes, *src.size)
+    if size_error:
+        src.close()
+        raise ValueError(size_error)
+    return src
+
+def _decode_memory(width, height):
+    return 2 * 4 * min(width * height, IMAGE_MAX_PIXELS) # Decoded image and one converted copy, 4 bytes per pixel
+
+def estimate_decode_memory(img_bytes):
+    """Estimates the bytes a full decode of an upload holds, from its header only."""
+    try:
+        with Image.open(io.BytesIO(img_bytes)) as src: # Only the header is read
+            return _decode_memory(*src.size)
+    except Exception:
+        return 4 * len(img_bytes) # Fails properly when it is decoded
+
+def estimate_preprocessing_memory(img_bytes, preprocess=True):
+    """Estimates the bytes a generation holds at its peak, from the image header only.
+
+    Preprocessing holds the decoded image twice at worst (source and flattened copy, 4 bytes per
+    pixel); without it, the upload travels as base64 in the payload, its JSON body and the bytes sent.
+    """
+    if not preprocess:
+        return 4 * len(img_bytes)
+    return len(img_bytes) + estimate_decode_memory(img_bytes)
+
+def _exif_swaps_axes(img):
+    return img.getexif().get(0x0112) in (5, 6, 7, 8) # Orientations rotated by 90 or 270 degrees
+
+def preprocess_image(img_bytes, provider):
+    """Downscales, strips metadata and re-encodes an image for the given provider.
+
+    The image is decoded once, after its size is checked from the header (see check_image_size).
+    JPEGs are decoded straight at the smallest scale that still covers the target size.
+    Returns (PreparedImage, error_message).
+    """
+    limits = IMAGE_PROVIDER_LIMITS.get(provider)
+    if limits is None:
+        return None, f"No image limits configured for provider '{provider}'."
+    timings = {}
+    started = time.perf_counter()
+    try:
+        with Image.open(io.BytesIO(img_bytes)) as src:
+            original_format = src.format
+            original_size = src.size
+            size_error = check_image_size(img_bytes, *original_size)
+            if size_error:
+                logging.error(size_error)
+                return None, size_error
+            swapped = _exif_swaps_axes(src)
+            oriented = original_size[::-1] if swapped else original_size
+            width, height = target_size(*oriented, limits)
+            if original_format == "JPEG" and (width, height) != oriented:
+                src.draft("RGB", (height, width) if swapped else (width, height))
+            img = _flatten(ImageOps.exif_transpose(src))
+    except Exception as e:
+        error_message = f"Could not read the uploaded image: {e}"
+        logging.error(error_message)
+        return None, error_message
+    timings["image_decode"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    if (width, height) != img.size:
+        img = img.resize((width, height), Image.LANCZOS, reducing_gap=3.0) # Box-reduces first; the full-size copy is freed here
+    timings["image_resize"] = time.perf_counter() - started
+
+    # Re-encoding drops EXIF/ICC/text chunks; keep whichever allowed format is smallest.
+    started = time.perf_counter()
+    best_fmt, best_data = None, None
+    for fmt in limits["formats"]:
+        data = _encode(img, fmt)
+        if best_data is None or len(data) < len(best_data):
+            best_fmt, best_data = fmt, data
+    timings["image_encode"] = time.perf_counter() - started
+
+    tokens_before = estimate_image_tokens(*original_size, provider)
+    tokens_after = estimate_image_tokens(width, height, provider)
+    stats = {
+        "original_format": original_format,
+        "original_size": original_size,
+        "final_format": best_fmt,
+        "final_size": (width, height),
+        "original_bytes": len(img_bytes),
+        "final_bytes": len(best_data),
+        "bytes_saved": len(img_bytes) - len(best_data),
+        "estimated_tokens_before": tokens_before,
+        "estimated_tokens_after": tokens_after,
+        "estimated_tokens_saved": tokens_before - tokens_after,
+        "timings": timings,
+    }
+    logging.info(
+        f"Preprocessed image for {provider}: {original_size[0]}x{original_size[1]} {original_format} "
+        f"({len(img_bytes)} bytes) -> {width}x{height} {best_fmt} ({len(best_data)} bytes), "
+        f"~{stats['estimated_tokens_saved']} image tokens saved."
+    )
+    return PreparedImage(best_data, _MIME_TYPES[best_fmt], width, height, stats), None
+
+def encode_data_url(mime_type, data, chunk_size=IMAGE_BASE64_CHUNK_BYTES):
+    """Returns "data:<mime type>;base64,<data>" without intermediate full-size copies.
+
+    The image is read through a memoryview and encoded a chunk at a time into one preallocated
+    buffer, so only the buffer and the returned str are full size. The usual b64encode, decode and
+    f-string would make three full-size copies.
+    """
+    prefix = f"data:{mime_type};base64,".encode("ascii")
+    view = memoryview(data)
+    buffer = bytearray(len(prefix) + 4 * ((len(view) + 2) // 3))
+    buffer[:len(prefix)] = prefix
+    position = len(prefix)
+    chunk_size -= chunk_size % 3 # Whole 3-byte groups, so only the last chunk is padded
+    for start in range(0, len(view), chunk_size):
+        encoded = binascii.b2a_base64(view[start:start + chunk_size], newline=False)
+        buffer[position:position + len(encoded)] = encoded
+        position += len(encoded)
+    return buffer.decode("ascii")
+
+def passthrough_image(img_bytes):
+    """Wraps the raw upload without preprocessing, labelled with its real MIME type."""
+    mime_type = detect_mime_type(img_bytes)
+    stats = {"original_bytes": len(img_bytes), "final_bytes": len(img_bytes), "bytes_saved": 0}
+    return PreparedImage(img_bytes, mime_type, 0, 0, stats)
+
+# --- Session Image Memo ---
+@dataclass
+class ImageInfo:
+    """What the UI needs to know about an upload, decoded once."""
+    digest: str
+    width: int
+    height: int
+    format: str
+    thumbnail: bytes = field(repr=False) # At most IMAGE_THUMBNAIL_MAX_WIDTH wide; the upload itself if already small
+
+def _thumbnail(src, img_bytes):
+    """Returns the display thumbnail of an image opened with open_image (see ImageInfo.thumbnail).
+
+    The decode is held in the process memory budget; JPEGs are decoded at a reduced scale.
+    """
+    width, height = src.size
+    if width <= IMAGE_THUMBNAIL_MAX_WIDTH and len(img_bytes) <= IMAGE_THUMBNAIL_MAX_BYTES:
+        return img_bytes
+    with reserve_memory(_decode_memory(width, height)):
+        if src.format == "JPEG": # Both sides stay at least this large, whichever way EXIF rotates the image
+            src.draft("RGB", (IMAGE_THUMBNAIL_MAX_WIDTH, IMAGE_THUMBNAIL_MAX_WIDTH))
+        img = _flatten(ImageOps.exif_transpose(src))
+        img.thumbnail((IMAGE_THUMBNAIL_MAX_WIDTH, img.height), Image.LANCZOS, reducing_gap=2.0)
+        return _encode(img, "JPEG")
+
+def make_thumbnail(img_bytes):
+    """Returns the display thumbnail of an image, or None if it cannot be decoded.
+
+    Finished jobs keep this instead of the upload, so the job store does not hold full-size screenshots;
+    the upload itself is kept where it is the smaller of the two.
+    """
+    try:
+        with open_image(img_bytes) as src:
+            thumbnail = _thumbnail(src, img_bytes)
+        return thumbnail if len(thumbnail) < len(img_bytes) else bytes(img_bytes)
+    except Exception as e:
+        logging.warning(f"Could not decode an uploaded image for display: {e}")
+        return None
+
+def content_digest(img_bytes):
+    """Returns a short content hash of image bytes (blake2b runs at memory speed)."""
+    return hashlib.blake2b(img_bytes, digest_size=16).hexdigest()
+
+class ImageMemo:
+    """Decoded image facts and display thumbnails keyed by content hash, kept per Streamlit session.
+
+    Streamlit reruns the script on every interaction (and the job view polls every second), so
+    without it every rerun would decode and downscale each full-size screenshot on display again.
+    """
+
+    def __init__(self, max_entries=IMAGE_MEMO_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict() # digest -> ImageInfo, least recently used first
+
+    def get(self, img_bytes):
+        """Returns the ImageInfo of an image, decoding it only the first time. None if it cannot be read."""
+        digest = content_digest(img_bytes)
+        info = self._entries.get(digest)
+        if info is not None:
+            self._entries.move_to_end(digest)
+            return info
+        try:
+            with open_image(img_bytes) as src:
+                original_format, (width, height) = src.format, src.size
+                thumbnail = _thumbnail(src, img_bytes)
+        except Exception as e:
+            logging.warning(f"Could not decode an uploaded image for display: {e}")
+            return None
+        info = self._entries[digest] = ImageInfo(digest, width, height, original_format, thumbnail)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return info
+
+    def thumbnail(self, img_bytes):
+        """Returns bytes suitable for st.image: the memoized thumbnail, or the image itself if it cannot be decoded."""
+        info = self.get(img_bytes)
+        return info.thumbnail if info is not None else img_bytes
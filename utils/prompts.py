@@ -28,4 +28,67 @@ SYSTEM_PROMPT = """
     *   Style this placeholder `<div>` with a background color, border, and approximate dimensions (width/height) based on the image in the screenshot. Example: `<div style="width:150px; height:100px; background-color:#eee; border:1px dashed #ccc; display:flex; align-items:center; justify-content:center; color:#888; font-size:12px; text-align:center;">add your image</div>`
 
 **Process:** Carefully examine the screenshot provided. Generate the complete, single-file HTML code according to all instructions above. Ensure the final output is only the raw HTML code.
-"""
\ No newline at end of file
+"""
+# ---Section Prompt (tiled generation of tall screenshots)---
+SECTION_PROMPT_TEMPLATE = SYSTEM_PROMPT + """
+**Section Mode:** The screenshot is horizontal section {index} of {count} cut from a taller page (rows {top}px to {bottom}px of a page {page_width}px wide). The sections will be stacked vertically into one document afterwards, so:
+*   Reproduce **only** what is visible in this section, as one `<section class="{prefix}">` element inside `<body>`. It must span the full page width.
+*   Content may be cut off at the top or bottom edge; replicate what is visible without inventing the rest.
+*   Prefix **every** CSS class name and id you define with `{prefix}-` so sections do not clash. Do not style `html`, `body` or `*` except for a shared reset.
+*   Still return a complete HTML document as described above.
+"""
+# ---Site Prompts (several pages of one site sharing a design system, see utils/site.py)---
+SITE_DESIGN_SYSTEM_PROMPT = """
+**Primary Goal:** The screenshot shows one page of a website whose pages will be cloned one by one. Extract the site's **shared design system**: one stylesheet and a small library of components that every page of the site can reuse instead of restating them.
+
+**Output Format:**
+*   Your response MUST be **ONLY** the raw HTML code, starting **directly** with `<!DOCTYPE html>` and ending **directly** with `</html>`. No explanations, no markdown.
+*   Put the shared stylesheet in a single `<style>` block in `<head>`: CSS custom properties for the palette and fonts on `:root`, a base reset and typography (`body`, headings, links, lists), page containers, and one class per shared component and variant (e.g. `.site-header`, `.site-nav`, `.site-footer`, `.btn`, `.btn-primary`, `.card`). Use short, descriptive class names.
+*   In `<body>`, give one example of each shared component, each preceded by a comment naming it, e.g. `<!-- component: header -->`. Include the header/navigation, the footer, buttons and cards when the site has them, and any other element likely to repeat across pages (forms, badges, section headings).
+*   Components use only classes from the stylesheet (no inline styles). Where an image appears, use a `<div>` with a placeholder class containing the exact text 'add your image'.
+*   Do not reproduce content that is unique to this page; only what other pages of the same site would share. Match colors (hex), spacing, radii, shadows and typography exactly.
+"""
+SITE_PAGE_PROMPT_TEMPLATE = SYSTEM_PROMPT + """
+**Site Mode:** This page belongs to a site whose shared stylesheet is already written and saved as `{stylesheet}`; it is given below together with the site's shared components. This overrides the single-file instruction above:
+*   In `<head>`, link the stylesheet with `<link rel="stylesheet" href="{stylesheet}">` and **DO NOT** repeat any of its rules. Your own `<style>` block holds only the rules for content unique to this page, and may be omitted.
+*   Build the page from the stylesheet's classes. For the header, footer, buttons, cards and other shared elements, reuse the component markup below, changing only the text.
+
+Shared stylesheet ({stylesheet}):
+{css}
+
+Shared components:
+{components}
+"""
+# ---Continuation Prompt (output cut off by the length limit)---
+CONTINUATION_PROMPT = """Your previous reply was cut off by the output length limit. Continue the HTML code exactly from the last character you wrote.
+*   **DO NOT** repeat anything you already wrote and **DO NOT** start the document over.
+*   **DO NOT** add any explanation or markdown formatting.
+*   End with `</html>`.
+"""
+# ---Layout Prompt (compact layout tree rendered locally, see utils/layout.py)---
+LAYOUT_PROMPT = """
+**Primary Goal:** Analyze the provided website screenshot and describe its visual appearance and static layout as a **compact JSON layout tree**. The tree is rendered to HTML/CSS by a program, so it must be precise and complete but as short as possible.
+
+**Output Format:** Respond with **ONLY** one JSON object, no markdown and no explanation:
+`{"title": "...", "palette": {...}, "fonts": {...}, "styles": {...}, "root": <node>}`
+*   `palette`: named colors, e.g. `{"bg": "#ffffff", "text": "#1f2937", "primary": "#2563eb"}`. `bg` and `text` are the page background and text color. Refer to colors by name anywhere a color is expected.
+*   `fonts`: named CSS `font` shorthands, e.g. `{"body": "16px/1.5 Arial, sans-serif", "h1": "700 36px/1.2 Georgia, serif"}`. `body` is the page default.
+*   `styles`: named property presets for repeated elements (cards, nav links, buttons), e.g. `{"card": {"t": "col", "p": 16, "r": 8, "bg": "surface"}}`. A node uses one with `"s": "card"`; its own properties override the preset.
+
+**Nodes:** `{"t": type, ...}` with type one of:
+*   `box` (block), `row` (horizontal flex), `col` (vertical flex), `grid` — containers; children go in `c` (a list of nodes).
+*   `text` — `c` is the text. `button` — `c` is the label. `input` — `ph` is the placeholder. `hr` — a divider.
+*   `img` — any image, icon, logo or illustration: give only its size (`w`, `h`); it becomes an 'add your image' placeholder.
+
+**Properties** (omit any that are not needed; numbers are pixels, strings are raw CSS values):
+*   `tag`: semantic tag (header, nav, main, section, footer, aside, ul, li, h1-h6, p, span, a, label...).
+*   Size and spacing: `w`, `h`, `minh`, `maxw` (centers a container), `p` (padding), `m` (margin), `gap`. Padding/margin may be a number or a list like `[8, 16]`.
+*   Colors and borders: `bg`, `fg` (text color), `b` (border width, with `bc` color, or a full CSS border), `r` (radius), `sh` (`true` or a CSS box-shadow).
+*   Layout: `al` (align-items: start|center|end|stretch|baseline), `jc` (justify: start|center|end|between|around|evenly), `wrap` (true), `grow` (flex-grow), `cols` (grid columns: a count or a CSS template).
+*   Text: `f` (font name), `fs` (size), `fw` (weight), `i` (italic), `u` (underline), `ta` (text-align), `tt` (text-transform), `ls` (letter-spacing).
+
+**Rules:**
+*   Cover the **ENTIRE visible area** and include **ALL visible text** exactly.
+*   Match colors (hex), spacing, alignment, sizes and typography as closely as possible; reuse palette, font and style names instead of repeating values.
+*   Nest `row`/`col`/`grid` containers to reproduce the layout; do not position elements absolutely.
+"""
@@ -0,0 +1,52 @@
+import threading
+import time
+
+class TokenBucket:
+    """Thread-safe token bucket that spaces out calls to a fixed rate per minute."""
+
+    def __init__(self, rate_per_minute, burst=1):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        """Takes a token if one is available. Returns the seconds to wait otherwise (0.0 on success)."""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self, timeout=None):
+        """Blocks until a token is available. Returns False if `timeout` seconds pass first."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire()
+            if wait == 0.0:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+def get_rate_limiter(name, rate_per_minute, burst=1):
+    """Returns the process-wide bucket for `name`, creating it (or resetting its rate) as needed."""
+    with _buckets_lock:
+        bucket = _buckets.get(name)
+        if bucket is None or bucket.rate != rate_per_minute / 60.0 or bucket.capacity != max(1, burst):
+            bucket = TokenBucket(rate_per_minute, burst)
+            _buckets[name] = bucket
+        return bucket
@@ -0,0 +1,220 @@
+import email.utils
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from .config import (
+    PROVIDER_REQUESTS_PER_MINUTE,
+    RETRY_MAX_ATTEMPTS,
+    RETRY_BASE_DELAY,
+    RETRY_MAX_DELAY,
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_RESET_TIMEOUT,
+    JOB_MAX_WORKERS,
+    TILING_MAX_WORKERS,
+    SITE_MAX_WORKERS
+)
+from .ratelimit import get_rate_limiter
+from .clients import key_fingerprint
+from .sdk import loaded
+
+_RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+def _retryable_exceptions():
+    """Transient exception types of the SDKs imported so far; the others cannot have raised."""
+    exceptions = []
+    openai = loaded("openai")
+    if openai:
+        exceptions += [openai.APITimeoutError, openai.APIConnectionError]
+    requests = loaded("requests")
+    if requests:
+        exceptions += [requests.exceptions.ConnectionError, requests.exceptions.Timeout]
+    google_exceptions = loaded("google.api_core.exceptions")
+    if google_exceptions:
+        exceptions += [
+            google_exceptions.ResourceExhausted,
+            google_exceptions.ServiceUnavailable,
+            google_exceptions.DeadlineExceeded,
+            google_exceptions.InternalServerError,
+            google_exceptions.TooManyRequests,
+        ]
+    return tuple(exceptions)
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose circuit breaker is open."""
+
+    def __init__(self, provider, retry_in):
+        super().__init__(f"{provider} is failing repeatedly; not sending requests for another {retry_in:.0f}s.")
+        self.provider = provider
+        self.retry_in = retry_in
+
+def is_retryable(e):
+    """Returns True for transient failures: rate limits, timeouts, connection resets and 5xx errors."""
+    if isinstance(e, _retryable_exceptions()):
+        return True
+    openai, requests = loaded("openai"), loaded("requests")
+    if openai and isinstance(e, openai.APIStatusError):
+        return e.status_code in _RETRYABLE_STATUS_CODES
+    if requests and isinstance(e, requests.exceptions.HTTPError) and e.response is not None:
+        return e.response.status_code in _RETRYABLE_STATUS_CODES
+    return False
+
+def retry_after_seconds(e):
+    """Returns the server-requested delay from Retry-After / retry-after-ms headers, if any."""
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        parsed = email.utils.parsedate_to_datetime(retry_after)
+        return max(0.0, parsed.timestamp() - time.time()) if parsed else None
+
+def backoff_delay(attempt, retry_after=None):
+    """Exponential backoff with full jitter for the given (1-based) failed attempt."""
+    if retry_after is not None:
+        return min(RETRY_MAX_DELAY, retry_after)
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+
+# --- Circuit Breaker ---
+class CircuitBreaker:
+    """Opens after consecutive transient failures, then lets one trial request through per reset period."""
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        """Raises CircuitOpenError if the call should not be made."""
+        with self.lock:
+            if self.opened_at is None:
+                return
+            elapsed = time.monotonic() - self.opened_at
+            if elapsed < self.reset_timeout or self.trial_in_flight:
+                raise CircuitOpenError(self.name, max(0.0, self.reset_timeout - elapsed))
+            self.trial_in_flight = True # Half-open: this call is the trial
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                logging.info(f"Circuit for {self.name} closed again.")
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_in_flight or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self.trial_in_flight:
+                    logging.warning(f"Circuit for {self.name} opened after {self.failures} consecutive failures.")
+                self.opened_at = time.monotonic()
+                self.trial_in_flight = False
+
+    def release_trial(self):
+        """Ends a trial that failed for a non-transient reason (neither success nor outage)."""
+        with self.lock:
+            self.trial_in_flight = False
+
+    def state(self):
+        with self.lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+_breakers = {} # (provider, key fingerprint) -> CircuitBreaker
+_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(provider, api_key=None):
+    """Returns the process-wide circuit breaker for a provider and API key.
+
+    Keyed like the client pool: a key that is rate limited (429) or out of quota only pauses the
+    sessions using that key, not everyone calling the provider.
+    """
+    breaker_key = (provider, key_fingerprint(api_key) if api_key else None)
+    with _breakers_lock:
+        if breaker_key not in _breakers:
+            _breakers[breaker_key] = CircuitBreaker(provider)
+        return _breakers[breaker_key]
+
+def get_provider_rate_limiter(provider, requests_per_minute=None):
+    """Returns the token bucket shared by every session and batch job calling this provider."""
+    rpm = requests_per_minute or PROVIDER_REQUESTS_PER_MINUTE.get(provider, 60)
+    return get_rate_limiter(f"provider:{provider}", rpm, burst=max(1, int(rpm // 10)))
+
+# --- Retry Loop ---
+def call_with_retries(provider, call_fn, rate_limiter=None, stats=None, max_attempts=RETRY_MAX_ATTEMPTS, api_key=None):
+    """Runs `call_fn()` under the provider's rate limiter and the circuit breaker of the provider and
+    `api_key`, retrying transient errors.
+
+    Non-transient errors and the last transient error are re-raised to the caller.
+    """
+    if stats is None:
+        stats = {}
+    breaker = get_circuit_breaker(provider, api_key)
+    for attempt in range(1, max_attempts + 1):
+        breaker.before_call()
+        if rate_limiter is not None:
+            wait_started = time.monotonic()
+            rate_limiter.acquire()
+            stats["rate_limit_wait_s"] = stats.get("rate_limit_wait_s", 0.0) + time.monotonic() - wait_started
+        stats["attempts"] = attempt
+        try:
+            result = call_fn()
+        except Exception as e:
+            if not is_retryable(e):
+                breaker.release_trial()
+                raise
+            breaker.record_failure()
+            if attempt == max_attempts:
+                raise
+            delay = backoff_delay(attempt, retry_after_seconds(e))
+            logging.warning(f"{provider}: transient error on attempt {attempt}/{max_attempts} ({type(e).__name__}: {e}); retrying in {delay:.1f}s.")
+            stats["retry_wait_s"] = stats.get("retry_wait_s", 0.0) + delay
+            time.sleep(delay)
+            continue
+        breaker.record_success()
+        return result
+
+# --- Hedged Requests ---
+# Every generation job, and every tile or site page within it, may hedge at once with two calls in
+# flight. A smaller pool would queue primaries, and a queued primary looks slow and gets hedged.
+_hedge_pool = ThreadPoolExecutor(max_workers=2 * JOB_MAX_WORKERS * max(TILING_MAX_WORKERS, SITE_MAX_WORKERS), thread_name_prefix="hedge")
+
+def run_hedged(primary_fn, fallback_fn, hedge_after):
+    """Runs `primary_fn`; if it has not finished after `hedge_after` seconds, also starts `fallback_fn`.
+
+    Returns (result, used_fallback) from whichever finishes first without raising. The slower call
+    is left to finish in the background and its result is discarded.
+    """
+    primary = _hedge_pool.submit(primary_fn)
+    done, _ = wait([primary], timeout=hedge_after)
+    if done:
+        return primary.result(), False
+    logging.info(f"Primary request still running after {hedge_after}s; starting hedge request.")
+    fallback = _hedge_pool.submit(fallback_fn)
+    pending = {primary, fallback}
+    first_error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result(), future is fallback
+            first_error = first_error or future.exception()
+    raise first_error
@@ -0,0 +1,134 @@
+import io
+import logging
+import time
+from dataclasses import dataclass, field
+from PIL import Image
+from .config import (
+    IMAGE_PROVIDER_LIMITS,
+    ROUTER_DB_PATH,
+    ROUTER_LATENCY_BUDGET,
+    ROUTER_LATENCY_SAMPLES,
+    ROUTER_MIN_SAMPLES,
+    ROUTER_PRIOR_LATENCY,
+    ROUTER_EWMA_ALPHA,
+    ROUTER_MAX_ERROR_RATE,
+    ROUTER_ERROR_HALF_LIFE,
+    ROUTER_DEFAULT_OUTPUT_TOKENS,
+    MODEL_PRICES_PER_MTOK,
+    ROUTER_UNKNOWN_PRICE_PER_MTOK
+)
+from .catalog import get_model_capabilities
+from .entry_store import EntryStore
+from .preprocessing import target_size, estimate_image_tokens
+from .prompts import SYSTEM_PROMPT
+
+# --- Automatic Model Routing ---
+# Every full-page generation updates rolling statistics for its (provider, model): recent latencies,
+# an error rate and the usual output length. route_request() uses them to pick, for one screenshot,
+# the cheapest model expected to answer within the latency budget. Entries are keyed "provider|model id":
+#   {"latencies_s": [recent...], "error_rate": EWMA, "completion_tokens": EWMA, "calls": int, "updated_at"}
+# The entries are shared by every process using the data directory (see utils/entry_store.py).
+_store = EntryStore(ROUTER_DB_PATH, "Router")
+_NEW_ENTRY = {"latencies_s": [], "error_rate": None, "completion_tokens": None, "calls": 0, "updated_at": None}
+
+def _ewma(previous, value):
+    return value if previous is None else previous + ROUTER_EWMA_ALPHA * (value - previous)
+
+def record_observation(provider, model_id, stats, error_message):
+    """Learns from one finished generation. Cache hits and calls that never reached the provider are ignored."""
+    if stats.get("cache_hit") or "provider_latency_s" not in stats:
+        return
+
+    def update(entry):
+        entry["calls"] += 1
+        entry["error_rate"] = _ewma(entry["error_rate"], 1.0 if error_message else 0.0)
+        if not error_message:
+            entry["latencies_s"] = (entry["latencies_s"] + [round(stats["provider_latency_s"], 3)])[-ROUTER_LATENCY_SAMPLES:]
+            if stats.get("completion_tokens"):
+                entry["completion_tokens"] = _ewma(entry["completion_tokens"], stats["completion_tokens"])
+        entry["updated_at"] = time.time()
+
+    _store.update(f"{provider}|{model_id}", _NEW_ENTRY, update)
+
+def get_model_stats(provider, model_id):
+    """Returns the learned statistics of a model, or None if it was never observed."""
+    return _store.get(f"{provider}|{model_id}")
+
+# --- Cost and Latency Estimates ---
+def model_price(provider, model_id):
+    """Returns USD per million (input, output) tokens. Free OpenRouter models cost nothing."""
+    capabilities = get_model_capabilities(provider, model_id)
+    if (capabilities and capabilities.get("free")) or model_id.endswith(":free"):
+        return 0.0, 0.0
+    # Longest matching base name, so 'gpt-4o-mini-2024-07-18' is priced as gpt-4o-mini, not gpt-4o.
+    parts = model_id.split("/")[-1].split("-")
+    for end in range(len(parts), 0, -1):
+        price = MODEL_PRICES_PER_MTOK.get("-".join(parts[:end]))
+        if price:
+            return price
+    return ROUTER_UNKNOWN_PRICE_PER_MTOK
+
+def estimate_prompt_tokens(provider, img_size):
+    """Estimates the input tokens of a generation request: the prompt plus the preprocessed screenshot."""
+    width, height = target_size(*img_size, IMAGE_PROVIDER_LIMITS.get(provider, {}))
+    return len(SYSTEM_PROMPT) // 4 + estimate_image_tokens(width, height, provider)
+
+def _p90(values):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(0.9 * len(ordered)))]
+
+@dataclass
+class RouteDecision:
+    """The model chosen for a request, with the estimates that led to it."""
+    provider: str
+    model_id: str
+    estimated_latency_s: float
+    estimated_cost_usd: float
+    reason: str
+    candidates: list = field(default_factory=list) # One dict of estimates per considered model
+
+def route_request(provider, model_ids, img_bytes, latency_budget=ROUTER_LATENCY_BUDGET):
+    """Picks the cheapest of `model_ids` expected to answer within `latency_budget` seconds.
+
+    A model's expected latency is the 90th percentile of its recent latencies, retries and rate-limit
+    waits included (ROUTER_PRIOR_LATENCY until it has ROUTER_MIN_SAMPLES); models whose error rate is
+    above ROUTER_MAX_ERROR_RATE are skipped (the rate halves every ROUTER_ERROR_HALF_LIFE without calls). If no model fits the budget, the fastest one is used.
+    Returns a RouteDecision, or None if there is no usable model.
+    """
+    with Image.open(io.BytesIO(img_bytes)) as img: # Only the header is read
+        img_size = img.size
+    prompt_tokens = estimate_prompt_tokens(provider, img_size)
+
+    candidates = []
+    for model_id in dict.fromkeys(model_ids):
+        capabilities = get_model_capabilities(provider, model_id)
+        if capabilities and capabilities.get("vision") is False:
+            continue
+        entry = get_model_stats(provider, model_id) or {}
+        latencies = entry.get("latencies_s") or []
+        input_price, output_price = model_price(provider, model_id)
+        output_tokens = entry.get("completion_tokens") or ROUTER_DEFAULT_OUTPUT_TOKENS
+        idle = time.time() - (entry.get("updated_at") or time.time())
+        error_rate = (entry.get("error_rate") or 0.0) * 0.5 ** (idle / ROUTER_ERROR_HALF_LIFE)
+        candidates.append({
+            "model": model_id,
+            "latency_s": round(_p90(latencies), 2) if len(latencies) >= ROUTER_MIN_SAMPLES else ROUTER_PRIOR_LATENCY,
+            "cost_usd": round((prompt_tokens * input_price + output_tokens * output_price) / 1e6, 5),
+            "error_rate": round(error_rate, 3),
+            "samples": len(latencies),
+        })
+    usable = [c for c in candidates if c["error_rate"] <= ROUTER_MAX_ERROR_RATE]
+    if not usable:
+        usable = candidates # Everything is failing: still route somewhere rather than refuse
+    if not usable:
+        return None
+
+    within_budget = [c for c in usable if c["latency_s"] <= latency_budget]
+    if within_budget:
+        best = min(within_budget, key=lambda c: (c["cost_usd"], c["latency_s"]))
+        reason = f"cheapest of {len(within_budget)} model(s) expected within {latency_budget:.0f}s"
+    else:
+        best = min(usable, key=lambda c: (c["latency_s"], c["cost_usd"]))
+        reason = f"no model expected within {latency_budget:.0f}s; using the fastest"
+    logging.info(f"Router: {provider} {best['model']} ({reason}; ~{best['latency_s']}s, ~${best['cost_usd']}).")
+    return RouteDecision(provider, best["model"], best["latency_s"], best["cost_usd"], reason, candidates)
@@ -0,0 +1,28 @@
+import importlib
+import logging
+import sys
+import time
+from .metrics import record_import
+
+# --- Lazy Provider SDK Imports ---
+# The provider SDKs (and what they pull in: grpc, protobuf, httpx, pydantic) take seconds to import on
+# small instances, and most sessions only ever use one provider. They are imported on first use
+# instead of when app.py starts, and each first import is timed for the performance panel.
+
+def load(name):
+    """Imports a module on first use (timing that import) and returns it."""
+    first_import = name not in sys.modules
+    started = time.perf_counter()
+    module = importlib.import_module(name) # Waits if another thread is importing it right now
+    if first_import:
+        seconds = time.perf_counter() - started
+        record_import(name, seconds)
+        logging.info(f"Imported {name} on first use in {seconds:.2f}s.")
+    return module
+
+def loaded(name):
+    """Returns the module if it has already been imported, else None (never imports it).
+
+    For exception handling: an exception can only come from an SDK that was already loaded.
+    """
+    return sys.modules.get(name)
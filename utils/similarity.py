@@ -0,0 +1,268 @@
+import itertools
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+import numpy as np
+from PIL import Image
+from .config import SIMILARITY_DB_PATH, SIMILARITY_MAX_DISTANCE, SIMILARITY_INDEX_CHUNKS, SIMILARITY_MAX_MATCHES, CACHE_MAX_AGE
+from .memory import reserve_memory
+from .metrics import timed
+from .preprocessing import open_image, estimate_decode_memory
+
+# --- Perceptual Hashes ---
+# Two 64-bit fingerprints that barely change when a page is re-captured at another scroll offset,
+# slightly cropped or re-compressed, unlike the byte hash of the result cache:
+#   pHash: signs of the low-frequency DCT coefficients of a 32x32 grayscale copy (vs. their median),
+#   dHash: whether each pixel of a 9x8 grayscale copy is brighter than its right-hand neighbour.
+# Screenshots match when both hashes are within SIMILARITY_MAX_DISTANCE differing bits.
+_PHASH_SIZE = 32
+_HASH_SIDE = 8 # 8x8 = 64 bits
+
+def _dct_matrix(n):
+    """Orthonormal DCT-II matrix; D @ x @ D.T is the 2-D DCT of an n x n block."""
+    k = np.arange(n)[:, None]
+    matrix = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix.astype(np.float32)
+
+_DCT = _dct_matrix(_PHASH_SIZE)
+
+def _pack_bits(bits):
+    """Packs 64 booleans into an int (first bit most significant)."""
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+def perceptual_hashes(img_bytes):
+    """Returns (phash, dhash, (width, height)) of an encoded image.
+
+    JPEGs are decoded at reduced size, other formats in full: callers hold estimate_decode_memory()
+    of the process memory budget while it runs.
+    """
+    with open_image(img_bytes) as img:
+        size = img.size
+        img.draft("L", (_PHASH_SIZE * 2, _PHASH_SIZE * 2)) # JPEG: decode straight to a small grayscale image
+        gray = img.convert("L")
+    small = gray.resize((_PHASH_SIZE, _PHASH_SIZE), Image.Resampling.BILINEAR, reducing_gap=2.0)
+    pixels = np.asarray(small, dtype=np.float32)
+    coefficients = (_DCT @ pixels @ _DCT.T)[:_HASH_SIDE, :_HASH_SIDE]
+    median = np.median(coefficients.ravel()[1:]) # The DC term is overall brightness, not structure
+    phash = _pack_bits(coefficients > median)
+    tiny = np.asarray(small.resize((_HASH_SIDE + 1, _HASH_SIDE), Image.Resampling.BILINEAR), dtype=np.int16)
+    dhash = _pack_bits(tiny[:, 1:] > tiny[:, :-1])
+    return phash, dhash, size
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+_BYTE_POPCOUNTS = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+def _popcount(values):
+    """Set bits of each uint64 in an array; np.bitwise_count only exists from NumPy 2.0."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return _BYTE_POPCOUNTS[np.ascontiguousarray(values).view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.uint8)
+
+# --- Nearest-Neighbour Index ---
+_TAIL_LIMIT = 4096 # Hashes added since the tables were last sorted; scanned directly until then
+
+class MultiIndexHash:
+    """Finds 64-bit hashes within a Hamming radius without scanning them all (multi-index hashing).
+
+    Each hash is split into `chunks` parts (of at most 16 bits), and each part has a table of row
+    numbers bucketed by part value. Two hashes within distance r differ by at most r // chunks bits
+    in at least one part (pigeonhole). So only the buckets within that many bits of the query's
+    parts are read, all at once with NumPy indexing. The few candidates found this way are checked
+    with a vectorized popcount.
+    """
+
+    def __init__(self, chunks=SIMILARITY_INDEX_CHUNKS):
+        self.chunks = chunks
+        self.chunk_bits = 64 // chunks
+        self._phashes = np.zeros(1024, dtype=np.uint64)
+        self._dhashes = np.zeros(1024, dtype=np.uint64)
+        # Per chunk, rows [0, _sorted) bucketed by part value: the rows of value v are rows[offsets[v]:offsets[v + 1]].
+        self._bucket_offsets = [np.zeros((1 << self.chunk_bits) + 1, dtype=np.int64)] * chunks
+        self._bucket_rows = [np.zeros(0, dtype=np.int64)] * chunks
+        self._sorted = 0
+        self._probes = {} # radius -> XOR masks with at most that many bits set
+        self.size = 0
+
+    def add(self, phash, dhash):
+        """Adds a pair of hashes and returns its row number."""
+        row = self.size
+        if row == len(self._phashes): # Doubling keeps appends amortised O(1)
+            self._phashes = np.concatenate([self._phashes, np.zeros_like(self._phashes)])
+            self._dhashes = np.concatenate([self._dhashes, np.zeros_like(self._dhashes)])
+        self._phashes[row], self._dhashes[row] = phash, dhash
+        self.size += 1
+        return row
+
+    def _sort(self):
+        mask = np.uint64((1 << self.chunk_bits) - 1)
+        phashes = self._phashes[:self.size]
+        for i in range(self.chunks):
+            parts = ((phashes >> np.uint64(i * self.chunk_bits)) & mask).astype(np.int64)
+            self._bucket_rows[i] = np.argsort(parts, kind="stable")
+            self._bucket_offsets[i] = np.concatenate([[0], np.cumsum(np.bincount(parts, minlength=1 << self.chunk_bits))])
+        self._sorted = self.size
+
+    def _masks(self, radius):
+        if radius not in self._probes:
+            self._probes[radius] = np.array([
+                sum(1 << bit for bit in bits)
+                for count in range(radius + 1)
+                for bits in itertools.combinations(range(self.chunk_bits), count)
+            ], dtype=np.int64)
+        return self._probes[radius]
+
+    def search(self, phash, dhash, max_distance):
+        """Returns [(row, phash_distance, dhash_distance)] of entries with both distances <= max_distance, closest first."""
+        if self.size - self._sorted > _TAIL_LIMIT: # Sorted lazily, so a bulk load sorts once
+            self._sort()
+        masks = self._masks(max_distance // self.chunks)
+        candidates = [np.arange(self._sorted, self.size)]
+        for i in range(self.chunks):
+            probes = ((phash >> (i * self.chunk_bits)) & ((1 << self.chunk_bits) - 1)) ^ masks
+            low = self._bucket_offsets[i][probes]
+            counts = self._bucket_offsets[i][probes + 1] - low
+            total = int(counts.sum())
+            if total: # Positions low[j] .. low[j] + counts[j] of every probed bucket, concatenated
+                offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+                candidates.append(self._bucket_rows[i][np.repeat(low, counts) + offsets])
+        rows = np.concatenate(candidates) # A row found through several parts is only kept once, below
+        phash_distances = _popcount(self._phashes[rows] ^ np.uint64(phash))
+        dhash_distances = _popcount(self._dhashes[rows] ^ np.uint64(dhash))
+        close = (phash_distances <= max_distance) & (dhash_distances <= max_distance)
+        rows, first = np.unique(rows[close], return_index=True)
+        phash_distances, dhash_distances = phash_distances[close][first], dhash_distances[close][first]
+        order = np.lexsort((dhash_distances, phash_distances))
+        return [(int(row), int(p), int(d)) for row, p, d in zip(rows[order], phash_distances[order], dhash_distances[order])]
+
+# --- Persistent Screenshot Index ---
+# One row per cached full-page result; the in-memory index is built from the table on first use
+# and picks up rows added by other processes (the HTTP service, batch runs) on every lookup.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS screenshots (
+    key TEXT PRIMARY KEY, -- Result cache key of the generated HTML
+    phash INTEGER NOT NULL,
+    dhash INTEGER NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    provider TEXT NOT NULL,
+    model TEXT NOT NULL,
+    created REAL NOT NULL
+)
+"""
+
+@dataclass
+class SimilarResult:
+    """A previously generated page whose screenshot looks like the one being looked up."""
+    cache_key: str
+    provider: str
+    model_id: str
+    created: float
+    size: tuple # (width, height) of the earlier screenshot
+    distance: int # Differing pHash bits (of 64)
+    dhash_distance: int
+
+_lock = threading.Lock()
+_index = None # MultiIndexHash, built on first use
+_entries = [] # Row -> (cache key, provider, model, created, (width, height))
+_last_rowid = 0
+
+def _connect():
+    os.makedirs(os.path.dirname(SIMILARITY_DB_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(SIMILARITY_DB_PATH, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(_SCHEMA)
+    return conn
+
+def _to_signed(value):
+    """SQLite integers are signed 64-bit."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+def _sync_locked():
+    """Loads rows added since the last sync (all of them on first use)."""
+    global _index, _last_rowid
+    if _index is None:
+        _index = MultiIndexHash()
+    try:
+        conn = _connect()
+        try:
+            rows = conn.execute(
+                "SELECT rowid, key, phash, dhash, width, height, provider, model, created FROM screenshots WHERE rowid > ? ORDER BY rowid",
+                (_last_rowid,)
+            ).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logging.warning(f"Similarity index read failed: {e}")
+        return
+    for rowid, key, phash, dhash, width, height, provider, model, created in rows:
+        _last_rowid = rowid
+        _index.add(phash & ((1 << 64) - 1), dhash & ((1 << 64) - 1))
+        _entries.append((key, provider, model, created, (width, height)))
+
+def index_screenshot(img_bytes, cache_key, provider, model_id, stats=None):
+    """Remembers the screenshot behind a cached result, so similar uploads can reuse it."""
+    if stats is None:
+        stats = {}
+    try:
+        with timed(stats, "similarity_index"):
+            phash, dhash, (width, height) = perceptual_hashes(img_bytes)
+            conn = _connect()
+            try:
+                with conn:
+                    conn.execute(
+                        "INSERT OR IGNORE INTO screenshots (key, phash, dhash, width, height, provider, model, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (cache_key, _to_signed(phash), _to_signed(dhash), width, height, provider, model_id, time.time())
+                    )
+            finally:
+                conn.close()
+    except (OSError, ValueError, sqlite3.Error) as e: # Never fails the generation it belongs to
+        logging.warning(f"Could not index the screenshot for similarity lookups: {e}")
+
+def find_similar(img_bytes, max_distance=SIMILARITY_MAX_DISTANCE, limit=SIMILARITY_MAX_MATCHES, stats=None):
+    """Returns up to `limit` SimilarResult for earlier screenshots within `max_distance` bits, closest first.
+
+    Results older than the result cache keeps them are skipped. Timings go to stats["timings"]
+    ("similarity_hash" for decoding and hashing, "similarity_search" for the lookup itself).
+    """
+    if stats is None:
+        stats = {}
+    with reserve_memory(estimate_decode_memory(img_bytes)), timed(stats, "similarity_hash"):
+        phash, dhash, _ = perceptual_hashes(img_bytes)
+    with _lock:
+        _sync_locked()
+        with timed(stats, "similarity_search"):
+            matches = _index.search(phash, dhash, max_distance)
+        entries = [(_entries[row], distance, dhash_distance) for row, distance, dhash_distance in matches]
+    oldest = time.time() - CACHE_MAX_AGE
+    return [
+        SimilarResult(key, provider, model, created, size, distance, dhash_distance)
+        for (key, provider, model, created, size), distance, dhash_distance in entries
+        if created >= oldest
+    ][:limit]
+
+def get_index_size():
+    """Returns the number of indexed screenshots."""
+    with _lock:
+        _sync_locked()
+        return _index.size
+
+def clear_similarity_index():
+    """Forgets every indexed screenshot (used along with clearing the result cache)."""
+    global _index, _entries, _last_rowid
+    with _lock:
+        try:
+            conn = _connect()
+            try:
+                with conn:
+                    conn.execute("DELETE FROM screenshots")
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logging.warning(f"Similarity index clear failed: {e}")
+        _index, _entries, _last_rowid = None, [], 0 # Row IDs start over in an emptied table
@@ -0,0 +1,216 @@
+import io
+import logging
+import re
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from .config import SITE_MAX_WORKERS, SITE_STYLESHEET_NAME, SITE_COMPONENTS_NAME
+from .prompts import SITE_DESIGN_SYSTEM_PROMPT, SITE_PAGE_PROMPT_TEMPLATE
+from .generation import generate_code_from_image
+from .metrics import timed, record_generation
+from .tiling import split_css_rules, normalize_css_rule, extract_stylesheets, replace_stylesheets, extract_body
+
+# --- Multi-page Site Cloning ---
+# Pages of one site share their header, footer, palette and typography. Instead of having the model
+# re-derive (and pay output tokens for) them on every page, the first screenshot is turned into a
+# shared stylesheet plus a component library once; every page is then generated in parallel against
+# it, with a <style> block only for what is unique to that page.
+_COMPONENT_RE = re.compile(r"<!--\s*component:\s*([\w .-]+?)\s*-->", re.IGNORECASE)
+_STYLESHEET_LINK_RE = re.compile(r"<link\b[^>]*href=[\"']" + re.escape(SITE_STYLESHEET_NAME) + r"[\"'][^>]*>", re.IGNORECASE)
+_HEAD_CLOSE_RE = re.compile(r"</head\s*>", re.IGNORECASE)
+_FILE_NAME_RE = re.compile(r"[^A-Za-z0-9._-]+")
+
+@dataclass
+class DesignSystem:
+    """The shared stylesheet and component library of a site."""
+    css: str
+    components: dict # component name -> HTML snippet, in the model's order
+    stats: dict = field(default_factory=dict)
+
+@dataclass
+class SitePage:
+    name: str # File name in the bundle, e.g. "pricing.html"
+    html: str = None # Links SITE_STYLESHEET_NAME; see inline_stylesheet() for a single-file version
+    error: str = None
+    stats: dict = field(default_factory=dict)
+
+@dataclass
+class SiteBundle:
+    design: DesignSystem
+    pages: list # SitePage per screenshot, in input order
+
+    def files(self):
+        """Returns {path: text} of the multi-file bundle: the stylesheet, the component library and every page."""
+        files = {SITE_STYLESHEET_NAME: self.design.css, SITE_COMPONENTS_NAME: render_component_library(self.design)}
+        files.update((page.name, page.html) for page in self.pages if page.html)
+        return files
+
+def page_file_name(label, taken):
+    """Turns an upload name into a unique, filesystem-safe HTML file name."""
+    stem = _FILE_NAME_RE.sub("-", (label or "page").rsplit(".", 1)[0]).strip("-.") or "page"
+    name, suffix = f"{stem}.html", 2
+    while name in taken or name in (SITE_STYLESHEET_NAME, SITE_COMPONENTS_NAME):
+        name, suffix = f"{stem}-{suffix}.html", suffix + 1
+    taken.add(name)
+    return name
+
+def parse_design_system(html):
+    """Splits the design-system document into its stylesheet and its `<!-- component: name -->` snippets."""
+    css = "\n".join(block.strip() for block in extract_stylesheets(html))
+    body = extract_body(html) or ""
+    components = {}
+    markers = list(_COMPONENT_RE.finditer(body))
+    for marker, next_marker in zip(markers, markers[1:] + [None]):
+        snippet = body[marker.end():next_marker.start() if next_marker else len(body)].strip()
+        if snippet:
+            components[marker.group(1).strip().lower()] = snippet
+    return DesignSystem(css, components)
+
+def render_component_library(design):
+    """Returns components.html: every shared component on one page, styled by the linked stylesheet."""
+    sections = "\n".join(f"<!-- component: {name} -->\n{snippet}" for name, snippet in design.components.items())
+    return (
+        "<!DOCTYPE html>\n<html lang=\"en\">\n<head>\n<meta charset=\"UTF-8\">\n"
+        "<meta name=\"viewport\" content=\"width=device-width, initial-scale=1.0\">\n"
+        f"<title>Components</title>\n<link rel=\"stylesheet\" href=\"{SITE_STYLESHEET_NAME}\">\n</head>\n<body>\n"
+        f"{sections}\n</body>\n</html>"
+    )
+
+def link_shared_stylesheet(html, shared_css):
+    """Makes a generated page reference the shared stylesheet instead of restating it.
+
+    Rules the page repeats from the shared stylesheet (ignoring whitespace) are dropped, and the
+    <link> is added if the model left it out.
+    """
+    shared_rules = {normalize_css_rule(rule) for rule in split_css_rules(shared_css)}
+
+    def own_rules(css):
+        rules = [rule for rule in split_css_rules(css) if normalize_css_rule(rule) not in shared_rules]
+        return f"<style>\n{chr(10).join(rules)}\n</style>" if rules else ""
+
+    html = replace_stylesheets(html, own_rules)
+    if not _STYLESHEET_LINK_RE.search(html):
+        link = f"<link rel=\"stylesheet\" href=\"{SITE_STYLESHEET_NAME}\">\n"
+        head_close = _HEAD_CLOSE_RE.search(html)
+        html = html[:head_close.start()] + link + html[head_close.start():] if head_close else link + html
+    return html
+
+def inline_stylesheet(html, shared_css):
+    """Returns a single-file version of a site page, with the shared stylesheet in place of its <link>."""
+    return _STYLESHEET_LINK_RE.sub(lambda _: f"<style>\n{shared_css}\n</style>", html, count=1)
+
+def build_site_archive(bundle, inline=False):
+    """Returns a ZIP of the bundle: the multi-file site, or (inline=True) one self-contained file per page."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        if inline:
+            for page in bundle.pages:
+                if page.html:
+                    archive.writestr(page.name, inline_stylesheet(page.html, bundle.design.css))
+        else:
+            for path, text in bundle.files().items():
+                archive.writestr(path, text)
+    return buffer.getvalue()
+
+def generate_design_system(provider, api_key, model_id_to_use, img_bytes, use_cache=True, preprocess=True, rate_limiter=None, hedge_model=None):
+    """Generates the shared stylesheet and component library from one page. Returns (DesignSystem, error_message)."""
+    stats = {}
+    html, error = generate_code_from_image(
+        provider, api_key, model_id_to_use, img_bytes, use_cache=use_cache, preprocess=preprocess,
+        stats=stats, rate_limiter=rate_limiter, prompt=SITE_DESIGN_SYSTEM_PROMPT, hedge_model=hedge_model
+    )
+    if error or not html:
+        return None, error or "No design system received."
+    design = parse_design_system(html)
+    design.stats = stats
+    if not design.css.strip():
+        return None, f"{provider}: The design system has no stylesheet."
+    logging.info(f"{provider}: Design system with {len(design.css)} characters of CSS and components {list(design.components)}.")
+    return design, None
+
+def generate_site_pages(provider, api_key, model_id_to_use, design, pages, use_cache=True, preprocess=True, rate_limiter=None, hedge_model=None):
+    """Generates every page against the shared design system, in parallel.
+
+    `pages` is a list of (name, img_bytes). Returns a SitePage per input, in order.
+    """
+    prompt = SITE_PAGE_PROMPT_TEMPLATE.format(
+        stylesheet=SITE_STYLESHEET_NAME, css=design.css,
+        components="\n".join(f"<!-- component: {name} -->\n{snippet}" for name, snippet in design.components.items()) or "(none)"
+    )
+
+    def generate_page(name, page_bytes):
+        page = SitePage(name)
+        page.html, page.error = generate_code_from_image(
+            provider, api_key, model_id_to_use, page_bytes, use_cache=use_cache, preprocess=preprocess,
+            stats=page.stats, rate_limiter=rate_limiter, prompt=prompt, hedge_model=hedge_model
+        )
+        if page.html:
+            with timed(page.stats, "postprocess"):
+                page.html = link_shared_stylesheet(page.html, design.css)
+        return page
+
+    if not pages:
+        return []
+    with ThreadPoolExecutor(max_workers=min(SITE_MAX_WORKERS, len(pages))) as pool:
+        futures = [pool.submit(generate_page, name, page_bytes) for name, page_bytes in pages]
+        return [future.result() for future in futures]
+
+def generate_site(provider, api_key, model_id_to_use, pages, use_cache=True, preprocess=True, stats=None, rate_limiter=None, hedge_model=None):
+    """Clones several pages of one site: a shared design system first, then all pages in parallel.
+
+    `pages` is a list of (label, img_bytes); the first one should show the site's header and footer, as
+    the design system is derived from it. Returns (SiteBundle, error_message); pages that failed keep
+    their error in the bundle, and the call only fails if the design system or every page did.
+    """
+    if stats is None:
+        stats = {}
+    if not pages:
+        return None, "No pages to generate."
+    started = time.monotonic()
+    design, error = generate_design_system(
+        provider, api_key, model_id_to_use, pages[0][1], use_cache=use_cache, preprocess=preprocess,
+        rate_limiter=rate_limiter, hedge_model=hedge_model
+    )
+    if error:
+        error_message = f"Design system generation failed: {error}"
+        logging.error(error_message)
+        stats["provider_latency_s"] = time.monotonic() - started
+        record_generation(provider, model_id_to_use, stats, None, error_message, kind="site")
+        return None, error_message
+    design_latency = time.monotonic() - started
+
+    taken = set()
+    site_pages = generate_site_pages(
+        provider, api_key, model_id_to_use, design,
+        [(page_file_name(label, taken), page_bytes) for label, page_bytes in pages],
+        use_cache=use_cache, preprocess=preprocess, rate_limiter=rate_limiter, hedge_model=hedge_model
+    )
+    stats["provider_latency_s"] = time.monotonic() - started
+    for call_stats in [design.stats] + [page.stats for page in site_pages]:
+        for key in ("prompt_tokens", "completion_tokens"):
+            if call_stats.get(key):
+                stats[key] = stats.get(key, 0) + call_stats[key]
+    stats["site"] = {
+        "pages": len(site_pages),
+        "failed": sum(1 for page in site_pages if not page.html),
+        "shared_css_bytes": len(design.css.encode("utf-8")),
+        "components": list(design.components),
+        "design": {
+            "latency_s": design_latency, "cache_hit": bool(design.stats.get("cache_hit")),
+            "prompt_tokens": design.stats.get("prompt_tokens"), "completion_tokens": design.stats.get("completion_tokens"),
+        },
+    }
+    bundle = SiteBundle(design, site_pages)
+    if not any(page.html for page in site_pages):
+        error_message = f"{provider}: Every page failed: {site_pages[0].error or 'No HTML content received.'}"
+        logging.error(error_message)
+        record_generation(provider, model_id_to_use, stats, None, error_message, kind="site")
+        return None, error_message
+    logging.info(
+        f"{provider}: Site of {len(site_pages)} pages generated in {stats['provider_latency_s']:.1f}s "
+        f"(design system {design_latency:.1f}s, {stats['site']['failed']} page(s) failed)."
+    )
+    first_page = next(page for page in site_pages if page.html)
+    record_generation(provider, model_id_to_use, stats, inline_stylesheet(first_page.html, design.css), None, kind="site")
+    return bundle, None
@@ -0,0 +1,429 @@
+"""Local stand-in for an OpenAI-compatible chat-completions endpoint.
+
+Used by benchmark.py to measure the app without network or API costs, and handy for offline
+development: start it with `python -m utils.stub_server --port 8400` and set
+OPENAI_BASE_URL=http://127.0.0.1:8400/v1 before launching the app.
+
+Three modes:
+- synthetic (default): canned HTML of a configurable size (or the equivalent layout tree for
+  JSON-mode requests), with configurable latency, streaming chunk rate and injected errors;
+- record: forwards requests to a real upstream API and appends each response to a cassette file;
+- replay: serves responses from a cassette, keyed by request content (falling back to cassette order).
+"""
+import argparse
+import hashlib
+import json
+import logging
+import random
+import sys
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from .config import STUB_DEFAULT_MODELS
+
+@dataclass
+class StubConfig:
+    latency_s: float = 0.5 # Time to first token
+    jitter_s: float = 0.0 # Uniform random extra latency, 0..jitter_s
+    chunk_chars: int = 64 # Characters per streamed delta
+    chunks_per_second: float = 200.0 # Generation speed; 0 streams as fast as possible
+    error_rate: float = 0.0 # Fraction of requests answered with error_status
+    error_status: int = 503
+    retry_after_ms: int = 50 # Sent with injected errors so client retries do not dominate timings
+    html_bytes: int = 20_000 # Size of the canned HTML document
+    fenced: bool = False # Wrap the HTML in a ```html block, like chattier models do
+    trailing_text: str = "" # Commentary after the document, e.g. "Hope this helps!"
+    max_output_chars: int = 0 # Cut replies off with finish_reason "length" after this many characters (0 = never)
+    seed: int = 0
+    upstream: str = None # Record mode: real API base URL to forward to
+    cassette_path: str = None # Record mode: file appended to; replay mode: file served from
+    replay: bool = False
+    replay_timing: bool = True # Replay with the recorded delays (False = as fast as possible)
+
+def make_canned_html(size_bytes):
+    """Returns a self-contained HTML page of roughly `size_bytes` bytes."""
+    head = (
+        "<!DOCTYPE html>\n<html lang=\"en\">\n<head>\n<meta charset=\"UTF-8\">\n<title>Stub Clone</title>\n"
+        "<style>\nbody { margin: 0; font-family: Arial, sans-serif; }\n"
+        ".card { padding: 16px; margin: 8px; border: 1px solid #ddd; border-radius: 8px; }\n"
+        ".card h2 { font-size: 18px; color: #222; }\n</style>\n</head>\n<body>\n"
+    )
+    tail = "</body>\n</html>"
+    sections = []
+    size = len(head) + len(tail)
+    index = 0
+    while size < size_bytes:
+        section = (
+            f"<div class=\"card\" style=\"background: #f{index % 10}f{index % 7}f{index % 5};\">"
+            f"<h2>Section {index}</h2><p>Lorem ipsum dolor sit amet, consectetur adipiscing elit, "
+            f"sed do eiusmod tempor incididunt ut labore et dolore magna aliqua.</p></div>\n"
+        )
+        sections.append(section)
+        size += len(section)
+        index += 1
+    return head + "".join(sections) + tail
+
+def make_canned_layout(size_bytes):
+    """Returns a layout tree (JSON) describing the same cards as make_canned_html(size_bytes)."""
+    cards = [
+        {"s": "card", "bg": f"#f{index % 10}f{index % 7}f{index % 5}", "c": [
+            {"s": "h", "c": f"Section {index}"},
+            {"t": "text", "c": "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore et dolore magna aliqua."},
+        ]}
+        for index in range(make_canned_html(size_bytes).count('class="card"'))
+    ]
+    return json.dumps({
+        "title": "Stub Clone",
+        "palette": {"bg": "#ffffff", "text": "#222222", "border": "#dddddd"},
+        "fonts": {"body": "16px/1.5 Arial, sans-serif", "h2": "700 18px/1.3 Arial, sans-serif"},
+        "styles": {"card": {"t": "col", "p": 16, "m": 8, "b": 1, "bc": "border", "r": 8}, "h": {"t": "text", "tag": "h2", "f": "h2"}},
+        "root": {"t": "col", "c": cards},
+    }, separators=(",", ":"))
+
+def request_key(body):
+    """Identifies a chat-completions request by its model, messages (image included) and streaming flag."""
+    canonical = json.dumps({"model": body.get("model"), "messages": body.get("messages"), "stream": bool(body.get("stream"))}, sort_keys=True)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def _split(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+def _usage(body, completion_text):
+    prompt_chars = 0
+    images = 0
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            prompt_chars += len(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                prompt_chars += len(part.get("text", ""))
+            elif part.get("type") == "image_url":
+                images += 1
+    prompt_tokens = prompt_chars // 4 + images * 765 # Roughly a 1024x768 image at high detail
+    completion_tokens = len(completion_text) // 4
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+def _apply_limits(text, body, config):
+    """Applies continuation, stop sequences and the output limit like a real API. Returns (text, finish_reason)."""
+    messages = body.get("messages") or []
+    # A continuation request carries the cut-off reply as an assistant turn: resume after it.
+    previous = [m.get("content") for m in messages if m.get("role") == "assistant" and isinstance(m.get("content"), str)]
+    if previous and text.startswith(previous[-1]):
+        text = text[len(previous[-1]):]
+    stop = body.get("stop") or []
+    for sequence in [stop] if isinstance(stop, str) else stop:
+        index = text.find(sequence)
+        if index >= 0:
+            text = text[:index] # The stop sequence itself is not returned
+    if config.max_output_chars and len(text) > config.max_output_chars:
+        return text[:config.max_output_chars], "length"
+    return text, "stop"
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive, so pooled clients reuse connections as they would upstream
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def stub(self):
+        return self.server.stub
+
+    # --- Response Helpers ---
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_chunked(self, status=200, content_type="text/event-stream"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    # --- Routes ---
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            created = int(time.time())
+            self._send_json(200, {"object": "list", "data": [
+                {"id": model_id, "object": "model", "created": created, "owned_by": "stub"} for model_id in STUB_DEFAULT_MODELS
+            ]})
+            return
+        self._send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw_body = self.rfile.read(length)
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+        try:
+            body = json.loads(raw_body)
+        except json.JSONDecodeError as e:
+            self._send_json(400, {"error": {"message": f"Invalid JSON body: {e}", "type": "invalid_request_error"}})
+            return
+        self.stub._count("requests")
+        config = self.stub.config
+        try:
+            if config.upstream:
+                self._proxy_and_record(raw_body, body)
+            elif config.replay:
+                self._replay(body)
+            else:
+                self._synthetic(body)
+        except (BrokenPipeError, ConnectionResetError):
+            self.stub._count("disconnects") # Client cancelled mid-stream
+            self.close_connection = True
+
+    def _synthetic(self, body):
+        config = self.stub.config
+        time.sleep(config.latency_s + self.stub._random() * config.jitter_s)
+        if config.error_rate and self.stub._random() < config.error_rate:
+            self.stub._count("errors")
+            self._send_json(
+                config.error_status,
+                {"error": {"message": "Injected error from the stub server.", "type": "server_error", "code": None}},
+                headers={"retry-after-ms": str(config.retry_after_ms)},
+            )
+            return
+        if (body.get("response_format") or {}).get("type") == "json_object":
+            text = self.stub.canned_layout # Layout mode
+        else:
+            html = self.stub.canned_html
+            text = (f"```html\n{html}\n```" if config.fenced else html) + config.trailing_text
+        text, finish_reason = _apply_limits(text, body, config)
+        chunks = _split(text, max(1, config.chunk_chars))
+        delay = 1.0 / config.chunks_per_second if config.chunks_per_second else 0.0
+        model = body.get("model", STUB_DEFAULT_MODELS[0])
+        if body.get("stream"):
+            events = [(delay if i else 0.0, delta) for i, delta in enumerate(chunks)]
+            self._stream_deltas(model, events, _usage(body, text), body, finish_reason)
+        else:
+            time.sleep(delay * max(0, len(chunks) - 1))
+            self._send_json(200, self._completion(model, text, _usage(body, text), finish_reason))
+
+    def _completion(self, model, text, usage, finish_reason="stop"):
+        return {
+            "id": f"chatcmpl-stub-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": finish_reason}],
+            "usage": usage,
+        }
+
+    def _stream_deltas(self, model, events, usage, body, finish_reason="stop"):
+        completion_id = f"chatcmpl-stub-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+
+        def event(choices, **extra):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model, "choices": choices, **extra}
+            return f"data: {json.dumps(chunk)}\n\n".encode("utf-8")
+
+        self._start_chunked()
+        self._write_chunk(event([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]))
+        for delay, delta in events:
+            if delay:
+                time.sleep(delay)
+            self._write_chunk(event([{"index": 0, "delta": {"content": delta}, "finish_reason": None}]))
+        self._write_chunk(event([{"index": 0, "delta": {}, "finish_reason": finish_reason}]))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self._write_chunk(event([], usage=usage))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._end_chunked()
+
+    # --- Record / Replay ---
+    def _proxy_and_record(self, raw_body, body):
+        config = self.stub.config
+        headers = {"Content-Type": "application/json"}
+        if self.headers.get("Authorization"):
+            headers["Authorization"] = self.headers["Authorization"]
+        started = time.monotonic()
+        entry = {"key": request_key(body), "model": body.get("model"), "stream": bool(body.get("stream"))}
+        with requests.post(f"{config.upstream.rstrip('/')}/chat/completions", data=raw_body, headers=headers, stream=True, timeout=300) as response:
+            entry["status"] = response.status_code
+            if not entry["stream"] or response.status_code != 200:
+                content = response.content
+                entry["latency_s"] = round(time.monotonic() - started, 4)
+                entry["body"] = content.decode("utf-8", errors="replace")
+                self.send_response(response.status_code)
+                self.send_header("Content-Type", response.headers.get("Content-Type", "application/json"))
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+            else:
+                # Each SSE line is stored with its delay after the previous one, so replays keep the pacing.
+                entry["lines"] = []
+                last = started
+                self._start_chunked()
+                for line in response.iter_lines():
+                    now = time.monotonic()
+                    entry["lines"].append([round(now - last, 4), line.decode("utf-8")])
+                    last = now
+                    self._write_chunk(line + b"\n")
+                self._end_chunked()
+        self.stub._append_to_cassette(entry)
+
+    def _replay(self, body):
+        config = self.stub.config
+        entry = self.stub._find_recording(request_key(body))
+        if entry is None:
+            self._send_json(404, {"error": {"message": "Cassette is empty.", "type": "invalid_request_error"}})
+            return
+        if "lines" not in entry:
+            if config.replay_timing:
+                time.sleep(entry.get("latency_s", 0.0))
+            content = entry["body"].encode("utf-8")
+            self.send_response(entry["status"])
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+            return
+        self._start_chunked()
+        for delay, line in entry["lines"]:
+            if config.replay_timing and delay:
+                time.sleep(delay)
+            self._write_chunk(line.encode("utf-8") + b"\n")
+        self._end_chunked()
+
+class StubServer:
+    """Runs the stub on a background thread. Use as a context manager, or call start()/stop()."""
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.config = config or StubConfig()
+        self.canned_html = make_canned_html(self.config.html_bytes)
+        self.canned_layout = make_canned_layout(self.config.html_bytes)
+        self.counts = {"requests": 0, "errors": 0, "disconnects": 0}
+        self._lock = threading.Lock()
+        self._rng = random.Random(self.config.seed)
+        self._recordings = []
+        self._recordings_by_key = {}
+        self._replay_position = 0
+        if self.config.replay:
+            self._load_cassette()
+        self._httpd = ThreadingHTTPServer((host, port), _StubHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.stub = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="stub-server", daemon=True)
+        self._thread.start()
+        logging.info(f"Stub server listening on {self.base_url}")
+        return self
+
+    def serve_forever(self):
+        """Serves on the calling thread until interrupted (used by the command line entry point)."""
+        try:
+            self._httpd.serve_forever()
+        finally:
+            self._httpd.server_close()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def set_html_bytes(self, html_bytes):
+        """Changes the canned response size for subsequent requests."""
+        self.config.html_bytes = html_bytes
+        self.canned_html = make_canned_html(html_bytes)
+        self.canned_layout = make_canned_layout(html_bytes)
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def _random(self):
+        with self._lock:
+            return self._rng.random()
+
+    def _load_cassette(self):
+        with open(self.config.cassette_path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._recordings.append(entry)
+                    self._recordings_by_key.setdefault(entry["key"], entry)
+        logging.info(f"Stub server: loaded {len(self._recordings)} recordings from {self.config.cassette_path}")
+
+    def _find_recording(self, key):
+        with self._lock:
+            entry = self._recordings_by_key.get(key)
+            if entry is None and self._recordings:
+                # Unknown request (e.g. a different screenshot): serve recordings in order.
+                entry = self._recordings[self._replay_position % len(self._recordings)]
+                self._replay_position += 1
+            return entry
+
+    def _append_to_cassette(self, entry):
+        with self._lock:
+            with open(self.config.cassette_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a local OpenAI-compatible chat-completions stub.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8400)
+    parser.add_argument("--latency", type=float, default=StubConfig.latency_s, help="Seconds before the first token.")
+    parser.add_argument("--jitter", type=float, default=StubConfig.jitter_s, help="Extra random latency, up to this many seconds.")
+    parser.add_argument("--chunk-chars", type=int, default=StubConfig.chunk_chars, help="Characters per streamed chunk.")
+    parser.add_argument("--chunk-rate", type=float, default=StubConfig.chunks_per_second, help="Chunks per second (0 = unthrottled).")
+    parser.add_argument("--error-rate", type=float, default=StubConfig.error_rate, help="Fraction of requests that fail.")
+    parser.add_argument("--error-status", type=int, default=StubConfig.error_status, help="HTTP status of injected failures.")
+    parser.add_argument("--html-kb", type=float, default=StubConfig.html_bytes / 1000, help="Size of the canned HTML response.")
+    parser.add_argument("--fenced", action="store_true", help="Wrap responses in a ```html code block.")
+    parser.add_argument("--trailing-text", default="", help="Commentary appended after the document.")
+    parser.add_argument("--max-output-kb", type=float, default=0, help="Cut replies off (finish_reason \"length\") after this size.")
+    parser.add_argument("--record", metavar="CASSETTE", help="Forward to --upstream and append responses to this file.")
+    parser.add_argument("--upstream", default="https://api.openai.com/v1", help="Real API base URL used with --record.")
+    parser.add_argument("--replay", metavar="CASSETTE", help="Serve responses recorded with --record.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    config = StubConfig(
+        latency_s=args.latency, jitter_s=args.jitter, chunk_chars=args.chunk_chars, chunks_per_second=args.chunk_rate,
+        error_rate=args.error_rate, error_status=args.error_status, html_bytes=int(args.html_kb * 1000), fenced=args.fenced,
+        trailing_text=args.trailing_text, max_output_chars=int(args.max_output_kb * 1000),
+        upstream=args.upstream if args.record else None, cassette_path=args.record or args.replay, replay=bool(args.replay),
+    )
+    server = StubServer(config, host=args.host, port=args.port)
+    print(f"Set OPENAI_BASE_URL={server.base_url} to use this stub. Ctrl+C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
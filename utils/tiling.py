@@ -0,0 +1,162 @@
+import io
+import re
+import logging
+import numpy as np
+from PIL import Image
+from .config import (
+    TILING_TARGET_BAND_RATIO,
+    TILING_MIN_BAND_RATIO,
+    TILING_MAX_BAND_RATIO,
+    TILING_MAX_BANDS,
+    TILING_UNIFORM_TOLERANCE
+)
+from .memory import reserve_memory
+from .preprocessing import open_image, estimate_decode_memory
+
+_ANALYSIS_WIDTH = 256 # Rows are analysed on a narrowed copy; only full-height resolution matters
+
+def _cut_candidates(img):
+    """Returns {row: score} for rows that are good places to cut the page.
+
+    Runs of uniform rows (whitespace, flat backgrounds) score by their length and are cut in the
+    middle; sharp changes in row brightness (section background changes) score as short runs.
+    """
+    width, height = img.size
+    narrow = img.convert("L").resize((min(width, _ANALYSIS_WIDTH), height), Image.BILINEAR)
+    gray = np.asarray(narrow, dtype=np.int16)
+    uniform = (gray.max(axis=1) - gray.min(axis=1)) <= TILING_UNIFORM_TOLERANCE
+
+    candidates = {}
+    # Boundaries of uniform runs: +1 where a run starts, -1 just past where it ends.
+    edges = np.diff(np.concatenate(([0], uniform.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    for start, end in zip(starts, ends):
+        candidates[int((start + end) // 2)] = int(end - start)
+
+    row_mean = gray.mean(axis=1)
+    jumps = np.flatnonzero(np.abs(np.diff(row_mean)) > 32) + 1
+    for row in jumps:
+        candidates.setdefault(int(row), 1)
+    return candidates
+
+def find_band_boundaries(img, target_ratio=TILING_TARGET_BAND_RATIO, max_bands=TILING_MAX_BANDS):
+    """Returns [(top, bottom), ...] horizontal bands covering the whole image.
+
+    Bands aim for `target_ratio` times the image width in height, and there are at most `max_bands`.
+    """
+    width, height = img.size
+    target = max(1, int(width * target_ratio))
+    if height / target > max_bands:
+        target = -(-height // max_bands)
+    min_band = max(1, int(target * TILING_MIN_BAND_RATIO / TILING_TARGET_BAND_RATIO))
+    max_band = max(min_band + 1, int(target * TILING_MAX_BAND_RATIO / TILING_TARGET_BAND_RATIO))
+
+    candidates = sorted(_cut_candidates(img).items())
+    bands = []
+    top = 0
+    while height - top > max_band:
+        window = [(row, score) for row, score in candidates if top + min_band <= row <= top + max_band]
+        if window:
+            # Prefer the longest whitespace run, then the cut closest to the target height.
+            cut = max(window, key=lambda c: (c[1], -abs(c[0] - (top + target))))[0]
+        else:
+            cut = top + target
+        bands.append((top, cut))
+        top = cut
+    bands.append((top, height))
+    return bands
+
+def crop_band(img, top, bottom):
+    """Returns rows top..bottom of an image as PNG bytes."""
+    buf = io.BytesIO()
+    img.crop((0, top, img.width, bottom)).save(buf, format="PNG")
+    return buf.getvalue()
+
+def split_into_bands(img_bytes, **boundary_options):
+    """Splits a screenshot into horizontal bands. Returns ([(top, bottom, png_bytes), ...], page_width).
+
+    The decoded screenshot is held in the process memory budget and freed before returning, so
+    call it before, not inside, the generation requests for the bands.
+    """
+    with reserve_memory(estimate_decode_memory(img_bytes)):
+        with open_image(img_bytes) as src:
+            img = src.convert("RGB")
+        bands = [(top, bottom, crop_band(img, top, bottom)) for top, bottom in find_band_boundaries(img, **boundary_options)]
+    logging.info(f"Split {img.width}x{img.height} screenshot into {len(bands)} bands: {[(t, b) for t, b, _ in bands]}")
+    return bands, img.width
+
+# --- Stitching ---
+_STYLE_RE = re.compile(r"<style[^>]*>(.*?)</style>", re.DOTALL | re.IGNORECASE)
+_BODY_RE = re.compile(r"<body[^>]*>(.*)</body>", re.DOTALL | re.IGNORECASE)
+_TITLE_RE = re.compile(r"<title[^>]*>(.*?)</title>", re.DOTALL | re.IGNORECASE)
+_CSS_COMMENT_RE = re.compile(r"/\*.*?\*/", re.DOTALL)
+
+def split_css_rules(css):
+    """Splits a stylesheet into top-level rules (at-rule blocks such as @media stay whole)."""
+    css = _CSS_COMMENT_RE.sub("", css)
+    rules = []
+    depth = 0
+    start = 0
+    for i, ch in enumerate(css):
+        if ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                rules.append(css[start:i + 1].strip())
+                start = i + 1
+        elif ch == ";" and depth == 0:
+            # Block-less at-rules such as @import or @charset
+            rules.append(css[start:i + 1].strip())
+            start = i + 1
+    return [rule for rule in rules if rule]
+
+def normalize_css_rule(rule):
+    """Returns a rule with insignificant whitespace removed, for comparing rules."""
+    return re.sub(r"\s+", " ", rule).replace(" {", "{").replace("{ ", "{").replace("; ", ";").replace(" }", "}")
+
+def extract_stylesheets(html):
+    """Returns the contents of every <style> block of a document, in order."""
+    return _STYLE_RE.findall(html)
+
+def replace_stylesheets(html, replace):
+    """Replaces every <style> block by replace(css); an empty string removes the block."""
+    return _STYLE_RE.sub(lambda match: replace(match.group(1)), html)
+
+def extract_body(html):
+    """Returns the contents of the <body> element, or None if the document has none."""
+    match = _BODY_RE.search(html)
+    return match.group(1) if match else None
+
+def merge_css(stylesheets):
+    """Concatenates stylesheets, dropping rules that are repeated verbatim (ignoring whitespace).
+
+    Only the last copy of a repeated rule is kept, so the cascade order of the input is preserved.
+    """
+    rules = [rule for css in stylesheets for rule in split_css_rules(css)]
+    last_index = {normalize_css_rule(rule): index for index, rule in enumerate(rules)}
+    return "\n".join(rule for index, rule in enumerate(rules) if last_index[normalize_css_rule(rule)] == index)
+
+def stitch_fragments(fragments):
+    """Combines per-band HTML documents into one page with a single merged <style> block."""
+    stylesheets = []
+    bodies = []
+    title = None
+    for index, html in enumerate(fragments, start=1):
+        stylesheets.extend(extract_stylesheets(html))
+        body = extract_body(html)
+        if body is None:
+            body = replace_stylesheets(html, lambda css: "")
+        bodies.append(f"<!-- Section {index} -->\n{body.strip()}")
+        if title is None:
+            title_match = _TITLE_RE.search(html)
+            if title_match:
+                title = title_match.group(1).strip()
+    return (
+        "<!DOCTYPE html>\n<html lang=\"en\">\n<head>\n<meta charset=\"UTF-8\">\n"
+        "<meta name=\"viewport\" content=\"width=device-width, initial-scale=1.0\">\n"
+        f"<title>{title or 'Cloned Page'}</title>\n<style>\n{merge_css(stylesheets)}\n</style>\n</head>\n<body>\n"
+        + "\n".join(bodies)
+        + "\n</body>\n</html>"
+    )